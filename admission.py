@@ -0,0 +1,304 @@
+"""Admission control for /api/chat: in-flight caps, a bounded wait queue and Retry-After.
+
+Each chat request takes a slot for as long as it streams. A request is
+admitted at once while fewer than `max_in_flight` are streaming; otherwise
+it waits in a FIFO queue of at most `queue_size` requests for up to
+`queue_timeout` seconds, being told its position as it moves up. With
+`per_client` set, a client (known API key, or IP address) may hold at most that
+many slots and queue places together. Requests beyond that are rejected
+straight away:
+
+    429  the client already has per_client requests in flight or queued
+    503  the queue is full
+
+both with a Retry-After estimated from recent stream durations. A request
+that reaches the front of the queue too late gets an in-stream error (the
+SSE response has already started by then).
+
+The per-client limit is off by default. Behind a proxy (Render's, for one)
+every request comes from the proxy's address, so keying by IP only tells
+clients apart with ADMISSION_TRUST_PROXY on; API keys always do, but only
+those listed in ADMISSION_API_KEYS. The app does not otherwise check
+X-API-Key, so any other value is ignored: a client sending a fresh random
+key with each request would otherwise never reach its limit.
+
+The in-flight and queue limits default by server mode (see size_for). On
+gunicorn's threaded worker a queued request still holds a thread, so half
+the worker's threads stream and all but one of the rest may wait: the
+spare thread is what answers rejections quickly. On the event loop
+(asgi.py) a stream is a coroutine, so the limits are far higher. All
+limits are per worker process.
+
+Configured from the environment (see AdmissionControl.from_env):
+    ADMISSION_MAX_IN_FLIGHT   concurrent chat streams per worker (default by server mode:
+                              half the threads, or 256 on asgi; 0 = unlimited)
+    ADMISSION_PER_CLIENT      in-flight + queued requests per client (default 0, off)
+    ADMISSION_QUEUE_SIZE      requests allowed to wait (default by server mode: the
+                              threads left but one, or 256 on asgi)
+    ADMISSION_QUEUE_TIMEOUT   seconds a request may wait for a slot (default 15)
+    ADMISSION_TRUST_PROXY     "true" to key clients by X-Forwarded-For (behind a proxy)
+    ADMISSION_API_KEYS        comma-separated X-API-Key values that identify a client
+                              (default none: the header is ignored)
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+POSITION_INTERVAL = 0.5  # how often a waiting request re-reports its queue position
+DEFAULT_THREADS = 8  # the Procfile's --threads, until gunicorn.conf.py says otherwise
+ASGI_MAX_IN_FLIGHT = 256
+ASGI_QUEUE_SIZE = 256
+
+
+class Rejected(Exception):
+    """A request refused admission, with the HTTP status and Retry-After to send."""
+
+    def __init__(self, status, code, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.retry_after = retry_after
+
+    def body(self):
+        return {"error": str(self), "code": self.code, "retry_after": self.retry_after}
+
+
+class Ticket:
+    """One request's claim on a slot; release() it when the stream ends (idempotent)."""
+
+    __slots__ = ("control", "client", "admitted", "released", "enqueued", "started", "_event", "_waker")
+
+    def __init__(self, control, client):
+        self.control = control
+        self.client = client
+        self.admitted = False
+        self.released = False
+        self.enqueued = time.monotonic()
+        self.started = None
+        self._event = threading.Event()
+        self._waker = None  # set by the async waiter: wakes it from any thread
+
+    @property
+    def queued(self):
+        return not self.admitted and not self.released
+
+    def _grant(self):
+        self.admitted = True
+        self.started = time.monotonic()
+        self._event.set()
+        if self._waker is not None:
+            self._waker()
+
+    def wait(self):
+        """Blocks until admitted, yielding the queue position whenever it changes.
+
+        Raises Rejected once the queue timeout passes.
+        """
+        deadline = self.enqueued + self.control.queue_timeout
+        last = None
+        while not self.admitted:
+            position = self.control.position(self)
+            if position != last:
+                last = position
+                yield position
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.control.abandon(self)
+                if self.admitted:  # granted in the meantime
+                    return
+                raise self.control.timed_out()
+            self._event.wait(min(POSITION_INTERVAL, remaining))
+
+    async def await_slot(self):
+        """Async twin of wait()."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        self._waker = lambda: loop.call_soon_threadsafe(event.set)
+        if self.admitted:
+            return
+        deadline = self.enqueued + self.control.queue_timeout
+        last = None
+        while not self.admitted:
+            position = self.control.position(self)
+            if position != last:
+                last = position
+                yield position
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.control.abandon(self)
+                if self.admitted:
+                    return
+                raise self.control.timed_out()
+            try:
+                await asyncio.wait_for(event.wait(), min(POSITION_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self):
+        self.control.release(self)
+
+
+class AdmissionControl:
+    """Per-worker admission state (thread-safe)."""
+
+    def __init__(self, max_in_flight=None, per_client=0, queue_size=None, queue_timeout=15.0, trust_proxy=False,
+                 api_keys=()):
+        self.limits = (max_in_flight, queue_size)  # as configured; None is sized by size_for
+        self.per_client = per_client
+        self.queue_timeout = queue_timeout
+        self.trust_proxy = trust_proxy
+        self.api_keys = frozenset(api_keys)
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._clients = {}  # client key -> in-flight + queued tickets
+        self.in_flight = 0
+        self.avg_seconds = 5.0  # EWMA of stream durations, for Retry-After
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected = {"client_limit": 0, "queue_full": 0, "queue_timeout": 0}
+        self.size_for(DEFAULT_THREADS)
+
+    def size_for(self, threads=None):
+        """Sets the limits left unconfigured for the server mode: gunicorn's
+        threaded worker with `threads` threads, or the event loop (None).
+        Called at worker boot, before any request."""
+        if threads:
+            defaults = max(1, threads // 2), max(0, threads - threads // 2 - 1)
+        else:
+            defaults = ASGI_MAX_IN_FLIGHT, ASGI_QUEUE_SIZE
+        self.max_in_flight, self.queue_size = (
+            default if limit is None else limit for limit, default in zip(self.limits, defaults))
+
+    @property
+    def enabled(self):
+        return self.max_in_flight > 0
+
+    def client_key(self, remote_addr, headers):
+        """Identifies the caller: its API key if it sends a known one, else its IP address."""
+        api_key = headers.get("X-API-Key") or headers.get("x-api-key")
+        if api_key and api_key in self.api_keys:
+            return "key:" + api_key
+        if self.trust_proxy:
+            forwarded = headers.get("X-Forwarded-For") or headers.get("x-forwarded-for")
+            if forwarded:
+                return "ip:" + forwarded.split(",")[0].strip()
+        return "ip:" + (remote_addr or "unknown")
+
+    def retry_after(self, ahead=0):
+        """Seconds until a slot is likely free with `ahead` requests already waiting."""
+        slots = max(1, self.max_in_flight)
+        return max(1, min(60, math.ceil(self.avg_seconds * (ahead + 1) / slots)))
+
+    def enter(self, client):
+        """Admits or queues a request; raises Rejected if it cannot even wait."""
+        ticket = Ticket(self, client)
+        if not self.enabled:
+            ticket.admitted = True
+            return ticket
+        with self._lock:
+            held = self._clients.get(client, 0)
+            if self.per_client and held >= self.per_client:
+                self.rejected["client_limit"] += 1
+                raise Rejected(429, "client_limit",
+                               f"Too many requests in progress for this client; retry in {self.retry_after()}s.",
+                               self.retry_after())
+            if self.in_flight < self.max_in_flight and not self._queue:
+                self.in_flight += 1
+                self.admitted += 1
+                ticket._grant()
+            elif len(self._queue) < self.queue_size:
+                self._queue.append(ticket)
+                self.queued_total += 1
+            else:
+                self.rejected["queue_full"] += 1
+                wait = self.retry_after(len(self._queue))
+                raise Rejected(503, "queue_full", f"Gravitas is at capacity; retry in {wait}s.", wait)
+            self._clients[client] = held + 1
+        return ticket
+
+    def position(self, ticket):
+        """1-based place in the queue (0 once admitted)."""
+        with self._lock:
+            try:
+                return self._queue.index(ticket) + 1
+            except ValueError:
+                return 0
+
+    def timed_out(self):
+        with self._lock:
+            self.rejected["queue_timeout"] += 1
+            wait = self.retry_after(len(self._queue))
+        return Rejected(503, "queue_timeout", f"Gravitas is busy; no slot freed up in time. Retry in {wait}s.", wait)
+
+    def abandon(self, ticket):
+        """Drops a waiting ticket from the queue (on timeout); no-op once admitted."""
+        with self._lock:
+            if ticket.admitted or ticket.released:
+                return
+            self._queue.remove(ticket)
+            ticket.released = True
+            self._forget(ticket.client)
+
+    def release(self, ticket):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._forget(ticket.client)
+            if not ticket.admitted:
+                self._queue.remove(ticket)
+                return
+            if not self.enabled:
+                return
+            self.avg_seconds += 0.2 * ((time.monotonic() - ticket.started) - self.avg_seconds)
+            if self._queue:
+                # Hand the slot straight to the head of the queue.
+                self.admitted += 1
+                self._queue.popleft()._grant()
+            else:
+                self.in_flight -= 1
+
+    def _forget(self, client):
+        held = self._clients.get(client, 0) - 1
+        if held > 0:
+            self._clients[client] = held
+        else:
+            self._clients.pop(client, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "queue_size": self.queue_size,
+                "per_client": self.per_client,
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "admitted": self.admitted,
+                "waited": self.queued_total,
+                "rejected": dict(self.rejected),
+                "avg_stream_seconds": round(self.avg_seconds, 2),
+            }
+
+    @classmethod
+    def from_env(cls):
+        def limit(name):
+            value = os.getenv(name)
+            return int(value) if value else None
+        control = cls(
+            max_in_flight=limit("ADMISSION_MAX_IN_FLIGHT"),
+            per_client=int(os.getenv("ADMISSION_PER_CLIENT", 0)),
+            queue_size=limit("ADMISSION_QUEUE_SIZE"),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 15)),
+            trust_proxy=os.getenv("ADMISSION_TRUST_PROXY", "false").lower() == "true",
+            api_keys=[key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip()],
+        )
+        if control.per_client and not control.trust_proxy:
+            log.warning("ADMISSION_PER_CLIENT without ADMISSION_TRUST_PROXY keys clients without a known API key "
+                        "by the connecting address; behind a proxy they all share it.")
+        return control
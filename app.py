@@ -235,58 +235,308 @@
 #     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=False)
 
 
+import itertools
+import json
+import logging
 import os
+import re
+import sys
+import threading
+import time
+from contextlib import closing
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, Response, stream_with_context, jsonify
+from flask import Flask, render_template, request, Response, send_file, stream_with_context, jsonify
 from flask_cors import CORS
-# --- Added for potential AuthenticationError handling ---
-from openai import AuthenticationError
-# Import Groq and alias its AuthenticationError if necessary (though the try/except block handles this)
-try:
-    from groq import Groq, AuthenticationError as GroqAuthenticationError
-except ImportError:
-    Groq = None
-    GroqAuthenticationError = AuthenticationError # Fallback
+from router import KeywordRouter
+from cache import ResponseCache, cache_key
+from history import HistoryManager
+from conversations import ConversationStore
+from http_pool import HttpPool, warm_up
+from providers import ProviderBusy, ProviderPool
+from senate import Council, MENTOR_BRIEF
+from coalesce import Coalescing, coalesce
+from admission import AdmissionControl, Rejected
+from cancellation import StreamRegistry
+from singleflight import Lagging, SingleFlight
+from resume import ResumableStreams
+from cascade import Cascade
+from batch import BatchBusy, BatchRunner, Cancelled, parse_jobs
+from assets import AssetPipeline
+from sse import frame, json_frame
+from metrics import registry
+from logs import setup_logging
 
 load_dotenv()
+setup_logging()
+log = logging.getLogger(__name__)
 
 PROVIDER = os.getenv("PROVIDER", "openai").lower()
 
-# ----- Provider clients -----
-client = None
-model_default = None
-try:
-    if PROVIDER == "groq":
-        # --- Use GROQ_API_KEY for Groq ---
-        groq_key = os.getenv("GROQ_API_KEY") 
-        if not groq_key:
-            print("Warning: GROQ_API_KEY environment variable not set.")
-        # Initialize client only if key exists
-        if groq_key:
-            client = Groq(api_key=groq_key)
-            # Use the 70B model as default for higher quality
-            model_default = os.getenv("GROQ_MODEL", "llama3-70b-8192") 
-    else: # Default to OpenAI
-        # --- Use GRAVITAS_AI_KEY for OpenAI ---
-        openai_key = os.getenv("GRAVITAS_AI_KEY") 
-        if not openai_key:
-            print("Warning: GRAVITAS_AI_KEY environment variable not set.")
-        # Initialize client only if key exists
-        if openai_key:
-            from openai import OpenAI
-            client = OpenAI(api_key=openai_key)
-            model_default = os.getenv("OPENAI_MODEL", "gpt-4o") 
-
-except (ImportError, NameError) as e:
-    print(f"Error initializing AI client library for provider '{PROVIDER}': {e}")
-    client = None 
-except (AuthenticationError, GroqAuthenticationError) as e:
-    print(f"Authentication Error initializing AI client for provider '{PROVIDER}': {e}")
-    client = None
+# ----- Provider clients (pooled HTTP transport, see http_pool.py) -----
+# The provider SDKs (openai, groq) are heavy imports: each is only imported
+# when a client for it is first built, or by preload() in a gunicorn master.
+http_pool = HttpPool.from_env()
+
+def sdk_auth_errors():
+    """AuthenticationError classes of the provider SDKs imported so far (one
+    that was never imported cannot have raised anything)."""
+    return tuple(sys.modules[name].AuthenticationError for name in ("openai", "groq") if name in sys.modules)
+
+
+def provider_key(provider: str):
+    """The provider's API key: GROQ_API_KEY for Groq, GRAVITAS_AI_KEY for OpenAI."""
+    name = "GROQ_API_KEY" if provider == "groq" else "GRAVITAS_AI_KEY"
+    key = os.getenv(name)
+    if not key:
+        log.warning("%s environment variable not set.", name)
+    return key or None
+
+
+def make_client(asynchronous=False, provider=None):
+    """Builds a provider SDK client from the environment (default: PROVIDER).
+
+    Returns the sync client used by the Flask app, or the asyncio flavour
+    (AsyncOpenAI / AsyncGroq) used by the ASGI entry point in asgi.py.
+    Both share one pooled httpx client per worker across all threads.
+    Returns None if the key is missing or the SDK cannot be initialized.
+    """
+    provider = provider or PROVIDER
+    try:
+        if provider == "groq":
+            # --- Use GROQ_API_KEY for Groq ---
+            groq_key = provider_key(provider)
+            if not groq_key:
+                return None
+            import httpx
+            if asynchronous:
+                from groq import AsyncGroq
+                return AsyncGroq(api_key=groq_key, http_client=http_pool.build(httpx.AsyncClient))
+            from groq import Groq
+            return Groq(api_key=groq_key, http_client=http_pool.build(httpx.Client))
+        else: # Default to OpenAI
+            # --- Use GRAVITAS_AI_KEY for OpenAI ---
+            openai_key = provider_key(provider)
+            if not openai_key:
+                return None
+            # The SDK's own httpx subclasses keep its defaults (redirects etc.).
+            if asynchronous:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                return AsyncOpenAI(api_key=openai_key, http_client=http_pool.build(DefaultAsyncHttpxClient))
+            from openai import OpenAI, DefaultHttpxClient
+            return OpenAI(api_key=openai_key, http_client=http_pool.build(DefaultHttpxClient))
+
+    except (ImportError, NameError) as e:
+        log.error("Error initializing AI client library for provider '%s': %s", provider, e)
+    except sdk_auth_errors() as e:
+        log.error("Authentication Error initializing AI client for provider '%s': %s", provider, e)
+    return None
+
+
+def default_model(provider: str) -> str:
+    if provider == "groq":
+        # Use the 70B model as default for higher quality
+        return os.getenv("GROQ_MODEL", "llama3-70b-8192")
+    return os.getenv("OPENAI_MODEL", "gpt-4o")
+
+
+# ----- Provider pool (failover and hedging across PROVIDERS, see providers.py) -----
+provider_pool = ProviderPool.from_env(PROVIDER, make_client, default_model, configured=provider_key)
+primary = next((p for p in provider_pool.providers if p.primary), None)
+if primary is None and provider_pool.providers:
+    primary = provider_pool.providers[0]
+model_default = primary.model if primary is not None else None
+
+
+def preload():
+    """Imports everything the configured providers' clients need.
+
+    Called by gunicorn.conf.py in a --preload master, so the workers it
+    forks share the imported modules instead of each paying for them. The
+    SDKs import their HTTP transport only when a client is built, so one
+    client per provider is built and closed here; the workers still build
+    their own (see providers.Provider).
+    """
+    for provider in provider_pool.providers:
+        client = make_client(provider=provider.name)
+        if client is not None:
+            client.close()
+
+TEMPERATURE = 0.7
+
+# ----- Connection warm-up (HTTP_WARMUP; started by gunicorn.conf.py or asgi.py) -----
+warmup_state = {"status": "cold", "connections": 0, "seconds": None}
+
+
+def start_warm_up():
+    """Opens pooled provider connections in the background; /api/health reports
+    "warming" (503) until it finishes."""
+    if not provider_pool.providers or http_pool.warmup_connections <= 0 or warmup_state["status"] != "cold":
+        return None
+
+    def run():
+        opened, seconds = 0, 0.0
+        for provider in provider_pool.providers:
+            if provider.client is None:
+                continue
+            ok, elapsed = warm_up(provider.client, http_pool.warmup_connections)
+            opened, seconds = opened + ok, seconds + elapsed
+            log.info("Warm-up: %d/%d %s connections open in %.2fs", ok, http_pool.warmup_connections, provider.name, elapsed)
+        warmup_state.update(status="ready", connections=opened, seconds=round(seconds, 3))
+
+    warmup_state["status"] = "warming"
+    thread = threading.Thread(target=run, name="provider-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# ----- SSE frame coalescing (see coalesce.py) -----
+coalescing = Coalescing.from_env()
+
+# ----- Admission control for /api/chat (see admission.py) -----
+admission = AdmissionControl.from_env()
+
+# ----- Stream cancellation: disconnects and the stop endpoint (see cancellation.py) -----
+streams = StreamRegistry.from_env()
+
+# ----- Single-flight: identical requests in flight share one upstream stream (see singleflight.py) -----
+single_flight = SingleFlight.from_env()
+
+# ----- Resumable streams: SSE ids, Last-Event-ID and a replay buffer (see resume.py) -----
+resumable = ResumableStreams.from_env()
+
+# ----- Model cascade: small model for simple turns, large when needed (see cascade.py) -----
+cascade = Cascade.from_env(PROVIDER, model_default)
+if cascade is not None:
+    provider_pool.metric_models.update(cascade.models.values())
+
+# ----- Batch runs: JSONL jobs on a bounded worker pool (see batch.py) -----
+batch_runner = BatchRunner.from_env()
+
+# ----- Metrics (served on /metrics, see metrics.py) -----
+STREAM_LABELS = ["agent", "model", "provider"]
+CHAT_REQUESTS = registry.counter(
+    "gravitas_chat_requests_total", "Chat streams by outcome (ok, cached, guardian, error, disconnected, stopped).",
+    STREAM_LABELS + ["outcome"])
+CHAT_ERRORS = registry.counter(
+    "gravitas_chat_errors_total", "Chat streams that ended in an error, by exception type.", STREAM_LABELS + ["error"])
+ROUTING_SECONDS = registry.histogram(
+    "gravitas_routing_seconds", "Time spent routing a message to an agent (detect_agent).", ["agent"])
+TTFT_SECONDS = registry.histogram(
+    "gravitas_ttft_seconds", "Time from the start of a chat stream to its first answer frame.", STREAM_LABELS)
+STREAM_SECONDS = registry.histogram(
+    "gravitas_stream_seconds", "Total duration of a chat stream.", STREAM_LABELS)
+TOKENS_OUT = registry.counter(
+    "gravitas_tokens_out_total", "Content chunks (about one token each) streamed from providers.", STREAM_LABELS)
+
+
+class ChatTiming:
+    """Stage timings of one chat stream, recorded into the metrics when it ends."""
+
+    __slots__ = ("start", "agent", "model", "provider", "chunks", "delivered", "ttft", "stop", "tier",
+                 "prompt_tokens")
+
+    def __init__(self, stop=None):
+        registry.ensure_flusher()
+        self.start = time.perf_counter()
+        self.agent = self.model = self.provider = "none"
+        self.chunks = 0
+        self.delivered = 0  # chunks whose frame the server has taken
+        self.ttft = None
+        self.stop = stop
+        self.tier = None  # (tier, reason) once the request goes upstream through the cascade
+        self.prompt_tokens = 0
+
+    def count(self, chunks):
+        """Passes provider chunks through, counting them."""
+        for content in chunks:
+            self.chunks += 1
+            yield content
+
+    async def acount(self, chunks):
+        async for content in chunks:
+            self.chunks += 1
+            yield content
+
+    def first_frame(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+
+    def finish(self, outcome, error=None):
+        if outcome == "disconnected" and self.stop is not None and self.stop.reason:
+            outcome = self.stop.reason  # the ASGI app cancels the stream for either reason
+        model = provider_pool.model_label(self.model) if self.model != "none" else "none"
+        labels = (self.agent, model, self.provider)
+        seconds = time.perf_counter() - self.start
+        streams.finished(outcome, self.chunks, self.delivered, seconds)
+        CHAT_REQUESTS.labels(*labels, outcome).inc()
+        STREAM_SECONDS.labels(*labels).observe(seconds)
+        if self.ttft is not None:
+            TTFT_SECONDS.labels(*labels).observe(self.ttft)
+        if self.chunks:
+            TOKENS_OUT.labels(*labels).inc(self.chunks)
+        if error is not None:
+            CHAT_ERRORS.labels(*labels, type(error).__name__).inc()
+        if self.tier is not None:
+            tier, reason = self.tier
+            cascade.record(tier, self.agent, reason, self.model, self.ttft, self.prompt_tokens, self.chunks)
+        log.info("chat %s", outcome, extra={
+            "agent": self.agent, "model": self.model, "provider": self.provider, "chunks": self.chunks,
+            "ttft_ms": round(self.ttft * 1000) if self.ttft is not None else None,
+            "duration_ms": round(seconds * 1000),
+        })
+
+# ----- Senate council mode (parallel mentor fan-out, see senate.py) -----
+council = Council.from_env()
+
+# The sync provider connections go to the threads that can call a provider
+# at once: the request threads (gunicorn.conf.py sets how many), a hedge
+# beside each, and the Senate and batch executors (see HttpPool.sync_limit).
+http_pool.connections_per_thread = 2 if provider_pool.hedge else 1
+http_pool.background_threads = (council.workers if council else 0) + (batch_runner.concurrency if batch_runner else 0)
+
+# ----- Conversation history trimming (token budgets, see history.py) -----
+history_manager = HistoryManager.from_env()
+
+# ----- Server-side conversations (opt-in conversation-id mode, see conversations.py) -----
+conversations = ConversationStore.from_env()
+
+# ----- Response caches (optional, see cache.py and semantic_cache.py) -----
+response_cache = ResponseCache.from_env()
+semantic_cache = None
+if os.getenv("SEMANTIC_CACHE", "false").lower() == "true":
+    # NumPy (and any embedding model) is only imported when the layer is on.
+    from semantic_cache import SemanticCache
+    semantic_cache = SemanticCache.from_env()
 
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
-CORS(app)
+CORS(app, expose_headers=["X-Conversation-Id", "Retry-After", "X-Stream-Id", "X-Batch-Id"])
+
+# ----- Static assets: fingerprinted, precompressed, cached index (see assets.py) -----
+assets = AssetPipeline.from_env(app.static_folder, app.template_folder)
+if assets is not None:
+    # The cached page is re-rendered when the template changes, so Jinja must reload it.
+    app.jinja_env.auto_reload = bool(assets.check_interval)
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        """url_for("static", filename=...) points at the fingerprinted file."""
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = assets.url(values["filename"])
+
+    def static_asset(filename):
+        """Serves a built asset (any file static/ gained since startup: as Flask does)."""
+        result = assets.asset(filename, request.headers.get("Accept-Encoding", ""),
+                              request.headers.get("If-None-Match"))
+        return asset_response(result) if result is not None else app.send_static_file(filename)
+
+    app.view_functions["static"] = static_asset
+
+
+def asset_response(result):
+    """A Flask response from an asset pipeline (status, headers, body)."""
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
 
 # ==============================================
 # --- Multi-Agent Personalities (Enhanced Prompts) ---
@@ -300,6 +550,7 @@ AGENTS = {
             "Guide them through reflection and emotional clarity. Speak in a calm, Socratic, emotionally intelligent tone. "
             "Structure responses clearly, use examples, and explain the reasoning behind your guidance. Ask insightful follow-up questions."
         ),
+        "keywords": ["emotion", "empathy", "feeling", "conflict", "sensitive", "eq", "stress management", "self-aware", "mood"],
     },
     "kinesis": {
         "name": "Kinesis – Body Language Coach",
@@ -308,6 +559,7 @@ AGENTS = {
             "You specialize in nonverbal communication — posture, gestures, tone, and spatial awareness. "
             "Offer direct, practical, actionable feedback that enhances confidence and congruence. Use bullet points for specific advice. Explain the impact of each nonverbal cue."
         ),
+        "keywords": ["body", "gesture", "posture", "tone", "eye contact", "nonverbal", "voice modulation"],
     },
     "gravis": {
         "name": "Gravis – Gravitas Mentor",
@@ -316,6 +568,7 @@ AGENTS = {
             "You cultivate composure, authority, and presence in leaders. "
             "Speak with depth and restraint, helping others project calm strength through authenticity. Explain concepts clearly and provide illustrative examples from leadership contexts."
         ),
+        "keywords": ["gravitas", "composure", "calm strength", "seriousness", "poise"],
     },
     "virtus": {
         "name": "Virtus – Roman Leadership Virtues Mentor",
@@ -325,6 +578,7 @@ AGENTS = {
             "Firmitas, Industria, Fides, and Clementia — and apply them to modern leadership challenges. "
             "Speak with moral clarity and philosophical depth. Connect virtues to practical leadership actions and decision-making."
         ),
+        "keywords": ["virtue", "integrity", "values", "duty", "ethics", "honor", "moral", "principles"],
     },
     "ethos": {
         "name": "Ethos – Persuasion Strategist",
@@ -334,6 +588,7 @@ AGENTS = {
             "Help craft persuasive, balanced, and impactful narratives, providing step-by-step guidance and frameworks. "
             "Your tone is energetic, sharp, and strategic. Use lists, examples, and rhetorical principles."
         ),
+        "keywords": ["persuade", "influence", "story", "speech", "pitch", "proposal", "negotiate", "argument", "convince"],
     },
     # --- ENHANCED PRAXIS PROMPT ---
     "praxis": {
@@ -347,6 +602,8 @@ AGENTS = {
             "Maintain an encouraging, insightful, and authoritative tone suitable for coaching executives. "
             "Anticipate potential follow-up questions. Always aim to provide substantial, well-reasoned guidance."
         ),
+        "keywords": ["presence", "authority", "executive presence", "command", "impact"],
+        "tiers": ("small", "large"),  # escalation path of the model cascade (see cascade.py)
     },
     "anima": {
         "name": "Anima – Internal Presence Mentor",
@@ -355,6 +612,7 @@ AGENTS = {
             "You help leaders reconnect with inner stillness, mindfulness, and purpose. "
             "Speak gently and introspectively, guiding alignment and authenticity. Offer simple, concrete exercises or reflections that can be practiced daily."
         ),
+        "keywords": ["inner", "mindfulness", "alignment", "purpose", "anxiety", "stillness", "focus", "meditation"],
     },
     "persona": {
         "name": "Persona – External Presence Advisor",
@@ -363,6 +621,7 @@ AGENTS = {
             "You refine how leaders are perceived — appearance, tone, and projection. "
             "Be polished, precise, and balance confidence with approachability. Give specific, actionable tips with clear rationale."
         ),
+        "keywords": ["appearance", "attire", "style", "grooming", "energy", "brand", "perception"],
     },
     "impressa": {
         "name": "Impressa – First Impression Specialist",
@@ -371,6 +630,7 @@ AGENTS = {
             "You guide leaders to make strong first impressions with warmth and credibility. "
             "Use friendly, science-based micro-behavioral insights. Provide clear dos and don'ts with explanations."
         ),
+        "keywords": ["first impression", "introduce", "introduction", "elevator pitch", "rapport", "greeting"],
     },
     "sentio": {
         "name": "Sentio – Empathy Development Guide",
@@ -379,6 +639,7 @@ AGENTS = {
             "You nurture compassion, understanding, and emotional connection in leaders. "
             "Your tone is warm, validating, and psychologically attuned. Suggest perspective-taking exercises and active listening techniques."
         ),
+        "keywords": ["empathic", "listen", "understand", "compassion", "care", "perspective", "connect", "relationship"],
     },
     "guardian": {
         "name": "Guardian – Scope Filter",
@@ -388,6 +649,7 @@ AGENTS = {
             "(e.g., coding help, recipes, specific historical facts unrelated to leadership), "
             "you kindly clarify the suite’s focus: 'My expertise is centered on leadership development, communication skills, and emotional mastery. How can I assist you within those areas today?'"
         ),
+        "keywords": ["code", "recipe", "math", "history", "science", "translate", "stock market", "weather", "movie", "book summary"],
     },
 }
 
@@ -398,164 +660,750 @@ SENATE = {
         "You synthesize insights from emotional intelligence, persuasion, presence, and virtue to guide leaders holistically. "
         "Respond with balance, composure, clarity, and well-structured, comprehensive advice using lists or steps where appropriate. Ensure your response integrates perspectives from multiple relevant areas."
     ),
+    "keywords": ["senate", "consult", "all mentors", "holistic"],
+    "tiers": ("large",),  # synthesizes a whole council: never the small model (see cascade.py)
 }
 
 
-def detect_agent(user_input: str):
-    """Selects the most appropriate agent based on keywords."""
+# Expanded terms marking a message as in scope
+LEADERSHIP_TERMS = [
+    "leader", "leadership", "team", "emotion", "empathy", "speech", "presence", "communication",
+    "influence", "virtue", "authority", "values", "mindfulness", "presentation", "confidence",
+    "persuasion", "integrity", "motivation", "body language", "posture", "manage", "ceo",
+    "executive", "coach", "mentor", "guide", "develop", "improve", "skill", "career", "feedback",
+    "strategy", "vision", "decision making"
+]
+SMALL_TALK = {"hi", "hello", "ok", "thanks", "thank you", "yes", "no", "why", "how"}
+
+# Agent detection order (order matters). Impressa is only considered once
+# Persona's keywords matched, and Guardian's keywords are the off-topic list.
+ROUTING_ORDER = ["senate", "eidos", "kinesis", "gravis", "virtus", "ethos", "praxis", "anima", "persona", "sentio"]
+
+ALL_AGENTS = dict(AGENTS, senate=SENATE)
+
+# Compiled once at import; see router.py for the matching rules.
+ROUTER = KeywordRouter(dict(
+    {key: agent["keywords"] for key, agent in ALL_AGENTS.items()},
+    leadership=LEADERSHIP_TERMS,
+))
+
+
+def route_agent(user_input: str) -> str:
+    """Returns the key (in ALL_AGENTS) of the most appropriate agent."""
     text = user_input.lower().strip()
-    # Expanded terms
-    leadership_terms = [
-        "leader", "leadership", "team", "emotion", "empathy", "speech", "presence", "communication",
-        "influence", "virtue", "authority", "values", "mindfulness", "presentation", "confidence",
-        "persuasion", "integrity", "motivation", "body language", "posture", "manage", "ceo",
-        "executive", "coach", "mentor", "guide", "develop", "improve", "skill", "career", "feedback",
-        "strategy", "vision", "decision making"
-    ]
+    hits = ROUTER.scan(text)
+
     # Check if ANY leadership term is present. If not, trigger Guardian.
-    is_short_irrelevant = len(text.split()) < 3 and text not in ["hi", "hello", "ok", "thanks", "thank you", "yes", "no", "why", "how"]
-    off_topic_keywords = ["code", "recipe", "math", "history", "science", "translate", "stock market", "weather", "movie", "book summary"]
-    is_clearly_off_topic = any(keyword in text for keyword in off_topic_keywords)
-
-    if (not any(term in text for term in leadership_terms) and is_short_irrelevant) or is_clearly_off_topic:
-          return AGENTS["guardian"]
-
-    # Agent detection logic (order matters)
-    if "senate" in text or "consult" in text or "all mentors" in text or "holistic" in text:
-        return SENATE
-    if any(w in text for w in ["emotion", "empathy", "feeling", "conflict", "sensitive", "eq", "stress management", "self-aware", "mood"]):
-        return AGENTS["eidos"]
-    if any(w in text for w in ["body", "gesture", "posture", "tone", "eye contact", "nonverbal", "voice modulation"]):
-        return AGENTS["kinesis"]
-    if any(w in text for w in ["gravitas", "composure", "calm strength", "seriousness", "poise"]):
-        return AGENTS["gravis"]
-    if any(w in text for w in ["virtue", "integrity", "values", "duty", "ethics", "honor", "moral", "principles"]):
-        return AGENTS["virtus"]
-    if any(w in text for w in ["persuade", "influence", "story", "speech", "pitch", "proposal", "negotiate", "argument", "convince"]):
-        return AGENTS["ethos"]
-    # Praxis handles general presence and leadership if not caught by others
-    if any(w in text for w in ["presence", "authority", "executive presence", "command", "impact"]):
-        return AGENTS["praxis"]
-    if any(w in text for w in ["inner", "mindfulness", "alignment", "purpose", "anxiety", "stillness", "focus", "meditation"]):
-        return AGENTS["anima"]
-    if any(w in text for w in ["appearance", "attire", "style", "grooming", "energy", "brand", "perception"]):
-          if any(w in text for w in ["first impression", "introduce", "introduction", "elevator pitch", "rapport", "greeting"]):
-              return AGENTS["impressa"]
-          else:
-              return AGENTS["persona"]
-    if any(w in text for w in ["empathic", "listen", "understand", "compassion", "care", "perspective", "connect", "relationship"]):
-        return AGENTS["sentio"]
+    is_short_irrelevant = len(text.split(None, 2)) < 3 and text not in SMALL_TALK  # only counts to 3
+    if ("leadership" not in hits and is_short_irrelevant) or "guardian" in hits:
+        return "guardian"
+
+    for key in ROUTING_ORDER:
+        if key in hits:
+            if key == "persona" and "impressa" in hits:
+                return "impressa"
+            return key
 
     # --- DEFAULT AGENT ---
     # If no specific agent matches but it seems related to leadership, default to Praxis
-    if any(term in text for term in leadership_terms):
-        return AGENTS["praxis"]
+    if "leadership" in hits:
+        return "praxis"
 
     # --- Fallback Guardian if truly unclear/off-topic ---
-    return AGENTS["guardian"]
+    return "guardian"
+
+
+def detect_agent(user_input: str):
+    """Selects the most appropriate agent based on keywords."""
+    return ALL_AGENTS[route_agent(user_input)]
+
+
+# SSE frames are bytes, with multi-line data split per the spec (see sse.py).
+sse, sse_event = frame, json_frame
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Content-Type": "text/event-stream",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+def build_request(messages, model_name: str, agent_key=None):
+    """Routes the conversation to an agent and builds the upstream request.
+
+    Shared by the sync (Flask) and async (ASGI) streaming paths and by
+    /api/batch, whose jobs may name their agent_key instead of routing.
+    Returns (agent_key, selected_agent, all_messages, model, trim, tier)
+    where trim is the history.TrimResult describing prompt size and savings
+    and tier the cascade's (tier, reason), or None when the cascade is off
+    or the client named a model.
+    """
+    user_text = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    if agent_key is None:
+        start = time.perf_counter()
+        agent_key = route_agent(user_text)
+        ROUTING_SECONDS.labels(agent_key).observe(time.perf_counter() - start)
+    selected = ALL_AGENTS[agent_key]
+    model = model_name or model_default
+
+    # Keep the newest turns that fit the model's prompt-token budget
+    system = {"role": "system", "content": selected["system"]}
+    trim = history_manager.trim(system, messages, model)
+    tier = None
+    if cascade is not None and not model_name and agent_key != "guardian":
+        depth = sum(1 for m in messages if m.get("role") == "user")
+        tier = cascade.choose(selected, user_text, trim.prompt_tokens, depth)
+        if cascade.model(tier[0]) != model:
+            model = cascade.model(tier[0])
+            trim = history_manager.trim(system, messages, model)
+    return agent_key, selected, trim.messages, model, trim, tier
+
+
+# Per-provider create() options. OpenAI only reports usage (with the cached
+# prompt tokens) in a stream when asked; Groq always attaches it.
+PROVIDER_OPTIONS = {"openai": {"stream_options": {"include_usage": True}}}
+
+
+def upstream_request(selected, messages, all_messages, model: str, extra=(), **options):
+    """Returns request_for(provider) for the provider pool.
+
+    The primary provider gets the request as built; a failover or hedge
+    provider serving a different model gets the history re-trimmed to that
+    model's budget. `extra` messages (e.g. the Senate's council notes) are
+    appended after the history, keeping the cacheable prefix (system prompt
+    and history) unchanged; `options` are passed through to create().
+    """
+    def request_for(provider):
+        provider_model = provider.model_for(model)
+        if provider_model == model:
+            trimmed = all_messages
+        else:
+            system = {"role": "system", "content": selected["system"]}
+            trimmed = history_manager.trim(system, messages, provider_model).messages
+        return dict(options, **PROVIDER_OPTIONS.get(provider.name, {}),
+                    model=provider_model, messages=trimmed + list(extra), temperature=TEMPERATURE)
+    return request_for
+
+
+# ----- Senate council -----
+def council_names():
+    return {key: agent["name"].split(" –")[0] for key, agent in AGENTS.items()}
+
+
+def senate_members(messages):
+    """The mentors to consult for the latest user message."""
+    user_text = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    mentors = [key for key in ROUTING_ORDER + ["impressa"] if key in AGENTS]
+    return council.members(ROUTER.scan(user_text.lower()), mentors)
+
+
+def mentor_request(key, messages, model: str):
+    """request_for(provider) asking one mentor for a short council perspective."""
+    mentor = {"system": AGENTS[key]["system"] + MENTOR_BRIEF}
+    system = {"role": "system", "content": mentor["system"]}
+    trimmed = history_manager.trim(system, messages, model).messages
+    return upstream_request(mentor, messages, trimmed, model, max_tokens=council.mentor_tokens)
+
+
+def ask_mentor(key, messages, model: str, cancel):
+    """Collects one mentor's perspective; gives up (closing the upstream
+    stream) once the council deadline passes."""
+    parts = []
+    with closing(provider_pool.stream(mentor_request(key, messages, model))) as stream:
+        for content in stream:
+            if cancel.is_set():
+                return None
+            parts.append(content)
+    return "".join(parts)
+
+
+# A progress event carried in a stream of content deltas: the Senate's council
+# runs inside the answer's stream, so single-flight joiners share its progress too.
+PROGRESS = "\x1eprogress:"
+
 
+def progress_item(payload) -> str:
+    return PROGRESS + json.dumps(payload)
 
-def sse(data: str) -> str:
-    """Formats data for Server-Sent Events, escaping newlines."""
-    processed_data = data.replace('\n', '\\n') # Escape newlines
-    return f"data: {processed_data}\n\n"
 
+def consult_senate(messages, model: str, cancel=None):
+    """Fans the question out to the council, yielding progress items.
 
-def stream_chat(messages, model_name: str):
-    """Unified streaming for OpenAI & Groq via SSE."""
-    global client
+    Returns (via StopIteration) the synthesis note to append to the
+    Senate's request, or None if no perspective arrived in time.
+    """
+    members = senate_members(messages)
+    names = council_names()
+    yield progress_item({"stage": "council", "members": [names[k] for k in members], "total": len(members)})
+    perspectives = {}
+    ask = lambda key, cancel: ask_mentor(key, messages, model, cancel)
+    for done, (key, status, answer) in enumerate(council.consult(members, ask), 1):
+        if answer:
+            perspectives[key] = answer
+        yield progress_item({"stage": "perspective", "agent": names[key], "status": status,
+                             "done": done, "total": len(members)})
+        if cancel is not None and cancel.is_set():
+            return None
+    yield progress_item({"stage": "synthesis", "perspectives": len(perspectives)})
+    return council.synthesis_note(perspectives, names) if perspectives else None
+
+
+def response_cache_key(all_messages, model: str) -> str:
+    """Cache key for a built request: agent system prompt, model, temperature, trimmed history."""
+    return cache_key(all_messages[0]["content"], model, TEMPERATURE, all_messages[1:])
+
+
+def answer_chunks(agent_key, selected, messages, all_messages, model: str, served, cancel=None):
+    """The content deltas answering a built request; for the Senate, the
+    council's progress items and then the synthesis."""
+    extra = []
+    if agent_key == "senate" and council is not None:
+        note = yield from consult_senate(messages, model, cancel)
+        if note:
+            extra.append(note)
+    request_for = upstream_request(selected, messages, all_messages, model, extra)
+    yield from provider_pool.stream(request_for, served, cancel)
+
+
+def upstream_chunks(agent_key, selected, messages, all_messages, model: str, served, stop=None):
+    """answer_chunks for a built request, shared with identical requests already
+    in flight when single-flight is enabled. The flight is keyed on the request
+    before the council step, so joiners share the council calls as well."""
+    answer = lambda served, cancel: answer_chunks(agent_key, selected, messages, all_messages, model, served, cancel)
+    if single_flight is None:
+        return answer(served, stop)
+    return single_flight.stream(response_cache_key(all_messages, model), answer, served, stop)
+
+
+def leading_progress(chunks):
+    """Yields the progress items leading a chunk stream as SSE events; returns
+    (via StopIteration) the stream's content deltas."""
+    for item in chunks:
+        if not item.startswith(PROGRESS):
+            return itertools.chain((item,), chunks)
+        yield sse_event("progress", json.loads(item[len(PROGRESS):]))
+    return iter(())
+
+
+def first_turn_question(all_messages):
+    """The user's question if the request is the first turn of a conversation, else None."""
+    history = all_messages[1:]
+    if len(history) == 1 and history[0].get("role") == "user":
+        return history[0].get("content") or None
+    return None
+
+
+def cached_answer(agent_key: str, all_messages, model: str):
+    """Looks a built request up in the exact and semantic caches; returns the answer or None."""
+    if response_cache is not None:
+        answer = response_cache.get(response_cache_key(all_messages, model))
+        if answer is not None:
+            return answer
+    if semantic_cache is not None:
+        question = first_turn_question(all_messages)
+        if question:
+            return semantic_cache.lookup(agent_key, model, question)
+    return None
+
+
+def remember_answer(agent_key: str, all_messages, model: str, answer: str):
+    """Stores a completed answer in whichever caches are enabled."""
+    if not answer:
+        return
+    if response_cache is not None:
+        response_cache.put(response_cache_key(all_messages, model), answer)
+    if semantic_cache is not None:
+        question = first_turn_question(all_messages)
+        if question:
+            semantic_cache.store(agent_key, model, question, answer)
+
+
+def replay_cached(text: str, chunk_chars: int = 32):
+    """Streams a cached answer as SSE frames of roughly chunk_chars characters.
+
+    Frames are only cut after whitespace, so words arrive whole.
+    """
+    buffer = ""
+    for piece in re.findall(r"\S+\s*|\s+", text):
+        buffer += piece
+        if len(buffer) >= chunk_chars:
+            yield sse(buffer)
+            buffer = ""
+    if buffer:
+        yield sse(buffer)
+
+
+def stream_error_message(e: Exception) -> str:
+    """Logs a streaming failure and returns the message shown to the user."""
+    if isinstance(e, sdk_auth_errors()):
+        error_message = f"Authentication Error: Invalid API Key detected. Please verify GRAVITAS_AI_KEY (OpenAI) or GROQ_API_KEY (Groq) in your Render Environment Variables. ({e})"
+        log.error(error_message)
+        return error_message
+    if isinstance(e, Lagging):
+        log.warning("Single-flight subscriber cut off: %s", e)
+        return str(e)
+    if isinstance(e, ProviderBusy):
+        log.warning("Provider rate limit: %s", e)
+        return "The AI provider is rate limiting requests right now. Please try again in a few seconds."
+    error_message = f"An unexpected error occurred during streaming: {type(e).__name__}: {e}"
+    log.error(error_message, exc_info=e)
+    return error_message
+
+
+def stream_chat(messages, model_name: str, on_complete=None, flush=None, stop=None):
+    """Unified streaming for OpenAI & Groq via SSE.
+
+    on_complete, if given, is called with the full answer once it has been
+    streamed without error. flush is the request's Coalescing settings
+    (default: the SSE_FLUSH_* ones). stop is the stream's StopSignal: once
+    it is set the upstream response is closed and the stream ends.
+    """
+    timing = ChatTiming(stop)
+    outcome, error = "disconnected", None
     try:
-        if client is None:
+        if not provider_pool.providers:
+            outcome = "error"
             yield sse("[Error] AI Service client not initialized. Check API keys and provider settings.")
             return
 
-        user_text = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
-        selected = detect_agent(user_text)
+        agent_key, selected, all_messages, model, trim, tier = build_request(messages, model_name)
+        timing.agent, timing.model = agent_key, model
 
         if selected["name"].startswith("Guardian"):
+            outcome = "guardian"
+            timing.first_frame()
             yield sse(selected["system"]) # Yield the Guardian's prompt directly
+            if on_complete:
+                on_complete(selected["system"])
+            return
+
+        cached = cached_answer(agent_key, all_messages, model)
+        if cached is not None:
+            outcome = "cached"
+            timing.first_frame()
+            yield from replay_cached(cached)
+            if on_complete:
+                on_complete(cached)
             return
 
-        all_messages = [{"role": "system", "content": selected["system"]}] + messages
-        # Ensure message history doesn't get excessively long (optional limit)
-        MAX_HISTORY = 10 # Keep system + last 9 messages (5 user, 4 assistant) approx
-        if len(all_messages) > MAX_HISTORY + 1:
-             all_messages = [all_messages[0]] + all_messages[-(MAX_HISTORY):] # Keep system + latest N
-
-        model = model_name or model_default
-
-        print(f"--- Requesting chat completion ---")
-        print(f"Provider: {PROVIDER}")
-        print(f"Model: {model}")
-        print(f"Agent: {selected['name']}")
-
-        resp = client.chat.completions.create(
-            model=model,
-            messages=all_messages,
-            temperature=0.7,
-            stream=True
-        )
-        print("--- Stream started ---")
-        chunk_count = 0
-        for chunk in resp:
-            chunk_count += 1
-            delta = chunk.choices[0].delta
-            content = getattr(delta, "content", None)
-            if content:
+        log.debug("Requesting chat completion", extra={
+            "agent": selected["name"], "model": model,
+            "providers": ",".join(p.name for p in provider_pool.ranked()),
+            "prompt_tokens": trim.prompt_tokens, "saved_tokens": trim.saved_tokens, "dropped": trim.dropped,
+        })
+
+        served = {}
+        parts = []
+        timing.tier, timing.prompt_tokens = tier, trim.prompt_tokens
+        with closing(upstream_chunks(agent_key, selected, messages, all_messages, model, served, stop)) as chunks:
+            deltas = yield from leading_progress(chunks)
+            for content in coalesce(timing.count(deltas), flush or coalescing):
+                if stop is not None and stop.is_set():
+                    break
+                if not parts:
+                    timing.first_frame()
+                    timing.provider = served.get("provider", "none")
+                parts.append(content)
+                pulled = timing.chunks
                 yield sse(content)
-        print(f"--- Stream finished ({chunk_count} chunks) ---")
+                timing.delivered = pulled
+        if stop is not None and stop.is_set():
+            outcome = stop.reason  # partial answers are never cached
+            if stop.reason == "stopped" and parts and on_complete:
+                # The client reads a stopped stream to its end and keeps what it
+                # was shown as the answer: so does the conversation.
+                on_complete("".join(parts))
+            return
+        outcome = "ok"
+        # Only completed streams are cached; errors and disconnects never reach here.
+        answer = "".join(parts)
+        if served.get("model") == model:
+            remember_answer(agent_key, all_messages, model, answer)
+        if on_complete:
+            on_complete(answer)
 
-    except (AuthenticationError, GroqAuthenticationError) as e:
-        error_message = f"Authentication Error: Invalid API Key detected. Please verify GRAVITAS_AI_KEY (OpenAI) or GROQ_API_KEY (Groq) in your Render Environment Variables. ({e})"
-        print(error_message)
-        yield sse(f"[Error] {error_message}")
     except Exception as e:
-        error_message = f"An unexpected error occurred during streaming: {type(e).__name__}: {e}"
-        import traceback
-        print(f"{error_message}\n{traceback.format_exc()}")
-        yield sse(f"[Error] {error_message}")
+        outcome, error = "error", e
+        yield sse(f"[Error] {stream_error_message(e)}")
+    finally:
+        timing.finish(outcome, error)
+
+
+def admitted(ticket, frames):
+    """Streams `frames` once `ticket` holds a slot, reporting the queue position
+    (as progress events) while it waits; releases the slot at the end."""
+    try:
+        if ticket.queued:
+            try:
+                for position in ticket.wait():
+                    yield sse_event("progress", {"stage": "queue", "position": position})
+            except Rejected as e:
+                yield sse_event("progress", {"stage": "queue", "status": "timeout", "retry_after": e.retry_after})
+                yield sse(f"[Error] {e}")
+                return
+        yield from frames
+    finally:
+        ticket.release()
+
+
+# ----- Batch jobs (/api/batch, see batch.py) -----
+# A job may name any agent but the Guardian, which answers off-topic messages.
+BATCH_AGENTS = [key for key in ALL_AGENTS if key != "guardian"]
+# Providers whose API has OpenAI's /v1/files + /v1/batches.
+NATIVE_BATCH_PROVIDERS = ("openai", "groq")
+
+
+def senate_note(messages, model: str):
+    """consult_senate without its progress events: the synthesis note or None."""
+    events = consult_senate(messages, model)
+    while True:
+        try:
+            next(events)
+        except StopIteration as done:
+            return done.value
+
+
+def run_batch_job(job, cancel):
+    """Answers one batch job in full; returns its agent, model and answer.
+
+    The same request as /api/chat (routing, cascade, caches, Senate council),
+    collected instead of streamed. Raises on an upstream error so the
+    runner can retry.
+    """
+    messages = job["messages"]
+    agent_key, selected, all_messages, model, trim, tier = build_request(messages, job["model"], job["agent"])
+    if agent_key == "guardian":
+        return {"agent": agent_key, "model": None, "answer": selected["system"]}
+    cached = cached_answer(agent_key, all_messages, model)
+    if cached is not None:
+        return {"agent": agent_key, "model": model, "answer": cached, "cached": True}
+    extra = []
+    if agent_key == "senate" and council is not None:
+        note = senate_note(messages, model)
+        if note:
+            extra.append(note)
+    served = {}
+    request_for = upstream_request(selected, messages, all_messages, model, extra)
+    # Not retried by the SDK: the runner retries through the provider's pacer.
+    with closing(provider_pool.stream(request_for, served, cancel, retries=False)) as chunks:
+        answer = "".join(chunks)
+    if cancel.is_set():
+        raise Cancelled()
+    if served.get("model") == model:
+        remember_answer(agent_key, all_messages, model, answer)
+    return {"agent": agent_key, "model": served.get("model", model), "provider": served.get("provider"),
+            "answer": answer}
+
+
+def submit_native_batch(jobs, checkpoint):
+    """Sends the jobs to the primary provider's batch API; Guardian and cached
+    answers are written to the results file at once. Returns the status."""
+    lines, answered = [], []
+    for job in jobs:
+        agent_key, selected, all_messages, model, _, _ = build_request(job["messages"], job["model"], job["agent"])
+        answer = selected["system"] if agent_key == "guardian" else cached_answer(agent_key, all_messages, model)
+        if answer is not None:
+            answered.append({"id": job["id"], "line": job["line"], "status": "ok", "agent": agent_key,
+                             "model": None if agent_key == "guardian" else model, "answer": answer})
+            continue
+        body = {"model": primary.model_for(model), "messages": all_messages, "temperature": TEMPERATURE}
+        lines.append({"custom_id": job["id"], "line": job["line"], "agent": agent_key, "body": body})
+    checkpoint.acquire()
+    try:
+        for result in answered:
+            checkpoint.write(result)
+    finally:
+        checkpoint.release()
+    if lines:
+        batch_runner.submit_native(primary.client, lines, checkpoint, len(jobs))
+    else:
+        checkpoint.save_meta({"batch_id": checkpoint.id, "jobs": len(jobs), "state": "done", "created": time.time()})
+    return batch_runner.status(checkpoint)
+
+
+def batch_lines(jobs, checkpoint):
+    """The batch's results as JSONL, ending with a summary line."""
+    with closing(batch_runner.run(jobs, run_batch_job, checkpoint)) as results:
+        for item in results:
+            yield json.dumps(item if "id" in item else {"summary": dict(item, batch_id=checkpoint.id)}) + "\n"
+
+
+def batch_error(error: str, status: int, **extra):
+    return jsonify(dict(extra, error=error)), status
+
+
+def validate_messages(messages):
+    """Returns an error string if the messages payload is unusable, else None."""
+    if not messages:
+        log.warning("Received request with no messages.")
+        return "No messages provided"
+
+    if not isinstance(messages, list) or not all(isinstance(m, dict) and 'role' in m and 'content' in m for m in messages):
+          log.warning("Invalid messages format received: %.200r", messages)
+          return "Invalid messages format"
+    return None
+
+
+def parse_chat_payload(data):
+    """Resolves a /api/chat body to (messages, conversation_id, error, status).
+
+    Full-history mode (unchanged): {"messages": [...]}.
+    Conversation mode (opt-in):
+      {"conversation_id": id, "message": {"role": "user", "content": ...}}
+          appends one message to the server-side history;
+      {"conversation": true, "messages": [...]} or {"conversation": true, "message": ...}
+          starts a conversation, seeded with the given history.
+    In conversation mode the id is returned to the client in X-Conversation-Id.
+    """
+    conversation_id = data.get("conversation_id")
+    if not conversation_id and not data.get("conversation"):
+        messages = data.get("messages", [])
+        return messages, None, validate_messages(messages), 400
+
+    message = data.get("message")
+    if isinstance(message, str):
+        message = {"role": "user", "content": message}
+    if message is not None and (not isinstance(message, dict) or 'role' not in message or 'content' not in message):
+        return None, None, "Invalid message format", 400
+
+    if conversation_id:
+        if message is None:
+            return None, None, "No message provided", 400
+        history = conversations.history(conversation_id)
+        if history is None:
+            # Unknown or expired: the client falls back to sending its full history.
+            return None, conversation_id, "Unknown conversation", 404
+    else:
+        history = data.get("messages") or []
+        if history and validate_messages(history):
+            return None, None, "Invalid messages format", 400
+        if message is None and not history:
+            return None, None, "No messages provided", 400
+        conversation_id = conversations.create(history)
+
+    if message is not None:
+        message = {"role": message["role"], "content": message["content"]}
+        conversations.append(conversation_id, message["role"], message["content"])
+        history.append(message)
+    return history, conversation_id, None, 200
+
+
+def resume_error(last_event_id: str) -> dict:
+    """Error body for a reconnect that cannot be resumed: the client resends its request."""
+    return {"error": "Stream cannot be resumed", "code": "stream_not_resumable", "last_event_id": last_event_id}
+
+
+def conversation_error(error: str, status: int, conversation_id=None) -> dict:
+    """Error body for /api/chat; a 404 tells the client to resend its full history."""
+    body = {"error": error}
+    if status == 404:
+        body.update(code="conversation_not_found", conversation_id=conversation_id)
+    return body
 
 
 @app.route("/")
 def index():
-    """Serves the main HTML page."""
-    return render_template("index.html")
+    """Serves the main HTML page, rendered once and kept until it changes (see assets.py)."""
+    if assets is None:
+        return render_template("index.html")
+    return asset_response(assets.page("index.html", lambda: render_template("index.html"),
+                                      request.headers.get("Accept-Encoding", ""), request.headers.get("If-None-Match")))
+
+
+def health_status(provider_client) -> dict:
+    """Health payload shared by the Flask and ASGI endpoints."""
+    status = "ok" if provider_client is not None else "error: client not initialized"
+    if provider_client is not None and warmup_state["status"] == "warming":
+        status = "warming"
+    payload = {"status": status, "provider": PROVIDER, "model": model_default}
+    payload["http_pool"] = dict(http_pool.stats(), warmup=warmup_state)
+    payload["providers"] = provider_pool.stats()
+    payload["coalescing"] = coalescing.stats()
+    payload["admission"] = admission.stats()
+    payload["streams"] = streams.stats()
+    if single_flight is not None:
+        payload["single_flight"] = single_flight.stats()
+    if resumable is not None:
+        payload["resumable"] = resumable.stats()
+    if cascade is not None:
+        payload["cascade"] = cascade.stats()
+    if batch_runner is not None:
+        payload["batch"] = batch_runner.stats()
+    if assets is not None:
+        payload["assets"] = assets.stats()
+    if council is not None:
+        payload["senate"] = council.stats()
+    if response_cache is not None:
+        payload["cache"] = response_cache.stats()
+    if semantic_cache is not None:
+        payload["semantic_cache"] = semantic_cache.stats()
+    payload["history"] = history_manager.stats()
+    payload["conversations"] = conversations.stats()
+    return payload
 
 
 @app.route("/api/health")
 def health():
     """Health check endpoint."""
-    status = "ok" if client is not None else "error: client not initialized"
-    return jsonify({"status": status, "provider": PROVIDER, "model": model_default})
+    payload = health_status(primary.client if primary is not None else None)
+    return jsonify(payload), 503 if payload["status"] == "warming" else 200
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition, summed over every worker of this server."""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/api/chat", methods=["POST"])
 def chat():
-    """Handles chat requests and streams responses."""
+    """Handles chat requests and streams responses.
+
+    With resumable streams, a request carrying Last-Event-ID reconnects to
+    the stream it names instead (see resume.py).
+    """
+    last_event_id = request.headers.get("Last-Event-ID")
+    if resumable is not None and last_event_id:
+        frames = resumable.resume(last_event_id)
+        if frames is None:
+            return jsonify(resume_error(last_event_id)), 404
+        stream_id = last_event_id.rpartition(":")[0]
+        return Response(frames, mimetype="text/event-stream", headers=dict(SSE_HEADERS, **{"X-Stream-Id": stream_id}))
+
     data = request.get_json(force=True, silent=True) or {}
-    messages = data.get("messages", [])
-    if not messages:
-        print("Error: Received request with no messages.")
-        return jsonify({"error": "No messages provided"}), 400
+    # Admit before touching the conversation store, so a rejected turn leaves no trace.
+    try:
+        ticket = admission.enter(admission.client_key(request.remote_addr, request.headers))
+    except Rejected as e:
+        return jsonify(e.body()), e.status, {"Retry-After": str(e.retry_after)}
+    messages, conversation_id, error, status = parse_chat_payload(data)
+    if error:
+        ticket.release()
+        return jsonify(conversation_error(error, status, conversation_id)), status
 
-    if not isinstance(messages, list) or not all(isinstance(m, dict) and 'role' in m and 'content' in m for m in messages):
-          print(f"Error: Invalid messages format received: {messages}")
-          return jsonify({"error": "Invalid messages format"}), 400
+    # The client socket lets the stream notice a closed tab between writes. A
+    # resumable stream outlives its connection: it stops once nobody reads it.
+    sock = request.environ.get("gunicorn.socket") or request.environ.get("werkzeug.socket")
+    stop = streams.open(data.get("stream_id"), sock if resumable is None else None)
+    if resumable is not None:
+        while not resumable.claim(stop.id):  # the id names a recording still kept: use a fresh one
+            stop.close()
+            stop = streams.open()
+    headers = dict(SSE_HEADERS, **{"X-Stream-Id": stop.id})
+    on_complete = None
+    if conversation_id:
+        headers["X-Conversation-Id"] = conversation_id
+        on_complete = lambda answer: conversations.append(conversation_id, "assistant", answer)
 
     model = data.get("model")
-    generator = stream_with_context(stream_chat(messages, model))
-    headers = {
-        "Cache-Control": "no-cache",
-        "Content-Type": "text/event-stream",
-        "Connection": "keep-alive",
-        "X-Accel-Buffering": "no",
-    }
-    return Response(generator, mimetype="text/event-stream", headers=headers)
+    flush = coalescing.for_request(data.get("coalesce"))
+    frames = admitted(ticket, stream_chat(messages, model, on_complete, flush, stop))
+    if resumable is not None:
+        # Generated in a thread of its own, which releases the slot when it ends.
+        reader = resumable.start(stop, frames, on_done=lambda: (ticket.release(), stop.close()))
+        return Response(reader, mimetype="text/event-stream", headers=headers)
+    generator = stream_with_context(frames)
+    response = Response(generator, mimetype="text/event-stream", headers=headers)
+    response.call_on_close(ticket.release)  # also frees the slot if the stream never starts
+    response.call_on_close(stop.close)
+    return response
+
+
+@app.route("/api/chat/<stream_id>/stop", methods=["POST"])
+def stop_chat(stream_id):
+    """Stops a running chat stream (its id is in the X-Stream-Id response header)."""
+    status = streams.stop(stream_id)
+    if status is None:
+        return jsonify({"error": "Unknown stream", "stream_id": stream_id}), 404
+    return jsonify({"stream_id": stream_id, "status": status}), 200 if status == "stopped" else 202
+
+
+@app.route("/api/batch", methods=["POST"])
+def batch():
+    """Runs a JSONL batch of chat jobs (see batch.py).
+
+    Streams the results as JSONL; with ?detach=true or ?native=true
+    answers 202 and the batch is followed with GET /api/batch/<id>.
+    """
+    if batch_runner is None:
+        return batch_error("The batch API is disabled", 404)
+    if not provider_pool.providers:
+        return batch_error("AI Service client not initialized", 503)
+    jobs, errors = parse_jobs(request.get_data(as_text=True), BATCH_AGENTS, validate_messages, batch_runner.max_jobs)
+    if errors:
+        return batch_error("Invalid batch", 400, lines=errors[:50])
+    if not jobs:
+        return batch_error("No jobs provided", 400)
+    try:
+        checkpoint = batch_runner.checkpoint(request.args.get("batch_id"))
+    except ValueError as e:
+        return batch_error(str(e), 400)
+    headers = {"X-Batch-Id": checkpoint.id}
+
+    if request.args.get("native", "").lower() == "true":
+        if primary is None or primary.name not in NATIVE_BATCH_PROVIDERS:
+            return batch_error(f"{PROVIDER} has no batch API", 400)
+        if checkpoint.exists():
+            return batch_error("batch_id is already in use", 409, batch_id=checkpoint.id)
+        try:
+            status = submit_native_batch(jobs, checkpoint)
+        except Exception as e:
+            log.error("Native batch submission failed: %s", e)
+            return batch_error(f"The provider rejected the batch: {type(e).__name__}: {e}", 502)
+        return jsonify(status), 202, headers
+
+    try:
+        checkpoint.acquire()
+    except BatchBusy as e:
+        return batch_error(str(e), 409, batch_id=checkpoint.id)
+    meta = checkpoint.meta() or {"batch_id": checkpoint.id, "created": time.time()}
+    checkpoint.save_meta(dict(meta, jobs=len(jobs), state="running"))
+    if request.args.get("detach", "").lower() == "true":
+        batch_runner.start(jobs, run_batch_job, checkpoint)
+        return jsonify(batch_runner.status(checkpoint)), 202, headers
+    return Response(batch_lines(jobs, checkpoint), mimetype="application/x-ndjson", headers=headers)
+
+
+def batch_checkpoint(batch_id):
+    """The checkpoint of a known batch, or None."""
+    if batch_runner is None:
+        return None
+    try:
+        checkpoint = batch_runner.checkpoint(batch_id)
+    except ValueError:
+        return None
+    return checkpoint if checkpoint.exists() else None
+
+
+@app.route("/api/batch/<batch_id>")
+def batch_status(batch_id):
+    """Progress of a batch; polls the provider for a native one."""
+    checkpoint = batch_checkpoint(batch_id)
+    if checkpoint is None:
+        return batch_error("Unknown batch", 404, batch_id=batch_id)
+    if (checkpoint.meta() or {}).get("native") and primary is not None:
+        try:
+            batch_runner.poll_native(primary.client, checkpoint)
+        except Exception as e:
+            log.warning("Polling native batch %s failed: %s", batch_id, e)
+    return jsonify(batch_runner.status(checkpoint))
+
+
+@app.route("/api/batch/<batch_id>/results")
+def batch_results(batch_id):
+    """The batch's results file so far (JSONL, in completion order)."""
+    checkpoint = batch_checkpoint(batch_id)
+    if checkpoint is None or not os.path.exists(checkpoint.path):
+        return batch_error("Unknown batch", 404, batch_id=batch_id)
+    return send_file(checkpoint.path, mimetype="application/x-ndjson", max_age=0)
 
 
 if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 10000)) # Using 10000 as a common default for flexibility
     debug_mode = os.getenv("FLASK_DEBUG", "False").lower() == "true"
-    print(f"Starting Flask app on {host}:{port} (Debug: {debug_mode})")
+    log.info("Starting Flask app on %s:%s (Debug: %s)", host, port, debug_mode)
     app.run(host=host, port=port, debug=debug_mode)
+
@@ -0,0 +1,444 @@
+"""ASGI entry point: asyncio streaming for /api/chat.
+
+Run with ``uvicorn asgi:app`` or, on the dyno,
+``gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2``.
+
+/api/chat and /api/health are served natively on the event loop with the
+async OpenAI/Groq clients, so a single worker multiplexes hundreds of open
+SSE streams instead of pinning one thread per stream. So are the built
+static files and the cached index page (see assets.py), straight from
+memory. Every other route (and an index page not yet rendered) is handed
+to the Flask app through a2wsgi's WSGI adapter, which runs it on a small
+thread pool.
+"""
+import asyncio
+import json
+import logging
+
+from a2wsgi import WSGIMiddleware
+
+import app as gravitas
+from http_pool import awarm_up
+from coalesce import acoalesce
+from admission import Rejected
+from cancellation import StopSignal
+
+log = logging.getLogger(__name__)
+
+flask_app = WSGIMiddleware(gravitas.app)
+
+# Streams are coroutines here, not threads: admission defaults to the event loop's limits.
+gravitas.admission.size_for(None)
+
+# Flask-CORS covers the routes served by Flask (including the OPTIONS
+# preflight for /api/chat); the native routes add the same header themselves.
+CORS_HEADERS = [(b"access-control-allow-origin", b"*"), (b"access-control-expose-headers", b"X-Conversation-Id, Retry-After, X-Stream-Id")]
+
+
+def get_async_client():
+    """The primary provider's async client, built lazily inside the serving
+    process (after any fork) so its pooled connections belong to this
+    worker's event loop."""
+    return gravitas.primary.async_client if gravitas.primary is not None else None
+
+
+async def run_blocking(func, *args):
+    """Runs func off the event loop only when it may touch SQLite."""
+    if gravitas.conversations.backend is not None:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+async def ask_mentor(key, messages, model: str):
+    """Async twin of app.ask_mentor; cancelled as a task at the deadline."""
+    parts = []
+    async for content in gravitas.provider_pool.astream(gravitas.mentor_request(key, messages, model)):
+        parts.append(content)
+    return "".join(parts)
+
+
+async def consult_senate(messages, model: str, result: dict):
+    """Async twin of app.consult_senate; stores the synthesis note in result["note"]."""
+    council = gravitas.council
+    members = gravitas.senate_members(messages)
+    names = gravitas.council_names()
+    yield gravitas.progress_item({"stage": "council", "members": [names[k] for k in members], "total": len(members)})
+    perspectives = {}
+    done = 0
+    async for key, status, answer in council.aconsult(members, lambda key: ask_mentor(key, messages, model)):
+        done += 1
+        if answer:
+            perspectives[key] = answer
+        yield gravitas.progress_item({"stage": "perspective", "agent": names[key], "status": status,
+                                      "done": done, "total": len(members)})
+    yield gravitas.progress_item({"stage": "synthesis", "perspectives": len(perspectives)})
+    result["note"] = council.synthesis_note(perspectives, names) if perspectives else None
+
+
+async def answer_chunks(agent_key, selected, messages, all_messages, model: str, served):
+    """Async twin of app.answer_chunks."""
+    extra = []
+    if agent_key == "senate" and gravitas.council is not None:
+        result = {}
+        async for item in consult_senate(messages, model, result):
+            yield item
+        if result.get("note"):
+            extra.append(result["note"])
+    request_for = gravitas.upstream_request(selected, messages, all_messages, model, extra)
+    async for content in gravitas.provider_pool.astream(request_for, served):
+        yield content
+
+
+def aupstream_chunks(agent_key, selected, messages, all_messages, model: str, served):
+    """Async twin of app.upstream_chunks."""
+    answer = lambda served: answer_chunks(agent_key, selected, messages, all_messages, model, served)
+    if gravitas.single_flight is None:
+        return answer(served)
+    return gravitas.single_flight.astream(gravitas.response_cache_key(all_messages, model), answer, served)
+
+
+async def leading_progress(chunks, rest: list):
+    """Async twin of app.leading_progress; appends the first content delta, if any, to `rest`."""
+    async for item in chunks:
+        if not item.startswith(gravitas.PROGRESS):
+            rest.append(item)
+            return
+        yield gravitas.sse_event("progress", json.loads(item[len(gravitas.PROGRESS):]))
+
+
+async def deltas(first: list, chunks):
+    """The content deltas of `chunks` once leading_progress has read its progress items."""
+    for content in first:
+        yield content
+    if first:
+        async for content in chunks:
+            yield content
+
+
+async def astream_chat(messages, model_name: str, on_complete=None, flush=None, stop=None):
+    """Async twin of app.stream_chat: yields SSE frames as tokens arrive.
+
+    Cancellation (stop) is enforced from outside, by cancelling the task
+    that consumes this generator (see run_until_stopped).
+    """
+    timing = gravitas.ChatTiming(stop)
+    outcome, error = "disconnected", None
+    parts = []
+    try:
+        pool = gravitas.provider_pool
+        if not pool.providers:
+            outcome = "error"
+            yield gravitas.sse("[Error] AI Service client not initialized. Check API keys and provider settings.")
+            return
+
+        agent_key, selected, all_messages, model, trim, tier = gravitas.build_request(messages, model_name)
+        timing.agent, timing.model = agent_key, model
+
+        if selected["name"].startswith("Guardian"):
+            outcome = "guardian"
+            timing.first_frame()
+            yield gravitas.sse(selected["system"])
+            if on_complete:
+                await run_blocking(on_complete, selected["system"])
+            return
+
+        caching = gravitas.response_cache is not None or gravitas.semantic_cache is not None
+        if caching:
+            # Cache tiers do SQLite I/O and NumPy lookups; keep them off the event loop.
+            cached = await asyncio.to_thread(gravitas.cached_answer, agent_key, all_messages, model)
+            if cached is not None:
+                outcome = "cached"
+                timing.first_frame()
+                for frame in gravitas.replay_cached(cached):
+                    yield frame
+                if on_complete:
+                    await run_blocking(on_complete, cached)
+                return
+
+        served = {}
+        timing.tier, timing.prompt_tokens = tier, trim.prompt_tokens
+        chunks = aupstream_chunks(agent_key, selected, messages, all_messages, model, served)
+        first = []
+        async for frame in leading_progress(chunks, first):
+            yield frame
+        async for content in acoalesce(timing.acount(deltas(first, chunks)), flush or gravitas.coalescing):
+            if not parts:
+                timing.first_frame()
+                timing.provider = served.get("provider", "none")
+            parts.append(content)
+            pulled = timing.chunks
+            yield gravitas.sse(content)
+            timing.delivered = pulled
+        outcome = "ok"
+        answer = "".join(parts)
+        if caching and served.get("model") == model:
+            await asyncio.to_thread(gravitas.remember_answer, agent_key, all_messages, model, answer)
+        if on_complete:
+            await run_blocking(on_complete, answer)
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # Stopped while waiting for the provider or for a send, which wrote its
+        # frame before waiting: every part reached the client, which keeps them
+        # as the answer (it reads a stopped stream to its end). So does the conversation.
+        if stop is not None and stop.reason == "stopped" and parts and on_complete:
+            await run_blocking(on_complete, "".join(parts))
+        raise
+    except Exception as e:
+        outcome, error = "error", e
+        yield gravitas.sse(f"[Error] {gravitas.stream_error_message(e)}")
+    finally:
+        timing.finish(outcome, error)
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return body
+
+
+async def send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                   + CORS_HEADERS + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def health(scope, receive, send):
+    payload = dict(gravitas.health_status(get_async_client()), mode="asgi")
+    await send_json(send, payload, status=503 if payload["status"] == "warming" else 200)
+
+
+async def static_files(scope, receive, send):
+    """A built asset or the cached index page from memory; the rest goes to Flask."""
+    request_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    accept, if_none_match = request_headers.get("accept-encoding", ""), request_headers.get("if-none-match")
+    if scope["path"] == "/":
+        result = gravitas.assets.cached_page("index.html", accept, if_none_match)
+    else:
+        result = gravitas.assets.asset(scope["path"][len("/static/"):], accept, if_none_match)
+    if result is None:
+        await flask_app(scope, receive, send)  # renders (and caches) the page, or serves a plain file
+        return
+    status, headers, body = result
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.lower().encode(), v.encode()) for k, v in headers] + CORS_HEADERS})
+    await send({"type": "http.response.body", "body": body if scope["method"] == "GET" else b""})
+
+
+def serves_static(scope) -> bool:
+    return (gravitas.assets is not None and scope.get("method") in ("GET", "HEAD")
+            and (scope["path"] == "/" or scope["path"].startswith("/static/")))
+
+
+# Producer tasks of resumable streams, which run on after their request returns.
+producers = set()
+
+
+def sse_headers(stream_id: str):
+    headers = [(k.lower().encode(), v.encode()) for k, v in gravitas.SSE_HEADERS.items()] + CORS_HEADERS
+    headers.append((b"x-stream-id", stream_id.encode()))
+    return headers
+
+
+async def chat(scope, receive, send):
+    request_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    last_event_id = request_headers.get("last-event-id")
+    if gravitas.resumable is not None and last_event_id:
+        await resume(receive, send, last_event_id)
+        return
+    try:
+        data = json.loads(await read_body(receive) or b"{}")
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    admission = gravitas.admission
+    try:
+        ticket = admission.enter(admission.client_key((scope.get("client") or ("unknown",))[0], request_headers))
+    except Rejected as e:
+        await send_json(send, e.body(), status=e.status, headers=[(b"retry-after", str(e.retry_after).encode())])
+        return
+    handed_over = False
+    try:
+        handed_over = await stream_admitted(ticket, receive, send, data)
+    finally:
+        if not handed_over:
+            ticket.release()
+
+
+async def stream_admitted(ticket, receive, send, data):
+    """Streams an admitted request; True if a resumable stream's producer took over the ticket."""
+    messages, conversation_id, error, status = await run_blocking(gravitas.parse_chat_payload, data)
+    if error:
+        await send_json(send, gravitas.conversation_error(error, status, conversation_id), status=status)
+        return False
+
+    stop = gravitas.streams.open(data.get("stream_id"))
+    if gravitas.resumable is not None:
+        while not await gravitas.resumable.aclaim(stop.id):  # the id names a recording still kept
+            stop.close()
+            stop = gravitas.streams.open()
+    try:
+        headers = sse_headers(stop.id)
+        on_complete = None
+        if conversation_id:
+            headers.append((b"x-conversation-id", conversation_id.encode()))
+            on_complete = lambda answer: gravitas.conversations.append(conversation_id, "assistant", answer)
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        frames = chat_frames(ticket, data, messages, on_complete, stop)
+        if gravitas.resumable is not None:
+            reader = await start_resumable(ticket, frames, stop)
+            stop = None  # the producer closes it
+            await follow(reader, receive, send)
+            return True
+        await run_until_stopped(send_all(send, frames), receive, stop)
+        await send({"type": "http.response.body", "body": b""})
+        return False
+    finally:
+        if stop is not None:
+            stop.close()
+
+
+async def chat_frames(ticket, data, messages, on_complete, stop):
+    """The frames of one chat response: queue progress while waiting for a slot, then the answer."""
+    if ticket.queued:
+        try:
+            async for position in ticket.await_slot():
+                yield gravitas.sse_event("progress", {"stage": "queue", "position": position})
+        except Rejected as e:
+            frame = gravitas.sse_event("progress", {"stage": "queue", "status": "timeout", "retry_after": e.retry_after})
+            yield frame + gravitas.sse(f"[Error] {e}")
+            return
+    flush = gravitas.coalescing.for_request(data.get("coalesce"))
+    async for frame in astream_chat(messages, data.get("model"), on_complete, flush, stop):
+        yield frame
+
+
+async def send_all(send, frames):
+    async for frame in frames:
+        await send({"type": "http.response.body", "body": frame, "more_body": True})
+
+
+async def start_resumable(ticket, frames, stop):
+    """Generates the response in a task of its own, which outlives this
+    connection and releases the slot when it ends (see resume.py); returns
+    the request's reader."""
+    reader, produce = await gravitas.resumable.astart(stop, frames)
+
+    async def producer():
+        try:
+            await run_until_stopped(produce, None, stop)
+        except Exception:
+            log.exception("Resumable stream %s failed", stop.id)
+        finally:
+            ticket.release()
+            stop.close()
+
+    task = asyncio.ensure_future(producer())
+    producers.add(task)  # the loop only keeps weak references to tasks
+    task.add_done_callback(producers.discard)
+    return reader
+
+
+async def resume(receive, send, last_event_id):
+    """Reconnects to a resumable stream from Last-Event-ID; 404 if it cannot be resumed."""
+    reader = await gravitas.resumable.aresume(last_event_id)
+    if reader is None:
+        await send_json(send, gravitas.resume_error(last_event_id), status=404)
+        return
+    await send({"type": "http.response.start", "status": 200,
+                "headers": sse_headers(last_event_id.rpartition(":")[0])})
+    await follow(reader, receive, send)
+
+
+async def follow(reader, receive, send):
+    """Sends a recording's frames until it ends or the client disconnects."""
+    await run_until_stopped(send_all(send, reader), receive, StopSignal("reader"))
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def run_until_stopped(body, receive, stop):
+    """Runs the coroutine `body` as a task, cancelling it (which closes the
+    upstream stream) when the client disconnects or the stream is stopped.
+
+    Without `receive` (a resumable stream's producer) only the stop signal counts.
+    """
+    task = asyncio.ensure_future(body)
+    listener = asyncio.ensure_future(receive() if receive is not None else asyncio.Event().wait())
+    # A stop request answered by this worker (Flask, in a thread) wakes us at once;
+    # one answered by another worker is noticed by polling for its marker.
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    stop.notify = lambda: loop.call_soon_threadsafe(stopped.set)
+    waiter = asyncio.ensure_future(stopped.wait())
+    try:
+        while not task.done():
+            await asyncio.wait({task, listener, waiter}, timeout=gravitas.streams.poll,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if listener.done() and not stop.is_set():
+                if listener.result()["type"] == "http.disconnect":
+                    stop.set("disconnected")
+                else:
+                    listener = asyncio.ensure_future(receive())
+            if stop.is_set() and not task.done():
+                task.cancel()
+                await asyncio.wait({task})
+    finally:
+        stop.notify = None
+        listener.cancel()
+        waiter.cancel()
+        if not task.done():
+            task.cancel()  # we were cancelled ourselves (server shutdown)
+    if not task.cancelled():
+        task.result()
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            connections = gravitas.http_pool.warmup_connections
+            opened, seconds = 0, 0.0
+            for provider in gravitas.provider_pool.providers:
+                client = provider.async_client
+                if client is not None and connections > 0:
+                    # Startup completes (and requests are accepted) only once the pool is warm.
+                    ok, elapsed = await awarm_up(client, connections)
+                    opened, seconds = opened + ok, seconds + elapsed
+                    log.info("Warm-up: %d/%d %s connections open in %.2fs", ok, connections, provider.name, elapsed)
+            if connections > 0:
+                gravitas.warmup_state.update(status="ready", connections=opened, seconds=round(seconds, 3))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await gravitas.provider_pool.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+ROUTES = {
+    ("POST", "/api/chat"): chat,
+    ("GET", "/api/health"): health,
+}
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+        return
+    handler = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is None and scope["type"] == "http" and serves_static(scope):
+        handler = static_files
+    if handler is None:
+        await flask_app(scope, receive, send)
+        return
+    await handler(scope, receive, send)
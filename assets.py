@@ -0,0 +1,412 @@
+"""Static asset pipeline: fingerprinted, minified, precompressed files and a cached index page.
+
+Without it Flask reads static/app.js and static/style.css from disk on
+every request and sends them uncompressed with Cache-Control: no-cache,
+so every page load revalidates (or downloads) both, and index() renders
+the template each time; all of it on worker threads that streams need.
+
+With it, static/ is built once at startup (in the gunicorn master with
+--preload, so the workers share the result):
+
+  * .js and .css files are minified (comments and indentation dropped;
+    strings, template literals and regular expressions left untouched)
+  * each file gets a fingerprinted name from a hash of its content,
+    app.js -> app.3f9c2a1b7d4e.js, which url_for("static", ...) returns
+  * each is compressed ahead of time with gzip and, if the brotli package
+    is installed, brotli; a request gets the smallest encoding it accepts
+
+A fingerprinted URL never changes content, so it is served with
+Cache-Control: immutable for a year and the browser does not ask again;
+the plain name (/static/app.js) is still served, revalidated. Responses
+carry an ETag per encoding and answer If-None-Match with 304. The
+rendered index page is kept in memory (compressed the same way, with an
+ETag, revalidated on every load) until the template or an asset changes;
+static/ and templates/ are checked for changes at most every
+ASSETS_CHECK_INTERVAL seconds, and earlier fingerprinted versions stay
+servable for pages that still reference them.
+
+Configured from the environment (see AssetPipeline.from_env):
+    ASSETS                 "false" to serve static/ as plain files, as Flask does (default on)
+    ASSETS_MINIFY          "false" to keep .js and .css as written (default on)
+    ASSETS_CHECK_INTERVAL  seconds between checks of static/ and templates/ for changes
+                           (default 2; 0 = never, for an immutable deploy)
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+MIN_COMPRESS = 256  # bytes below which compression is not worth the header
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+ASSET_RESPONSES = registry.counter(
+    "gravitas_asset_responses_total",
+    "Static asset and index responses by kind (asset, page), encoding and status (200, 304).",
+    ["kind", "encoding", "status"])
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone is still a 3-4x saving
+    brotli = None
+
+
+# ----- Minifiers -----
+_WORD = re.compile(r"[\w$]")
+# Tokens after which a "/" starts a regular expression rather than a division.
+_REGEX_AFTER = set("(,=:[!&|?{};+-*%<>~^")
+_REGEX_KEYWORDS = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do",
+                   "else", "yield", "await"}
+_TIGHT = set("{}()[];,:=<>!?&|*%^~.")
+
+
+def _space(prev: str, following: str) -> str:
+    """The whitespace to keep between two characters: a newline (for automatic
+    semicolon insertion), one space, or none."""
+    if not prev or not following:
+        return ""
+    if prev in "+-" or following in "+-":
+        return " " if prev in "+-" and following in "+-" else ""
+    if prev == "/" or following == "/":
+        return " "
+    return "" if prev in _TIGHT or following in _TIGHT else " "
+
+
+def minify_js(source: str) -> str:
+    """Drops comments, indentation and blank lines from JavaScript.
+
+    A line break is kept (one per run of blank lines) wherever it could end
+    a statement, so automatic semicolon insertion reads the code as before. Strings,
+    template literals (with their ${} expressions) and regular expression
+    literals are copied verbatim.
+    """
+    out = []
+    last = ""  # last character written (not whitespace)
+    word = ""  # last identifier or keyword written
+    templates = []  # brace depth inside each open ${} expression
+    pending = None  # whitespace seen since the last token: "\n", " " or None
+    i, n = 0, len(source)
+
+    def emit(text):
+        nonlocal last, pending
+        if pending is not None and out:
+            if pending == "\n" and last not in "{(,[;" and text[0] not in ")]},.;?":
+                out.append("\n")  # may end a statement
+            else:
+                out.append(_space(last, text[0]))
+        pending = None
+        out.append(text)
+        last = text[-1]
+
+    while i < n:
+        c = source[i]
+        if c in " \t\r\n":
+            j = i
+            while j < n and source[j] in " \t\r\n":
+                j += 1
+            pending = "\n" if "\n" in source[i:j] or pending == "\n" else " "
+            i = j
+        elif source.startswith("//", i):
+            j = source.find("\n", i)
+            i = n if j < 0 else j
+        elif source.startswith("/*", i):
+            j = source.find("*/", i + 2)
+            j = n if j < 0 else j + 2
+            pending = "\n" if "\n" in source[i:j] or pending == "\n" else " "
+            i = j
+        elif c in "'\"":
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == "\\" else 1
+            emit(source[i:j + 1])
+            word = ""
+            i = j + 1
+        elif c == "`" or (c == "}" and templates and templates[-1] == 0):
+            if c == "}":
+                templates.pop()
+            j = i + 1
+            while j < n and source[j] != "`" and not source.startswith("${", j):
+                j += 2 if source[j] == "\\" else 1
+            if source.startswith("${", j):
+                templates.append(0)
+                j += 1
+            emit(source[i:j + 1])
+            word = ""
+            i = j + 1
+        elif c == "/" and (last in _REGEX_AFTER or not last or word in _REGEX_KEYWORDS):
+            j, in_class = i + 1, False
+            while j < n and (source[j] != "/" or in_class):
+                if source[j] == "\\":
+                    j += 1
+                elif source[j] in "[]":
+                    in_class = source[j] == "["
+                j += 1
+            j += 1
+            while j < n and _WORD.match(source[j]):
+                j += 1  # flags
+            emit(source[i:j])
+            word = ""
+            i = j
+        elif _WORD.match(c):
+            j = i
+            while j < n and _WORD.match(source[j]):
+                j += 1
+            word = source[i:j]
+            emit(word)
+            i = j
+        else:
+            if templates and c == "{":
+                templates[-1] += 1
+            elif templates and c == "}":
+                templates[-1] -= 1
+            emit(c)
+            word = ""
+            i += 1
+    return "".join(out) + "\n"
+
+
+def minify_css(source: str) -> str:
+    """Drops comments and collapses whitespace in CSS.
+
+    Whitespace goes only around braces, semicolons and commas, where it
+    never matters; elsewhere (selectors such as "a :hover", calc()) a run
+    becomes one space. Strings are copied verbatim.
+    """
+    out = []
+    i, n = 0, len(source)
+    pending = False
+    while i < n:
+        c = source[i]
+        if source.startswith("/*", i):
+            j = source.find("*/", i + 2)
+            i = n if j < 0 else j + 2
+            pending = True
+        elif c in " \t\r\n":
+            pending = True
+            i += 1
+        else:
+            if c in "'\"":
+                j = i + 1
+                while j < n and source[j] != c:
+                    j += 2 if source[j] == "\\" else 1
+                token = source[i:j + 1]
+                i = j + 1
+            else:
+                token = c
+                i += 1
+            if token == "}" and out and out[-1] == ";":
+                out.pop()  # the last declaration needs no semicolon
+            if pending and out and out[-1] not in "{};," and token not in "{};,":
+                out.append(" ")
+            out.append(token)
+            pending = False
+    return "".join(out) + "\n"
+
+
+MINIFIERS = {".js": minify_js, ".css": minify_css}
+
+
+# ----- Built files -----
+def compress(body: bytes, content_type: str):
+    """{encoding: body} for a file: identity, plus gzip and br where they are smaller."""
+    bodies = {"identity": body}
+    if len(body) < MIN_COMPRESS or not content_type.startswith(COMPRESSIBLE):
+        return bodies
+    encoded = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=11)
+    bodies.update((encoding, data) for encoding, data in encoded.items() if len(data) < len(body))
+    return bodies
+
+
+def accepted(accept_encoding: str):
+    """Encodings a client accepts (q > 0) from its Accept-Encoding header."""
+    encodings = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name.strip())
+    return encodings
+
+
+class Built:
+    """One servable file (an asset or the rendered page) in every encoding."""
+
+    __slots__ = ("content_type", "digest", "bodies")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        self.bodies = compress(body, content_type)
+
+    def choose(self, accept_encoding: str) -> str:
+        """The smallest encoding of this file the client accepts."""
+        ok = accepted(accept_encoding)
+        candidates = [e for e in self.bodies if e == "identity" or e in ok]
+        return min(candidates, key=lambda e: len(self.bodies[e]))
+
+    def respond(self, kind, accept_encoding, if_none_match, cache_control):
+        """(status, headers, body) for a GET, 304 when If-None-Match has the ETag."""
+        encoding = self.choose(accept_encoding)
+        etag = f'"{self.digest}-{encoding}"'
+        headers = [("Content-Type", self.content_type), ("ETag", etag), ("Cache-Control", cache_control),
+                   ("Vary", "Accept-Encoding")]
+        if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+            ASSET_RESPONSES.labels(kind, encoding, "304").inc()
+            return 304, headers, b""
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        body = self.bodies[encoding]
+        headers.append(("Content-Length", str(len(body))))
+        ASSET_RESPONSES.labels(kind, encoding, "200").inc()
+        return 200, headers, body
+
+
+class AssetPipeline:
+    """Builds static/ into fingerprinted, compressed files and caches rendered pages."""
+
+    def __init__(self, static_dir, template_dir, minify=True, check_interval=2.0):
+        self.static_dir = static_dir
+        self.template_dir = template_dir
+        self.minify = minify
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._building = threading.Lock()
+        self.files = {}  # static path -> (mtime_ns, fingerprinted path)
+        self.served = {}  # fingerprinted or plain path -> Built
+        self.pages = {}  # template name -> (template mtime_ns, version, Built)
+        self.version = 0
+        self.checked = 0.0
+        self.build()
+
+    def _sources(self):
+        for root, _, names in os.walk(self.static_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, self.static_dir).replace(os.sep, "/"), path
+
+    def build(self):
+        """(Re)builds every file in static/ whose mtime changed; returns the number built."""
+        built, started = 0, time.perf_counter()
+        raw = minified = 0
+        for name, path in self._sources():
+            mtime = os.stat(path).st_mtime_ns
+            if self.files.get(name, (None,))[0] == mtime:
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            base, ext = os.path.splitext(name)
+            raw += len(body)
+            if self.minify and ext in MINIFIERS:
+                body = MINIFIERS[ext](body.decode("utf-8")).encode("utf-8")
+            minified += len(body)
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type == "application/javascript":
+                content_type += "; charset=utf-8"
+            asset = Built(body, content_type)
+            fingerprinted = f"{base}.{asset.digest}{ext}"
+            with self._lock:
+                self.served[name] = self.served[fingerprinted] = asset  # earlier versions stay servable
+                self.files[name] = (mtime, fingerprinted)
+            built += 1
+        if built:
+            with self._lock:
+                self.version += 1
+            log.info("Assets: built %d file(s) in %.0fms (%d -> %d bytes minified)", built,
+                     (time.perf_counter() - started) * 1000, raw, minified)
+        return built
+
+    def refresh(self):
+        """Rebuilds changed files, at most every check_interval seconds."""
+        now = time.monotonic()
+        if not self.check_interval or now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        if not self._building.acquire(blocking=False):
+            return  # another thread is checking
+        try:
+            self.build()
+        except OSError as e:
+            log.warning("Assets: rebuild failed: %s", e)
+        finally:
+            self._building.release()
+
+    def url(self, filename: str) -> str:
+        """The fingerprinted path for a static file (unknown files keep their name)."""
+        entry = self.files.get(filename)
+        return entry[1] if entry else filename
+
+    def asset(self, filename, accept_encoding, if_none_match):
+        """(status, headers, body) for /static/<filename>, or None if it is not a built file."""
+        self.refresh()
+        asset = self.served.get(filename)
+        if asset is None:
+            return None
+        plain = filename in self.files  # the name in static/, whose content can change
+        return asset.respond("asset", accept_encoding, if_none_match, REVALIDATE if plain else IMMUTABLE)
+
+    def _template_mtime(self, name):
+        try:
+            return os.stat(os.path.join(self.template_dir, name)).st_mtime_ns
+        except OSError:
+            return None
+
+    def cached_page(self, name, accept_encoding, if_none_match):
+        """(status, headers, body) for a rendered page still current in the cache, else None."""
+        self.refresh()
+        entry = self.pages.get(name)
+        if entry is None or entry[1] != self.version:
+            return None
+        if self.check_interval and entry[0] != self._template_mtime(name):
+            return None
+        return entry[2].respond("page", accept_encoding, if_none_match, REVALIDATE)
+
+    def page(self, name, render, accept_encoding, if_none_match):
+        """(status, headers, body) for a page, rendering (render() -> str) only on a cache miss."""
+        cached = self.cached_page(name, accept_encoding, if_none_match)
+        if cached is not None:
+            return cached
+        mtime, version = self._template_mtime(name), self.version
+        page = Built(render().encode("utf-8"), "text/html; charset=utf-8")
+        with self._lock:
+            self.pages[name] = (mtime, version, page)
+        return page.respond("page", accept_encoding, if_none_match, REVALIDATE)
+
+    def stats(self):
+        with self._lock:
+            current = [self.served[name] for name in self.files]
+            encodings = ("identity", "gzip", "br") if brotli is not None else ("identity", "gzip")
+            return {
+                "files": len(self.files),
+                "fingerprinted": len(self.served) - len(self.files),  # current and earlier versions
+                "bytes": {encoding: sum(len(a.bodies.get(encoding, a.bodies["identity"])) for a in current)
+                          for encoding in encodings},
+                "pages": len(self.pages),
+            }
+
+    @classmethod
+    def from_env(cls, static_dir, template_dir):
+        """Builds the pipeline from ASSETS_* variables, or returns None if disabled."""
+        if os.getenv("ASSETS", "true").lower() != "true":
+            return None
+        return cls(
+            static_dir,
+            template_dir,
+            minify=os.getenv("ASSETS_MINIFY", "true").lower() == "true",
+            check_interval=float(os.getenv("ASSETS_CHECK_INTERVAL", 2)),
+        )
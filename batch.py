@@ -0,0 +1,465 @@
+"""Batch runs: many scripted chat prompts from JSONL through a bounded worker pool.
+
+POST /api/batch takes one job per line:
+
+    {"id": "p-17", "agent": "praxis", "messages": [{"role": "user", "content": "..."}], "model": "gpt-4o-mini"}
+
+"agent" is an agent key (see app.ALL_AGENTS), or "auto" or absent to route
+the last user message the way /api/chat does; "model" is optional; "id"
+(or OpenAI's "custom_id") defaults to "line-<n>". Jobs are answered in
+full (not streamed token by token) by a pool of BATCH_CONCURRENCY threads
+per worker, shared by every batch that worker runs, so a batch of
+thousands of prompts never has more than that many upstream calls open.
+
+Pacing: each attempt first waits for the batch rate cap (BATCH_RPS, left
+below the provider's limit so interactive chats keep some headroom), then
+goes through the provider pool, which paces by the provider's own
+x-ratelimit headers; a job the pacer holds back longer than it will wait
+waits here and tries again, which does not count as a retry. A rate
+limit, timeout, connection error or 5xx is retried up to BATCH_RETRIES
+times with jittered exponential backoff (at least the wait the provider
+asked for), without the SDK's own retries, which would bypass the pacer;
+other errors fail the job.
+
+Results come back as JSONL, one line per job in completion order:
+
+    {"id": "p-17", "line": 17, "status": "ok", "agent": "praxis", "model": "...", "answer": "...",
+     "attempts": 1, "seconds": 2.31}
+
+followed by a {"summary": {...}} line. Every result is also appended to
+BATCH_DIR/<batch id>.jsonl as it completes: that file is the checkpoint.
+Posting the same jobs again with ?batch_id=<id> skips the ones that
+already succeeded, so an interrupted batch resumes where it stopped. With
+?detach=true the batch runs in the background and the request returns
+202 at once; GET /api/batch/<id> reports progress and
+GET /api/batch/<id>/results returns the results file.
+
+With ?native=true the jobs are submitted to the provider's own batch API
+(OpenAI and Groq: /v1/files + /v1/batches, half price, results within
+the provider's completion window) instead of the pool. Routing, system
+prompts and history trimming are applied here as for /api/chat; Guardian
+answers are written at once, as they need no provider call. The results
+file is filled in when GET /api/batch/<id> finds the provider batch done.
+
+Configured from the environment (see BatchRunner.from_env):
+    BATCH                 "true" to enable /api/batch (default off)
+    BATCH_CONCURRENCY     jobs answered at once per worker (default 4)
+    BATCH_RPS             batch requests per second per worker (default 0 = no cap)
+    BATCH_RETRIES         retries of a failed attempt (default 3)
+    BATCH_BACKOFF         first retry delay in seconds, doubled per retry (default 1.0)
+    BATCH_MAX_BACKOFF     longest retry delay (default 60)
+    BATCH_MAX_JOBS        jobs accepted per request (default 5000)
+    BATCH_DIR             directory for results and checkpoints, shared by the workers
+                          (default: gravitas-batches in the temp directory)
+    BATCH_WINDOW          completion window of native batches (default 24h)
+"""
+import fcntl
+import io
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import registry
+from providers import ProviderBusy
+
+log = logging.getLogger(__name__)
+
+BATCH_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = ("APIConnectionError", "APITimeoutError", "TimeoutError", "ConnectionError")
+
+BATCH_JOBS = registry.counter(
+    "gravitas_batch_jobs_total", "Batch jobs finished, by status (ok, error, cancelled).", ["status"])
+BATCH_RETRIES = registry.counter(
+    "gravitas_batch_retries_total", "Batch job attempts retried after a retryable error.")
+BATCH_JOB_SECONDS = registry.histogram(
+    "gravitas_batch_job_seconds", "Time to answer one batch job, retries and pacing included.")
+
+
+class BatchBusy(Exception):
+    """The batch is already running in some worker."""
+
+
+class Cancelled(Exception):
+    """A job stopped because its batch was abandoned."""
+
+
+def parse_jobs(text: str, agents, validate, max_jobs: int):
+    """(jobs, errors) from a JSONL body; errors lists the unusable lines.
+
+    `agents` are the agent keys a job may name; `validate` is
+    app.validate_messages.
+    """
+    jobs, errors, seen = [], [], set()
+    for n, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            errors.append({"line": n, "error": f"Invalid JSON: {e}"})
+            continue
+        if not isinstance(job, dict):
+            errors.append({"line": n, "error": "A job must be a JSON object"})
+            continue
+        messages = job.get("messages")
+        if isinstance(job.get("message"), str) and messages is None:
+            messages = [{"role": "user", "content": job["message"]}]
+        error = validate(messages)
+        agent = job.get("agent") or "auto"
+        if not error and agent != "auto" and agent not in agents:
+            error = f"Unknown agent {agent!r}"
+        job_id = str(job.get("id") or job.get("custom_id") or f"line-{n}")
+        if not error and job_id in seen:
+            error = f"Duplicate id {job_id!r}"
+        if error:
+            errors.append({"line": n, "error": error})
+            continue
+        seen.add(job_id)
+        jobs.append({"id": job_id, "line": n, "agent": None if agent == "auto" else agent,
+                     "messages": messages, "model": job.get("model")})
+    if len(jobs) > max_jobs:
+        errors.append({"line": None, "error": f"Too many jobs: {len(jobs)} (at most {max_jobs})"})
+    return jobs, errors
+
+
+def retryable(e: Exception) -> bool:
+    if getattr(e, "status_code", None) in RETRYABLE_STATUS:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(e).__mro__)
+
+
+def retry_after(e: Exception):
+    """Seconds the provider asked us to wait, if the error says."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class Checkpoint:
+    """The results file of one batch (JSONL, appended as jobs finish) and its
+    metadata, BATCH_DIR/<id>.jsonl and <id>.json.
+
+    While a worker runs the batch it holds an exclusive lock on the results
+    file, so the same batch never runs twice at once.
+    """
+
+    def __init__(self, directory, batch_id):
+        self.id = batch_id
+        self.path = os.path.join(directory, f"{batch_id}.jsonl")
+        self.meta_path = os.path.join(directory, f"{batch_id}.json")
+        self._file = None
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path)
+
+    def acquire(self):
+        """Opens the results file for appending; raises BatchBusy if another run holds it."""
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            raise BatchBusy(f"batch {self.id} is already running")
+        self._file = f
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()  # also drops the lock
+            self._file = None
+
+    def running(self) -> bool:
+        """Whether some worker holds the batch's lock."""
+        if self._file is not None:
+            return True
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        return False
+
+    def results(self):
+        """Every result written so far (a later line for an id replaces an earlier one)."""
+        latest = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    latest[result.get("id")] = result
+        except FileNotFoundError:
+            pass
+        return latest
+
+    def done(self):
+        """Ids of the jobs that already succeeded."""
+        return {job_id for job_id, r in self.results().items() if r.get("status") == "ok"}
+
+    def write(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result) + "\n")
+            self._file.flush()
+
+    def meta(self):
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_meta(self, meta):
+        tmp = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+
+
+class BatchRunner:
+    """Runs batch jobs on a bounded pool with pacing, retries and checkpoints."""
+
+    def __init__(self, directory, concurrency=4, rps=0.0, retries=3, backoff=1.0, max_backoff=60.0,
+                 max_jobs=5000, window="24h"):
+        self.directory = directory
+        self.concurrency = concurrency
+        self.rps = rps
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_jobs = max_jobs
+        self.window = window
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+        self.running = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def pool(self):
+        # Built in the serving process: threads do not survive a fork.
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="batch")
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def checkpoint(self, batch_id=None):
+        """The checkpoint for batch_id (a new id if None); raises ValueError for a malformed id."""
+        batch_id = batch_id or uuid.uuid4().hex[:16]
+        if not BATCH_ID.match(batch_id):
+            raise ValueError("batch_id must be 1-64 letters, digits, '-' or '_'")
+        return Checkpoint(self.directory, batch_id)
+
+    # ----- Pool -----
+    def _pace(self, cancel):
+        """Waits for the batch's share of the provider rate (BATCH_RPS)."""
+        if not self.rps:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + 1.0 / self.rps
+        if cancel.wait(max(0.0, start - now)):
+            raise Cancelled()
+
+    def _attempt(self, job, execute, cancel):
+        """One job, retried; returns its result dict."""
+        start = time.monotonic()
+        result = {"id": job["id"], "line": job["line"]}
+        attempt = 0
+        while True:
+            try:
+                self._pace(cancel)
+                attempt += 1
+                result.update(status="ok", **execute(job, cancel))
+                break
+            except Cancelled:
+                result.update(status="cancelled")
+                break
+            except ProviderBusy as e:
+                # Held back by the provider's pacer, never sent: wait for its
+                # bucket (jittered, so the pool does not stampede) without using up a retry.
+                attempt -= 1
+                if cancel.wait(e.wait * random.uniform(1.0, 1.25)):
+                    result.update(status="cancelled")
+                    break
+            except Exception as e:
+                if cancel.is_set():
+                    result.update(status="cancelled")
+                    break
+                if attempt > self.retries or not retryable(e):
+                    log.warning("Batch job %s failed after %d attempt(s): %s", job["id"], attempt, e)
+                    result.update(status="error", error=f"{type(e).__name__}: {e}")
+                    break
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                delay = max(delay, min(self.max_backoff, retry_after(e) or 0.0))
+                BATCH_RETRIES.inc()
+                log.info("Batch job %s: %s, retrying in %.1fs", job["id"], e, delay)
+                if cancel.wait(delay):
+                    result.update(status="cancelled")
+                    break
+        result.update(attempts=attempt, seconds=round(time.monotonic() - start, 3))
+        BATCH_JOBS.labels(result["status"]).inc()
+        BATCH_JOB_SECONDS.observe(result["seconds"])
+        return result
+
+    def run(self, jobs, execute, checkpoint=None, cancel=None):
+        """Yields each job's result as it completes, then the summary dict.
+
+        execute(job, cancel) answers one job, returning its agent, model and
+        answer. Jobs already done in the checkpoint are skipped; the others
+        are written to it, and the checkpoint (acquired by the caller) is
+        released when the run ends. Closing the generator (a client that
+        went away) cancels the jobs not yet finished.
+        """
+        cancel = cancel or threading.Event()
+        started = time.monotonic()
+        done = checkpoint.done() if checkpoint is not None else set()
+        pending = [job for job in jobs if job["id"] not in done]
+        counts = {"ok": 0, "error": 0, "cancelled": 0}
+        with self._lock:
+            self.running += 1
+        futures = [self.pool.submit(self._attempt, job, execute, cancel) for job in pending]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                counts[result["status"]] += 1
+                if checkpoint is not None:
+                    checkpoint.write(result)
+                yield result
+        finally:
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            with self._lock:
+                self.running -= 1
+            if checkpoint is not None:
+                checkpoint.release()
+        summary = dict(counts, jobs=len(jobs), skipped=len(jobs) - len(pending),
+                       seconds=round(time.monotonic() - started, 3))
+        if checkpoint is not None:
+            checkpoint.save_meta(dict(checkpoint.meta() or {}, state="done", summary=summary, finished=time.time()))
+        yield summary
+
+    def start(self, jobs, execute, checkpoint):
+        """Runs a batch in the background (the checkpoint must be acquired);
+        progress is read back with status()."""
+        def run():
+            try:
+                for _ in self.run(jobs, execute, checkpoint):
+                    pass
+            except Exception:
+                log.exception("Batch %s failed", checkpoint.id)
+                checkpoint.save_meta(dict(checkpoint.meta() or {}, state="failed", finished=time.time()))
+        threading.Thread(target=run, name=f"batch-{checkpoint.id}", daemon=True).start()
+
+    def status(self, checkpoint):
+        """Progress of a batch from its files, or None if it is unknown."""
+        meta = checkpoint.meta()
+        if meta is None:
+            return None
+        results = checkpoint.results()
+        counts = {}
+        for result in results.values():
+            counts[result.get("status")] = counts.get(result.get("status"), 0) + 1
+        state = meta.get("state", "running")
+        if state == "running" and not meta.get("native") and not checkpoint.running():
+            state = "interrupted"  # its worker went away: post the jobs again with the batch_id to resume
+        status = {"batch_id": checkpoint.id, "state": state, "jobs": meta.get("jobs"),
+                  "finished": len(results), "ok": counts.get("ok", 0), "error": counts.get("error", 0)}
+        if meta.get("native"):
+            status["native"] = meta["native"]
+        return status
+
+    # ----- Provider batch API -----
+    def submit_native(self, client, lines, checkpoint, jobs):
+        """Uploads request lines ({"custom_id", "line", "agent", "body"}) to the provider's batch API."""
+        payload = "".join(json.dumps({"custom_id": line["custom_id"], "method": "POST",
+                                      "url": "/v1/chat/completions", "body": line["body"]}) + "\n"
+                          for line in lines)
+        upload = client.files.create(file=(f"{checkpoint.id}.jsonl", io.BytesIO(payload.encode())), purpose="batch")
+        created = client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions",
+                                        completion_window=self.window, metadata={"gravitas_batch": checkpoint.id})
+        checkpoint.save_meta({"batch_id": checkpoint.id, "jobs": jobs, "state": "running", "created": time.time(),
+                              "lines": {line["custom_id"]: [line["line"], line["agent"]] for line in lines},
+                              "native": {"id": created.id, "status": created.status, "requests": len(lines)}})
+        return created.id
+
+    def poll_native(self, client, checkpoint):
+        """Refreshes a native batch's state, writing its results once the provider is done."""
+        meta = checkpoint.meta()
+        native, lines_of = meta["native"], meta.get("lines", {})
+        if meta.get("state") != "running":
+            return
+        remote = client.batches.retrieve(native["id"])
+        counts = getattr(remote, "request_counts", None)
+        native.update(status=remote.status, completed=getattr(counts, "completed", None),
+                      failed=getattr(counts, "failed", None))
+        if remote.status in ("failed", "expired", "cancelled"):
+            meta["state"] = remote.status
+        elif remote.status == "completed":
+            try:
+                checkpoint.acquire()
+            except BatchBusy:
+                return  # another worker is collecting the results
+            try:
+                for file_id in (remote.output_file_id, getattr(remote, "error_file_id", None)):
+                    if file_id:
+                        for line in client.files.content(file_id).text.splitlines():
+                            if line.strip():
+                                checkpoint.write(self._native_result(json.loads(line), lines_of))
+            finally:
+                checkpoint.release()
+            meta.update(state="done", finished=time.time())
+        checkpoint.save_meta(meta)
+
+    @staticmethod
+    def _native_result(line, lines_of):
+        number, agent = lines_of.get(line.get("custom_id"), (None, None))
+        result = {"id": line.get("custom_id"), "line": number, "agent": agent}
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            error = line.get("error") or body.get("error") or {}
+            message = error.get("message") if isinstance(error, dict) else str(error)
+            result.update(status="error", error=message or f"HTTP {response.get('status_code')}")
+        else:
+            choice = (body.get("choices") or [{}])[0]
+            result.update(status="ok", model=body.get("model"), answer=(choice.get("message") or {}).get("content"),
+                          usage=body.get("usage"))
+        BATCH_JOBS.labels(result["status"]).inc()
+        return result
+
+    def stats(self):
+        return {"concurrency": self.concurrency, "rps": self.rps, "retries": self.retries,
+                "running": self.running, "directory": self.directory}
+
+    @classmethod
+    def from_env(cls):
+        """Builds the runner from BATCH_* variables, or returns None if disabled."""
+        if os.getenv("BATCH", "false").lower() != "true":
+            return None
+        return cls(
+            os.getenv("BATCH_DIR") or os.path.join(tempfile.gettempdir(), "gravitas-batches"),
+            concurrency=int(os.getenv("BATCH_CONCURRENCY", 4)),
+            rps=float(os.getenv("BATCH_RPS", 0)),
+            retries=int(os.getenv("BATCH_RETRIES", 3)),
+            backoff=float(os.getenv("BATCH_BACKOFF", 1.0)),
+            max_backoff=float(os.getenv("BATCH_MAX_BACKOFF", 60)),
+            max_jobs=int(os.getenv("BATCH_MAX_JOBS", 5000)),
+            window=os.getenv("BATCH_WINDOW", "24h"),
+        )
@@ -0,0 +1,127 @@
+"""Admission control under overload: open-loop load at a multiple of capacity.
+
+    python benchmarks/bench_admission.py [--overload 5] [--duration 20] [--mode wsgi|asgi]
+
+Starts the fake provider (each answer streams for about --stream seconds)
+and one server worker, then fires /api/chat requests at a steady arrival
+rate of --overload times what the worker can serve (ADMISSION_MAX_IN_FLIGHT
+streams / --stream seconds), each from its own client key, in two setups:
+
+  unlimited   ADMISSION_MAX_IN_FLIGHT=0 (the behaviour before admission.py)
+  admission   ADMISSION_MAX_IN_FLIGHT=4, ADMISSION_QUEUE_SIZE=3
+
+For each it reports how many requests were served, rejected (429/503,
+with Retry-After) or failed/timed out, the p50/p99 TTFT and total time of
+served streams and the p99 time to a rejection. Without admission every
+request is accepted and waits for a thread, so latency grows for as long
+as the overload lasts; with it the served streams keep a flat p99 and the
+excess is turned away in milliseconds.
+
+--rpm additionally rate-limits the fake provider, to exercise the
+provider pacing in providers.RateLimitPacer; its 429 count is printed.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import percentile
+from bench_ttft import start_server
+from sse import EventParser
+
+PROMPT = "How can I improve my executive presence as a leader?"
+SETUPS = {
+    "unlimited": {"ADMISSION_MAX_IN_FLIGHT": "0"},
+    "admission": {"ADMISSION_MAX_IN_FLIGHT": "4", "ADMISSION_QUEUE_SIZE": "3", "ADMISSION_QUEUE_TIMEOUT": "10"},
+}
+
+
+async def one_request(client, url, n, timeout):
+    start = time.perf_counter()
+    ttft = None
+    try:
+        async with client.stream("POST", url, headers={"X-API-Key": f"client-{n}"}, timeout=timeout,
+                                 json={"messages": [{"role": "user", "content": f"{PROMPT} #{n}"}]}) as resp:
+            if resp.status_code in (429, 503):
+                await resp.aread()
+                return "rejected", time.perf_counter() - start, None, resp.headers.get("retry-after")
+            resp.raise_for_status()
+            parser = EventParser()
+            async for chunk in resp.aiter_bytes():
+                for event in parser.feed(chunk):
+                    if event.event != "message":
+                        continue  # queue/progress event: not answer text
+                    if event.data.startswith("[Error]"):
+                        return "failed", time.perf_counter() - start, None, None
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+    except httpx.HTTPError:
+        return "failed", time.perf_counter() - start, None, None
+    return "served", time.perf_counter() - start, ttft, None
+
+
+async def open_loop(url, rate, duration, timeout):
+    """Launches requests at `rate` per second for `duration` seconds, regardless of completions."""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=50)
+    async with httpx.AsyncClient(limits=limits) as client:
+        tasks = []
+        start = time.perf_counter()
+        n = 0
+        while time.perf_counter() - start < duration:
+            tasks.append(asyncio.create_task(one_request(client, url, n, timeout)))
+            n += 1
+            await asyncio.sleep(max(0.0, start + n / rate - time.perf_counter()))
+        return await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--overload", type=float, default=5.0, help="offered load as a multiple of capacity")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of offered load")
+    parser.add_argument("--stream", type=float, default=2.0, help="seconds per streamed answer")
+    parser.add_argument("--timeout", type=float, default=60.0, help="client timeout per request")
+    parser.add_argument("--rpm", type=int, default=0, help="fake provider requests per minute (0 = unlimited)")
+    parser.add_argument("--port", type=int, default=8961)
+    parser.add_argument("--provider-port", type=int, default=8960)
+    args = parser.parse_args()
+
+    ttft = 0.3
+    tokens = 40
+    provider = fake_provider.spawn(args.provider_port, ttft=ttft, tokens=tokens,
+                                   tps=tokens / max(0.1, args.stream - ttft), rpm=args.rpm)
+    capacity = 4 / args.stream
+    rate = capacity * args.overload
+    url = f"http://127.0.0.1:{args.port}/api/chat"
+    try:
+        print(f"mode={args.mode} capacity ~{capacity:.1f} req/s, offered {rate:.1f} req/s for {args.duration:.0f}s")
+        print(f"{'setup':>10} {'served':>7} {'rejected':>9} {'failed':>7} {'ttft p50':>9} {'ttft p99':>9} "
+              f"{'total p99':>10} {'reject p99':>11}")
+        for name, env in SETUPS.items():
+            env = dict(env, RESPONSE_CACHE="false", SEMANTIC_CACHE="false", HTTP_WARMUP="0")
+            server, _ = start_server(args.mode, args.port, args.provider_port, env)
+            try:
+                results = asyncio.run(open_loop(url, rate, args.duration, args.timeout))
+            finally:
+                server.terminate()
+                server.wait()
+            served = [r for r in results if r[0] == "served"]
+            rejected = [r for r in results if r[0] == "rejected"]
+            failed = len(results) - len(served) - len(rejected)
+            ttfts = [r[2] for r in served if r[2] is not None]
+            print(f"{name:>10} {len(served):>7} {len(rejected):>9} {failed:>7} "
+                  f"{percentile(ttfts, 50):>8.2f}s {percentile(ttfts, 99):>8.2f}s "
+                  f"{percentile([r[1] for r in served], 99):>9.2f}s "
+                  f"{percentile([r[1] for r in rejected], 99) * 1000:>9.0f}ms")
+        if args.rpm:
+            state = httpx.get(f"http://127.0.0.1:{args.provider_port}/control").json()
+            print(f"provider: {state['requests']} requests, {state['throttled']} answered 429")
+    finally:
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Page-load cost of the index and its static assets, with and without the asset pipeline.
+
+    python benchmarks/bench_assets.py [--loads 200] [--mode wsgi|asgi]
+
+Starts the fake provider (nothing here calls it) and a server with ASSETS
+off, then one with it on. Each run loads the page --loads times the way a
+browser does: GET / and then every /static/ URL the HTML references.
+
+  cold  an empty browser cache: every request is made in full
+  warm  a browser with everything cached from the first load: URLs sent
+        with an immutable Cache-Control are not requested at all, the rest
+        are revalidated with If-None-Match / If-Modified-Since
+
+For each it reports requests and bytes transferred per load (as received,
+so compressed where the server compressed), the median time per load and
+the server's CPU seconds per 1000 loads, and the requests that failed.
+"""
+import argparse
+import re
+import statistics
+import time
+
+import httpx
+
+import fake_provider
+from bench_coalesce import cpu_seconds
+from bench_ttft import start_server
+
+ACCEPT = {"Accept-Encoding": "gzip, deflate, br"}
+STATIC_URL = re.compile(r"""["'](/static/[^"']+)["']""")
+
+
+class Browser:
+    """Just enough of a browser HTTP cache: immutable entries are reused, others revalidated."""
+
+    def __init__(self, client):
+        self.client = client
+        self.cache = {}  # url -> response headers
+        self.html = ""
+        self.errors = 0
+
+    def get(self, url):
+        """(requests, bytes, body) for one URL."""
+        cached = self.cache.get(url)
+        if cached is not None and "immutable" in cached.get("cache-control", ""):
+            return 0, 0, None
+        headers = dict(ACCEPT)
+        if cached is not None:
+            if "etag" in cached:
+                headers["If-None-Match"] = cached["etag"]
+            if "last-modified" in cached:
+                headers["If-Modified-Since"] = cached["last-modified"]
+        resp = self.client.get(url, headers=headers)
+        self.errors += resp.status_code >= 400
+        if resp.status_code == 200:
+            self.cache[url] = resp.headers
+        # Status line, headers and the body as sent (before decompression).
+        sent = len(resp.http_version) + 12 + sum(len(k) + len(v) + 4 for k, v in resp.headers.items()) + 2
+        return 1, sent + resp.num_bytes_downloaded, resp.text if resp.status_code == 200 else None
+
+    def load(self, base):
+        """(requests, bytes) for one page load."""
+        requests, transferred, html = self.get(f"{base}/")
+        self.html = html or self.html
+        for url in dict.fromkeys(STATIC_URL.findall(self.html)):
+            n, size, _ = self.get(base + url)
+            requests += n
+            transferred += size
+        return requests, transferred
+
+
+def run(base, pid, loads, warm):
+    """Per-load requests and bytes, median seconds per load, CPU seconds per 1000 loads, errors."""
+    with httpx.Client(timeout=30) as client:
+        browser = Browser(client)
+        if warm:
+            browser.load(base)
+            browser.errors = 0
+        times, requests, transferred = [], 0, 0
+        cpu = cpu_seconds(pid)
+        for _ in range(loads):
+            if not warm:
+                browser.cache.clear()
+            start = time.perf_counter()
+            n, size = browser.load(base)
+            times.append(time.perf_counter() - start)
+            requests += n
+            transferred += size
+        cpu = cpu_seconds(pid) - cpu
+    return requests / loads, transferred / loads, statistics.median(times), cpu * 1000 / loads, browser.errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loads", type=int, default=200)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--port", type=int, default=8971)
+    parser.add_argument("--provider-port", type=int, default=8970)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port)
+    base = f"http://127.0.0.1:{args.port}"
+    print(f"mode={args.mode}: {args.loads} page loads per run")
+    print(f"{'run':>14} {'requests':>9} {'bytes':>9} {'ms/load':>8} {'cpu s/1k':>9} {'errors':>7}")
+    try:
+        for label, enabled in (("ASSETS=false", "false"), ("ASSETS=true", "true")):
+            server, _ = start_server(args.mode, args.port, args.provider_port,
+                                     {"ASSETS": enabled, "HTTP_WARMUP": "0"})
+            try:
+                for cache in ("cold", "warm"):
+                    requests, transferred, seconds, cpu, errors = run(base, server.pid, args.loads, cache == "warm")
+                    print(f"{label + ' ' + cache:>14} {requests:>9.1f} {transferred:>9.0f} "
+                          f"{seconds * 1000:>8.2f} {cpu:>9.2f} {errors:>7}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
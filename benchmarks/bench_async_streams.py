@@ -0,0 +1,120 @@
+"""Concurrent-stream capacity of /api/chat against the local fake provider.
+
+Starts the fake provider, boots one server worker in the chosen mode and
+opens N simultaneous SSE streams per level, reporting how many complete and
+the p50/p99 time-to-first-token seen by clients:
+
+    python benchmarks/bench_async_streams.py --mode asgi --levels 50,200,500
+    python benchmarks/bench_async_streams.py --mode wsgi --levels 8,50,200
+
+``asgi`` runs ``uvicorn asgi:app``; ``wsgi`` runs the Procfile's gunicorn
+setup with a single worker (4 threads) for a per-worker comparison.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+import fake_provider
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)  # the app's own modules, e.g. sse.EventParser for reading streams
+PROMPT = "How can I improve my executive presence as a leader?"
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def start_server(mode, port, provider_port):
+    # Admission control off: this measures raw stream capacity from one client IP.
+    env = dict(os.environ, PROVIDER="openai", GRAVITAS_AI_KEY="fake-key", ADMISSION_MAX_IN_FLIGHT="0",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{provider_port}/v1")
+    if mode == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port),
+               "--log-level", "warning", "--backlog", "4096"]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "--workers", "1", "--threads", "4",
+               "--timeout", "120", "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not come up on port {port}")
+
+
+async def one_stream(client, url):
+    start = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", url, json={"messages": [{"role": "user", "content": PROMPT}]}) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            if ttft is None and b"data:" in chunk:
+                ttft = time.perf_counter() - start
+    return ttft, time.perf_counter() - start
+
+
+async def run_level(url, concurrency, timeout):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one_stream(client, url) for _ in range(concurrency)),
+                                       return_exceptions=True)
+        wall = time.perf_counter() - start
+    ok = [r for r in results if not isinstance(r, BaseException) and r[0] is not None]
+    ttfts = [r[0] for r in ok]
+    totals = [r[1] for r in ok]
+    return {
+        "concurrency": concurrency,
+        "completed": len(ok),
+        "failed": concurrency - len(ok),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p99": percentile(ttfts, 99),
+        "total_p99": percentile(totals, 99),
+        "wall": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="asgi")
+    parser.add_argument("--levels", default="50,200,500", help="comma-separated concurrent stream counts")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--provider-port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, default=0.3, help="fake provider time-to-first-token (s)")
+    parser.add_argument("--tps", type=float, default=40.0, help="fake provider tokens per second")
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per fake completion")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=args.ttft, tps=args.tps, tokens=args.tokens)
+    server = start_server(args.mode, args.port, args.provider_port)
+    url = f"http://127.0.0.1:{args.port}/api/chat"
+    try:
+        print(f"mode={args.mode} provider ttft={args.ttft}s tps={args.tps} tokens={args.tokens}")
+        print(f"{'streams':>8} {'done':>6} {'failed':>6} {'ttft p50':>9} {'ttft p99':>9} {'total p99':>10} {'wall':>7}")
+        for level in (int(x) for x in args.levels.split(",")):
+            r = asyncio.run(run_level(url, level, args.timeout))
+            print(f"{r['concurrency']:>8} {r['completed']:>6} {r['failed']:>6} {r['ttft_p50']:>8.3f}s "
+                  f"{r['ttft_p99']:>8.3f}s {r['total_p99']:>9.3f}s {r['wall']:>6.2f}s")
+    finally:
+        for proc in (server, provider):
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""/api/batch throughput against one /api/chat stream at a time.
+
+    python benchmarks/bench_batch.py [--jobs 200] [--concurrency 1,4,8,16] [--mode wsgi|asgi]
+                                     [--rpm 0] [--error-rate 0] [--native]
+
+Starts the fake provider (no API spend) and, for each --concurrency, a
+server with BATCH_CONCURRENCY set to it, then posts --jobs scripted
+coaching prompts (a mix of named agents and auto-routed ones) as one
+JSONL batch and reads the streamed results. The baseline posts the same
+prompts to /api/chat one SSE stream after another, the way the cohort
+scripts did before (at most --baseline-jobs of them; the rate is what
+counts).
+
+For each run it reports jobs per second, wall time, the jobs that failed,
+the retries the runner made (gravitas_batch_retries_total) and the
+requests the provider saw and throttled. --rpm gives the provider a
+requests-per-minute limit with 429s and x-ratelimit headers, to see the
+pacing and retries at work; --error-rate fails that share of provider
+requests with a 500. --native also submits the batch to the provider's
+batch API emulation and reports the time until its results are in.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import httpx
+
+import fake_provider
+from bench_ttft import start_server
+from sse import EventParser
+
+SCENARIOS = [
+    (None, "My team missed its quarterly target. How do I lead the review meeting tomorrow?"),
+    ("eidos", "A direct report cried in our one-on-one. How do I respond with empathy as their manager?"),
+    ("ethos", "Help me persuade the leadership team to fund a second support shift."),
+    ("gravis", "How do I keep my composure when the CEO challenges my numbers in public?"),
+    ("kinesis", "What should my posture and gestures say when I open an all-hands meeting?"),
+    (None, "I am a new manager of my former peers. How do I set boundaries without losing trust?"),
+    ("virtus", "Which Roman virtue should guide a leader announcing layoffs?"),
+    (None, "Give me feedback phrasing for an engineer who keeps interrupting the team."),
+]
+
+
+def batch_body(jobs):
+    lines = []
+    for n in range(jobs):
+        agent, prompt = SCENARIOS[n % len(SCENARIOS)]
+        job = {"id": f"participant-{n}", "messages": [{"role": "user", "content": f"{prompt} (participant {n})"}]}
+        if agent:
+            job["agent"] = agent
+        lines.append(json.dumps(job))
+    return "\n".join(lines)
+
+
+def metric(text, name):
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(name))
+
+
+def run_batch(base, body, timeout):
+    """(seconds, summary) for one streamed batch."""
+    start = time.perf_counter()
+    summary = None
+    with httpx.stream("POST", f"{base}/api/batch", content=body, timeout=timeout) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            item = json.loads(line)
+            if "summary" in item:
+                summary = item["summary"]
+    return time.perf_counter() - start, summary
+
+
+def run_sequential(base, body, timeout):
+    """(seconds, failed) posting each job to /api/chat in turn."""
+    start, failed = time.perf_counter(), 0
+    with httpx.Client(timeout=timeout) as client:
+        for line in body.splitlines():
+            job = json.loads(line)
+            parser, error = EventParser(), False
+            with client.stream("POST", f"{base}/api/chat", json={"messages": job["messages"]}) as resp:
+                for chunk in resp.iter_bytes():
+                    error = error or any(e.data.startswith("[Error]") for e in parser.feed(chunk))
+            failed += error or resp.status_code != 200
+    return time.perf_counter() - start, failed
+
+
+def run_native(base, body, timeout):
+    """Seconds from submitting a native batch until its results are in."""
+    start = time.perf_counter()
+    resp = httpx.post(f"{base}/api/batch?native=true", content=body, timeout=timeout)
+    resp.raise_for_status()
+    batch_id = resp.json()["batch_id"]
+    while time.perf_counter() - start < timeout:
+        status = httpx.get(f"{base}/api/batch/{batch_id}", timeout=timeout).json()
+        if status["state"] != "running":
+            return time.perf_counter() - start, status
+        time.sleep(0.2)
+    return None, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--concurrency", default="1,4,8,16", help="comma-separated BATCH_CONCURRENCY values")
+    parser.add_argument("--baseline-jobs", type=int, default=40)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tps", type=float, default=80.0)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--rpm", type=int, default=0, help="provider requests per minute (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--native", action="store_true", help="also time the provider batch API path")
+    parser.add_argument("--port", type=int, default=8961)
+    parser.add_argument("--provider-port", type=int, default=8960)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=args.ttft, tps=args.tps, tokens=args.tokens,
+                                   rpm=args.rpm, error_rate=args.error_rate, batch_delay=2.0, seed=1)
+    control = httpx.Client(base_url=f"http://127.0.0.1:{args.provider_port}", timeout=10)
+    base = f"http://127.0.0.1:{args.port}"
+    body = batch_body(args.jobs)
+    env = {"BATCH": "true", "HTTP_WARMUP": "0", "RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false",
+           "SINGLE_FLIGHT": "false", "BATCH_BACKOFF": "0.5"}
+    print(f"mode={args.mode}: {args.jobs} jobs, provider ttft {args.ttft}s, {args.tokens} tokens at {args.tps:.0f}/s"
+          f"{f', {args.rpm} rpm' if args.rpm else ''}{f', {args.error_rate:.0%} errors' if args.error_rate else ''}")
+    print(f"{'run':>22} {'jobs/s':>8} {'wall s':>8} {'failed':>7} {'retries':>8} {'upstream':>9} {'throttled':>10}")
+    try:
+        with tempfile.TemporaryDirectory(prefix="gravitas-batch-") as tmp:
+            runs = [("baseline", 1)] + [(f"batch c={c}", int(c)) for c in args.concurrency.split(",")]
+            for label, concurrency in runs:
+                server, _ = start_server(args.mode, args.port, args.provider_port,
+                                         dict(env, BATCH_CONCURRENCY=str(concurrency), BATCH_DIR=tmp))
+                try:
+                    before = control.get("/control").json()
+                    if label == "baseline":
+                        jobs = min(args.jobs, args.baseline_jobs)
+                        seconds, failed = run_sequential(base, "\n".join(body.splitlines()[:jobs]), 600)
+                    else:
+                        jobs = args.jobs
+                        seconds, summary = run_batch(base, body, 3600)
+                        failed = summary["error"] + summary["cancelled"]
+                    after = control.get("/control").json()
+                    retries = metric(httpx.get(f"{base}/metrics").text, "gravitas_batch_retries_total")
+                    print(f"{label:>22} {jobs / seconds:>8.1f} {seconds:>8.1f} {failed:>7} {retries:>8.0f} "
+                          f"{after['requests'] - before['requests']:>9} {after['throttled'] - before['throttled']:>10}")
+                    if args.native and label == runs[-1][0]:
+                        seconds, status = run_native(base, body, 600)
+                        print(f"{'native batch API':>22} {args.jobs / seconds if seconds else 0:>8.1f} "
+                              f"{seconds or 0:>8.1f} {status['error']:>7} {'-':>8} {'-':>9} {'-':>10}")
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
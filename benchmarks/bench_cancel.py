@@ -0,0 +1,128 @@
+"""Upstream cancellation when a client drops or stops a stream.
+
+    python benchmarks/bench_cancel.py [--mode wsgi|asgi] [--trials 10] [--tps 20]
+
+Starts a slow fake provider (--tokens at --tps: a 20 s answer by default)
+and one server worker, streams a few warm-up answers to completion, then
+runs --trials streams of each kind one at a time:
+
+  disconnect  read --after answer frames, then drop the connection (a
+              closed tab)
+  stop        read --after answer frames, then POST /api/chat/<id>/stop
+              (the stop button) and read the stream to its end
+
+For each it reports the time from the client's action until the fake
+provider sees its upstream stream closed (p50 / max), in units of the
+provider's chunk interval as well, and the tokens the provider generated
+per cancelled stream out of a full answer. Afterwards /api/health must
+show no open streams, and the cancellation counters from /metrics are
+printed.
+"""
+import argparse
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import percentile
+from bench_ttft import start_server
+from sse import EventParser
+
+PROMPT = "How can I improve my executive presence as a leader?"
+
+
+# One pooled client for the polling: a fresh httpx.get costs ~50 ms of client setup.
+control = httpx.Client(timeout=10)
+
+
+def provider_state(port):
+    return control.get(f"http://127.0.0.1:{port}/control").json()
+
+
+def wait_until_idle(port, timeout=30.0):
+    """Polls the fake provider until no stream is in progress."""
+    deadline = time.perf_counter() + timeout
+    while provider_state(port)["active"]:
+        if time.perf_counter() > deadline:
+            raise RuntimeError("the provider stream was never closed")
+        time.sleep(0.002)
+
+
+def one_trial(base, provider_port, kind, after):
+    """Returns (seconds until the upstream closed, tokens the provider generated)."""
+    generated = provider_state(provider_port)["generated"]
+    client = httpx.Client(timeout=60)
+    try:
+        with client.stream("POST", f"{base}/api/chat",
+                           json={"messages": [{"role": "user", "content": PROMPT}]}) as resp:
+            resp.raise_for_status()
+            parser, frames = EventParser(), 0
+            chunks = resp.iter_bytes()
+            for chunk in chunks:
+                frames += sum(event.event == "message" for event in parser.feed(chunk))
+                if frames >= after:
+                    break
+            start = time.perf_counter()
+            if kind == "disconnect":
+                resp.close()  # unread body: the connection is dropped, not reused
+                client.close()
+            else:
+                control.post(f"{base}/api/chat/{resp.headers['x-stream-id']}/stop").raise_for_status()
+                for _ in chunks:
+                    pass
+            wait_until_idle(provider_port)
+            closed = time.perf_counter() - start
+    finally:
+        client.close()
+    return closed, provider_state(provider_port)["generated"] - generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--tps", type=float, default=20.0, help="provider tokens per second")
+    parser.add_argument("--tokens", type=int, default=400, help="tokens in a full answer")
+    parser.add_argument("--after", type=int, default=5, help="answer frames read before cancelling")
+    parser.add_argument("--port", type=int, default=8931)
+    parser.add_argument("--provider-port", type=int, default=8930)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=0.2, tps=2000, tokens=args.tokens)
+    env = {"RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "HTTP_WARMUP": "0"}
+    server, _ = start_server(args.mode, args.port, args.provider_port, env)
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        # Complete answers first: they set the average length behind the "saved" estimate.
+        for _ in range(3):
+            httpx.post(f"{base}/api/chat", json={"messages": [{"role": "user", "content": PROMPT}]}, timeout=60)
+        httpx.post(f"http://127.0.0.1:{args.provider_port}/control", json={"tps": args.tps})
+
+        interval = 1.0 / args.tps
+        print(f"mode={args.mode} full answer {args.tokens} tokens over {args.tokens / args.tps:.0f}s, "
+              f"chunk interval {interval * 1000:.0f} ms")
+        print(f"{'kind':>10} {'close p50':>10} {'close max':>10} {'max/chunk':>10} {'tokens/stream':>14}")
+        for kind in ("disconnect", "stop"):
+            closes, tokens = [], []
+            for _ in range(args.trials):
+                closed, generated = one_trial(base, args.provider_port, kind, args.after)
+                closes.append(closed)
+                tokens.append(generated)
+            print(f"{kind:>10} {percentile(closes, 50) * 1000:>8.0f}ms {max(closes) * 1000:>8.0f}ms "
+                  f"{max(closes) / interval:>10.1f} {sum(tokens) / len(tokens):>8.1f} / {args.tokens}")
+
+        health = httpx.get(f"{base}/api/health").json()
+        print(f"open streams after the run: {health['streams']['active']}, "
+              f"in flight: {health['admission']['in_flight']}")
+        for line in httpx.get(f"{base}/metrics").text.splitlines():
+            if line.startswith(("gravitas_cancel", "gravitas_chat_requests_total")):
+                print(line)
+    finally:
+        server.terminate()
+        server.wait()
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
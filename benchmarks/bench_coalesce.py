@@ -0,0 +1,118 @@
+"""SSE frame coalescing: frames per response, worker CPU and perceived latency.
+
+    python benchmarks/bench_coalesce.py [--mode wsgi|asgi] [--streams 4] [--rounds 3]
+
+Starts the fake provider streaming small sub-word chunks (--chunk-chars at
+--cps chunks per second) and one server worker, then runs rounds of
+--streams concurrent /api/chat requests with each request's "coalesce"
+option set to:
+
+  off       {"coalesce": false}                 one SSE frame per chunk
+  default   SSE_FLUSH_BYTES / SSE_FLUSH_MS      (160 bytes / 30 ms)
+  wide      {"coalesce": {"bytes": 512, "ms": 80}}
+
+For each it reports SSE frames per response, worker CPU seconds per
+response (utime + stime of the worker process from /proc), client-seen
+TTFT p50, the p95 gap between frames (how long text sits in the buffer)
+and the total stream time. Linux only, for the /proc CPU counters.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import percentile
+from bench_ttft import start_server
+from sse import EventParser
+
+OPTIONS = {
+    "off": False,
+    "default": None,
+    "wide": {"bytes": 512, "ms": 80},
+}
+PROMPT = "How can I improve my executive presence as a leader?"
+
+
+def cpu_seconds(pid):
+    """utime + stime of a process and its children (the gunicorn worker)."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return total
+
+
+async def one_stream(client, url, option):
+    body = {"messages": [{"role": "user", "content": PROMPT}]}
+    if option is not None:
+        body["coalesce"] = option
+    start = time.perf_counter()
+    arrivals, parser = [], EventParser()
+    async with client.stream("POST", url, json=body) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            for _ in parser.feed(chunk):
+                arrivals.append(time.perf_counter() - start)
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    return arrivals[0], len(arrivals), gaps, time.perf_counter() - start
+
+
+async def run_round(url, option, streams):
+    async with httpx.AsyncClient(timeout=120) as client:
+        return await asyncio.gather(*(one_stream(client, url, option) for _ in range(streams)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--streams", type=int, default=4, help="concurrent streams per round")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--tokens", type=int, default=400, help="words per completion")
+    parser.add_argument("--chunk-chars", type=int, default=3)
+    parser.add_argument("--cps", type=float, default=400, help="provider chunks per second")
+    parser.add_argument("--port", type=int, default=8951)
+    parser.add_argument("--provider-port", type=int, default=8950)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=0.2, tps=args.cps, tokens=args.tokens,
+                                   chunk_chars=args.chunk_chars)
+    env = {"RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "HTTP_WARMUP": "0"}
+    server, _ = start_server(args.mode, args.port, args.provider_port, env)
+    url = f"http://127.0.0.1:{args.port}/api/chat"
+    try:
+        print(f"mode={args.mode} {args.streams} streams x {args.rounds} rounds, "
+              f"{args.chunk_chars}-char chunks at {args.cps:.0f}/s")
+        print(f"{'coalesce':>9} {'frames/resp':>12} {'cpu ms/resp':>12} {'ttft p50':>9} "
+              f"{'gap p95':>8} {'total p50':>10}")
+        for name, option in OPTIONS.items():
+            asyncio.run(run_round(url, option, 2))  # warm the worker's provider connections
+            before = cpu_seconds(server.pid)
+            results = []
+            for _ in range(args.rounds):
+                results += asyncio.run(run_round(url, option, args.streams))
+            cpu = (cpu_seconds(server.pid) - before) / len(results)
+            frames = sum(r[1] for r in results) / len(results)
+            gaps = [gap for r in results for gap in r[2]]
+            print(f"{name:>9} {frames:>12.1f} {cpu * 1000:>12.1f} {percentile([r[0] for r in results], 50):>8.3f}s "
+                  f"{percentile(gaps, 95) * 1000:>6.0f}ms {percentile([r[3] for r in results], 50):>9.2f}s")
+    finally:
+        server.terminate()
+        server.wait()
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Request size and server CPU per turn: full-history vs conversation-id mode.
+
+    python benchmarks/bench_conversations.py [--turns 1,20,100] [--shared]
+
+Replays synthetic conversations turn by turn, as static/app.js does. In
+full-history mode every request carries the whole conversation; in
+conversation-id mode it carries only the new user message. For each turn
+count it reports the request body size and the server-side CPU per request
+(JSON decode + parse_chat_payload + build_request, i.e. everything before
+the provider call). --shared puts the store on a temporary SQLite log, as
+with CONVERSATION_DB across gunicorn workers.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as gravitas  # noqa: E402
+from conversations import ConversationStore, SQLiteConversationLog  # noqa: E402
+
+QUESTION = "How should I handle the board's reaction to the restructuring plan? "
+ANSWER = "Here are three steps to consider for a calm and credible message. "
+
+
+def user_message(rng):
+    return {"role": "user", "content": QUESTION * rng.randint(1, 4)}
+
+
+def server_side(body: bytes):
+    data = json.loads(body)
+    messages, conversation_id, error, status = gravitas.parse_chat_payload(data)
+    assert error is None, error
+    gravitas.build_request(messages, None)
+    return conversation_id
+
+
+def replay(turns, mode, rng):
+    """Returns (bytes, seconds) of the last turn's request."""
+    history, conversation_id = [], None
+    size = elapsed = 0
+    for turn in range(turns):
+        message = user_message(rng)
+        history.append(message)
+        if mode == "full":
+            payload = {"messages": history}
+        elif conversation_id is None:
+            payload = {"messages": history, "conversation": True}
+        else:
+            payload = {"conversation_id": conversation_id, "message": message}
+        body = json.dumps(payload).encode()
+        start = time.perf_counter()
+        returned_id = server_side(body)
+        elapsed = time.perf_counter() - start
+        size = len(body)
+        answer = ANSWER * rng.randint(10, 40)
+        history.append({"role": "assistant", "content": answer})
+        if returned_id:
+            conversation_id = returned_id
+            gravitas.conversations.append(conversation_id, "assistant", answer)
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", default="1,20,100")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--shared", action="store_true", help="back the store with a SQLite log")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteConversationLog(os.path.join(tmp, "conversations.db")) if args.shared else None
+        gravitas.conversations = ConversationStore(backend=backend)
+        print(f"shared backend: {bool(backend)}")
+        print(f"{'turns':>6} {'full bytes':>11} {'full us':>9} {'id bytes':>9} {'id us':>8} {'bytes saved':>12}")
+        for turns in (int(x) for x in args.turns.split(",")):
+            results = {}
+            for mode in ("full", "id"):
+                rng = random.Random(turns)
+                runs = [replay(turns, mode, rng) for _ in range(args.conversations)]
+                results[mode] = (sum(r[0] for r in runs) / len(runs), sum(r[1] for r in runs) / len(runs))
+            (full_bytes, full_s), (id_bytes, id_s) = results["full"], results["id"]
+            print(f"{turns:>6} {full_bytes:>11.0f} {full_s * 1e6:>9.1f} {id_bytes:>9.0f} {id_s * 1e6:>8.1f} "
+                  f"{1 - id_bytes / full_bytes:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
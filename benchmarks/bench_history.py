@@ -0,0 +1,83 @@
+"""Prompt size and trimming cost: token budgets vs the old 10-message window.
+
+    python benchmarks/bench_history.py [--model llama3-70b-8192] [--summary]
+
+Builds synthetic conversations (short acknowledgements mixed with pasted
+speeches and long coaching answers) and replays them turn by turn, as the
+client does. For each conversation length it reports the average and
+maximum prompt tokens under the legacy MAX_HISTORY=10 window and under
+HistoryManager, how many turns overflow the model's budget, and the
+per-request trimming cost with the per-message token cache warm.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryManager, MESSAGE_OVERHEAD, estimate_tokens  # noqa: E402
+
+SYSTEM = {"role": "system", "content": "You are Praxis, the Leadership Presence Coach of GravitasGPT. " * 8}
+SHORT = ["ok", "thanks", "got it", "why?", "can you say more?", "yes", "that helps"]
+SENTENCE = "We need to restructure the regional teams before the next quarter and I want to explain it calmly. "
+
+
+def conversation(turns, rng):
+    messages = []
+    for i in range(turns):
+        if rng.random() < 0.2:
+            user = SENTENCE * rng.randint(20, 80)  # pasted speech or transcript
+        elif rng.random() < 0.5:
+            user = rng.choice(SHORT)
+        else:
+            user = "How should I handle the board's reaction to the restructuring plan? " * rng.randint(1, 3)
+        messages.append({"role": "user", "content": user})
+        if i < turns - 1:
+            messages.append({"role": "assistant", "content": "Here are three steps to consider. " * rng.randint(10, 60)})
+    return messages
+
+
+def legacy_tokens(messages):
+    window = [SYSTEM] + messages
+    if len(window) > 11:
+        window = [window[0]] + window[-10:]
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD for m in window)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="llama3-70b-8192")
+    parser.add_argument("--summary", action="store_true", help="collapse dropped turns into a summary")
+    parser.add_argument("--conversations", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    manager = HistoryManager(summarize=args.summary)
+    budget = manager.budget_for(args.model)
+    print(f"model={args.model} budget={budget} tokens summary={args.summary}")
+    print(f"{'turns':>6} {'legacy avg':>11} {'legacy max':>11} {'over budget':>12} "
+          f"{'budget avg':>11} {'budget max':>11} {'saved/req':>10} {'trim us':>8}")
+    for turns in (10, 50, 200):
+        legacy, trimmed, saved, over, cost = [], [], [], 0, 0.0
+        for _ in range(args.conversations):
+            full = conversation(turns, rng)
+            # Replay turn by turn: each request carries the history so far.
+            for end in range(1, len(full) + 1, 2):
+                history = full[:end]
+                old = legacy_tokens(history)
+                legacy.append(old)
+                over += old > budget
+                start = time.perf_counter()
+                result = manager.trim(SYSTEM, history, args.model)
+                cost += time.perf_counter() - start
+                trimmed.append(result.prompt_tokens)
+                saved.append(result.saved_tokens)
+        n = len(trimmed)
+        print(f"{turns:>6} {sum(legacy) / n:>11.0f} {max(legacy):>11} {over / n:>11.0%} "
+              f"{sum(trimmed) / n:>11.0f} {max(trimmed):>11} {sum(saved) / n:>10.0f} {cost / n * 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
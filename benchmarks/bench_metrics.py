@@ -0,0 +1,109 @@
+"""Instrumentation overhead: metrics + structured logging vs request CPU.
+
+    python benchmarks/bench_metrics.py [--chunks 200] [--requests 40]
+
+Two measurements:
+
+1. Instrumentation CPU per request: everything the request thread and the
+   log listener do for one stream -- ChatTiming with its chunk counter,
+   the routing, connect and TTFT histograms, one inter-token-gap
+   observation per chunk and the "chat ok" log record (formatted by the
+   listener thread into /dev/null) -- timed in a loop with
+   time.process_time().
+2. Request CPU: utime + stime of one gunicorn worker streaming --requests
+   answers of --chunks chunks each from the fake provider.
+
+The ratio of the two is the instrumentation's share of request CPU.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import ROOT
+from bench_coalesce import cpu_seconds
+from bench_ttft import start_server
+
+sys.path.insert(0, ROOT)
+
+
+def instrumentation_cpu(chunks, rounds):
+    """Process CPU seconds per simulated request spent on metrics and logging."""
+    sys.stdout = open(os.devnull, "w")  # the log listener writes here
+    os.environ.setdefault("GRAVITAS_AI_KEY", "fake-key")
+    import app as gravitas
+    from providers import INTER_TOKEN_GAP, UPSTREAM_CONNECT
+
+    listener = __import__("logs")._state["listener"]
+    tokens = ["tok"] * chunks
+    start = time.process_time()
+    for _ in range(rounds):
+        timing = gravitas.ChatTiming()
+        gravitas.ROUTING_SECONDS.labels("eidos").observe(0.0001)
+        timing.agent, timing.model = "eidos", "gpt-4o"
+        UPSTREAM_CONNECT.labels("openai").observe(0.2)
+        gap = INTER_TOKEN_GAP.labels("openai")
+        for i, _ in enumerate(timing.count(tokens)):
+            if i:
+                gap.observe(0.02)
+            else:
+                timing.first_frame()
+                timing.provider = "openai"
+        timing.finish("ok")
+    listener.stop()  # drain the queue so the formatting CPU is counted
+    elapsed = time.process_time() - start
+    sys.stdout = sys.__stdout__
+    return elapsed / rounds
+
+
+async def drive(url, requests, concurrency):
+    async with httpx.AsyncClient(timeout=120) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(n):
+            async with semaphore:
+                body = {"messages": [{"role": "user", "content": f"How do I lead with presence? #{n}"}]}
+                async with client.stream("POST", url, json=body) as resp:
+                    async for _ in resp.aiter_bytes():
+                        pass
+        await asyncio.gather(*(one(n) for n in range(requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200, help="content chunks per answer")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=5000, help="simulated requests for the micro-benchmark")
+    parser.add_argument("--port", type=int, default=8981)
+    parser.add_argument("--provider-port", type=int, default=8980)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=0.05, tps=2000, tokens=args.chunks)
+    env = {"RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "HTTP_WARMUP": "0"}
+    server, _ = start_server("wsgi", args.port, args.provider_port, env)
+    url = f"http://127.0.0.1:{args.port}/api/chat"
+    try:
+        asyncio.run(drive(url, 4, 4))  # warm up
+        before = cpu_seconds(server.pid)
+        asyncio.run(drive(url, args.requests, 4))
+        request_cpu = (cpu_seconds(server.pid) - before) / args.requests
+    finally:
+        server.terminate()
+        server.wait()
+        provider.terminate()
+        provider.wait()
+
+    os.environ.update(OPENAI_BASE_URL=f"http://127.0.0.1:{args.provider_port}/v1", HTTP_WARMUP="0")
+    overhead = instrumentation_cpu(args.chunks, args.rounds)
+    print(f"{args.chunks} chunks per answer")
+    print(f"request CPU (gunicorn worker)   {request_cpu * 1000:8.2f} ms")
+    print(f"instrumentation CPU             {overhead * 1000:8.3f} ms")
+    print(f"overhead                        {overhead / request_cpu:8.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Prompt-cache friendliness of history trimming over a long conversation.
+
+    python benchmarks/bench_prefix_cache.py [--turns 60] [--budget 4000] [--prefill-ms 200]
+
+Plays one long conversation through app.stream_chat against the fake
+provider with its prefix cache on (--prefix-cache 1): only the uncached
+part of each prompt costs --prefill-ms per 1k tokens before the first
+token, and usage reports the cached tokens. Two trimming layouts are
+compared, each against a fresh provider cache:
+
+  sliding   HISTORY_BLOCK=1  drop the oldest message whenever over budget
+                             (the prefix changes every turn once trimming starts)
+  blocks    HISTORY_BLOCK=8  drop old messages in blocks of 8 (prefix-stable)
+
+For every ten turns it reports the mean TTFT, the share of prompt tokens
+served from the provider cache, the mean prompt size and the input cost
+per turn at --price per million tokens, cached tokens at half price (the
+OpenAI discount).
+"""
+import argparse
+import os
+import sys
+import time
+
+import fake_provider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOPICS = ["the opening minute", "hostile questions", "the budget slide", "silence after a hard question",
+          "a board member who interrupts", "my notes", "eye contact", "the closing ask"]
+
+
+def question(turn):
+    topic = TOPICS[turn % len(TOPICS)]
+    return (f"Turn {turn}: I am preparing my board presentation and want to project executive presence. "
+            f"How should I handle {topic}, and what should I practise tonight so my voice and posture "
+            f"carry authority without sounding rehearsed?")
+
+
+def counter_value(counter, *labels):
+    child = counter._children.get(tuple(labels))
+    return child.value if child is not None else 0.0
+
+
+def play(gravitas, turns, model):
+    from providers import CACHED_PROMPT_TOKENS, PROMPT_TOKENS
+    from sse import EventParser
+    history, rows = [], []
+    for turn in range(turns):
+        history.append({"role": "user", "content": question(turn)})
+        prompt_before = counter_value(PROMPT_TOKENS, "openai", model)
+        cached_before = counter_value(CACHED_PROMPT_TOKENS, "openai", model)
+        start = time.perf_counter()
+        ttft, parts, parser = None, [], EventParser()
+        for frame in gravitas.stream_chat(history, None):
+            for event in parser.feed(frame):
+                if event.event != "message":
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(event.data)
+        history.append({"role": "assistant", "content": "".join(parts)})
+        prompt = counter_value(PROMPT_TOKENS, "openai", model) - prompt_before
+        cached = counter_value(CACHED_PROMPT_TOKENS, "openai", model) - cached_before
+        rows.append((ttft, prompt, cached))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--budget", type=int, default=4000, help="history token budget")
+    parser.add_argument("--prefill-ms", type=float, default=200.0, help="provider ms per 1k uncached tokens")
+    parser.add_argument("--price", type=float, default=2.50, help="$ per million uncached input tokens")
+    parser.add_argument("--port", type=int, default=8990)
+    args = parser.parse_args()
+
+    os.environ.update(GRAVITAS_AI_KEY="fake-key", PROVIDER="openai", OPENAI_BASE_URL=f"http://127.0.0.1:{args.port}/v1",
+                      RESPONSE_CACHE="false", SEMANTIC_CACHE="false", SENATE_COUNCIL="false", HTTP_WARMUP="0",
+                      ADMISSION_MAX_IN_FLIGHT="0", LOG_LEVEL="WARNING")
+    import app as gravitas
+    from history import HistoryManager
+    model = gravitas.model_default
+
+    print(f"{args.turns} turns, budget {args.budget} tokens, prefill {args.prefill_ms:.0f} ms/1k uncached tokens")
+    print(f"{'layout':>8} {'turns':>7} {'ttft':>7} {'cached':>7} {'prompt tok':>11} {'$/1k turns':>11}")
+    for name, block in (("sliding", 1), ("blocks", 8)):
+        provider = fake_provider.spawn(args.port, ttft=0.05, tps=400, tokens=120, prefix_cache=1,
+                                       prefill_ms=args.prefill_ms)
+        try:
+            gravitas.history_manager = HistoryManager(default_budget=args.budget, budgets={model: args.budget},
+                                                      block=block)
+            rows = play(gravitas, args.turns, model)
+        finally:
+            provider.terminate()
+            provider.wait()
+        for first in range(0, args.turns, 10):
+            chunk = rows[first:first + 10]
+            prompt = sum(r[1] for r in chunk)
+            cached = sum(r[2] for r in chunk)
+            cost = ((prompt - cached) + cached * 0.5) * args.price / 1e6 / len(chunk) * 1000
+            print(f"{name:>8} {first + 1:>3}-{first + len(chunk):<3} {sum(r[0] for r in chunk) / len(chunk):>6.3f}s "
+                  f"{cached / prompt if prompt else 0:>6.0%} {prompt / len(chunk):>11.0f} {cost:>10.2f}$")
+
+
+if __name__ == "__main__":
+    main()
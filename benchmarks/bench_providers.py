@@ -0,0 +1,144 @@
+"""Provider pool under latency and faults: single provider vs failover vs hedging.
+
+    python benchmarks/bench_providers.py [--requests 120] [--concurrency 8]
+
+Starts two fake providers (one speaking for OpenAI, one for Groq) and
+streams chat completions through providers.ProviderPool in three setups:
+
+  single    PROVIDERS=openai                (the behaviour before the pool)
+  failover  PROVIDERS=openai,groq           latency-ranked with failover
+  hedged    PROVIDERS=openai,groq + PROVIDER_HEDGE=true
+
+across three scenarios, switched at runtime through each fake provider's
+/control endpoint:
+
+  healthy     openai ttft 0.30s, groq ttft 0.40s
+  slow-patch  openai: 20% of requests wait 3s for the first token
+  outage      openai: every request fails with a 500
+
+It reports client-seen TTFT p50/p95/p99, the error rate and which provider
+served the answers. --async drives the pool's asyncio path instead.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import fake_provider
+from bench_async_streams import percentile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCENARIOS = {
+    "healthy": ({"ttft": 0.3, "slow_rate": 0, "error_rate": 0}, {"ttft": 0.4}),
+    "slow-patch": ({"ttft": 0.3, "slow_rate": 0.2, "slow_ttft": 3.0, "error_rate": 0}, {"ttft": 0.4}),
+    "outage": ({"ttft": 0.3, "slow_rate": 0, "error_rate": 1}, {"ttft": 0.4}),
+}
+SETUPS = {
+    "single": (["openai"], False),
+    "failover": (["openai", "groq"], False),
+    "hedged": (["openai", "groq"], True),
+}
+MESSAGES = [{"role": "user", "content": "How do I open a board presentation with authority?"}]
+
+
+def build_pool(names, hedge):
+    import app as gravitas
+    from providers import Provider, ProviderPool
+    providers = [
+        Provider(name, gravitas.make_client(provider=name), gravitas.default_model(name),
+                 make_async=lambda name=name: gravitas.make_client(asynchronous=True, provider=name),
+                 primary=name == "openai")
+        for name in names
+    ]
+    return ProviderPool(providers, hedge=hedge)
+
+
+def request_for(provider):
+    return {"model": provider.model, "messages": MESSAGES, "temperature": 0.7}
+
+
+def one_sync(pool):
+    served = {}
+    start = time.perf_counter()
+    ttft = None
+    try:
+        for _ in pool.stream(request_for, served):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+    except Exception:
+        return None, None
+    return ttft, served.get("provider")
+
+
+async def one_async(pool):
+    served = {}
+    start = time.perf_counter()
+    ttft = None
+    try:
+        async for _ in pool.astream(request_for, served):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+    except Exception:
+        return None, None
+    return ttft, served.get("provider")
+
+
+async def run_async(pool, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded():
+        async with semaphore:
+            return await one_async(pool)
+    results = await asyncio.gather(*(bounded() for _ in range(requests)))
+    await pool.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the asyncio path")
+    parser.add_argument("--ports", default="8930,8931", help="fake OpenAI and Groq ports")
+    args = parser.parse_args()
+
+    openai_port, groq_port = (int(p) for p in args.ports.split(","))
+    os.environ.update(GRAVITAS_AI_KEY="fake-key", GROQ_API_KEY="fake-key", HTTP_WARMUP="0",
+                      OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+                      GROQ_BASE_URL=f"http://127.0.0.1:{groq_port}")
+    procs = [fake_provider.spawn(port, tps=200, tokens=10, seed=port) for port in (openai_port, groq_port)]
+    try:
+        print(f"{args.requests} requests, concurrency {args.concurrency}, {'async' if args.use_async else 'sync'}")
+        print(f"{'scenario':>11} {'setup':>9} {'p50':>7} {'p95':>7} {'p99':>7} {'errors':>7}  served")
+        for scenario, (openai_settings, groq_settings) in SCENARIOS.items():
+            httpx.post(f"http://127.0.0.1:{openai_port}/control", json=openai_settings)
+            httpx.post(f"http://127.0.0.1:{groq_port}/control", json=groq_settings)
+            for setup, (names, hedge) in SETUPS.items():
+                pool = build_pool(names, hedge)
+                if args.use_async:
+                    results = asyncio.run(run_async(pool, args.requests, args.concurrency))
+                else:
+                    with ThreadPoolExecutor(args.concurrency) as executor:
+                        results = list(executor.map(lambda _: one_sync(pool), range(args.requests)))
+                ttfts = [ttft for ttft, _ in results if ttft is not None]
+                errors = sum(ttft is None for ttft, _ in results) / len(results)
+                served = {}
+                for _, name in results:
+                    if name:
+                        served[name] = served.get(name, 0) + 1
+                print(f"{scenario:>11} {setup:>9} {percentile(ttfts, 50):>6.2f}s {percentile(ttfts, 95):>6.2f}s "
+                      f"{percentile(ttfts, 99):>6.2f}s {errors:>6.0%}  {served} "
+                      f"hedges={pool.hedges} failovers={pool.failovers}")
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
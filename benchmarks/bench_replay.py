@@ -0,0 +1,331 @@
+"""Offline replay of recorded conversations through /api/chat.
+
+    python benchmarks/bench_replay.py [--mode wsgi|asgi] [--trace traces/coaching.jsonl]
+                                      [--conversations 40] [--concurrency 8] [--out result.json]
+    python benchmarks/bench_replay.py --compare old.json new.json
+
+Starts the fake provider (no API spend) and one server worker, then
+replays conversation traces turn by turn the way static/app.js does:
+every turn posts the whole history so far, including the answers the
+server actually streamed back. --concurrency conversations run at once;
+--conversations repeats the trace file until that many have been played.
+--think-time scales the recorded pauses between turns (0 = back to back).
+
+Traces are either JSONL, one conversation per line:
+
+    {"id": "...", "turns": [{"content": "...", "delay": 30}, "a bare string turn", ...]}
+
+or a CONVERSATION_DB SQLite log, whose user messages and timestamps are
+replayed as recorded.
+
+The provider's latency and faults are set with the flags shared with
+fake_provider.py (--ttft, --tps, --tokens, --chunk-chars, --error-rate,
+--slow-rate). The report covers throughput, p50/p95/p99 TTFT and total
+latency, errors, and the worker's CPU seconds and peak RSS (process tree
+of the server). It is written as JSON (--out, by default
+benchmarks/results/replay-<mode>-<commit>.json); --compare prints the
+change between two such files, so runs can be compared across commits.
+
+--url replays against a server that is already running (any serving
+setup); its CPU and RSS are measured only when --pid is given.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import ROOT, percentile
+from bench_coalesce import cpu_seconds
+from bench_ttft import start_server
+from sse import EventParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROVIDER_FLAGS = ("ttft", "tps", "tokens", "chunk_chars", "error_rate", "slow_rate")
+
+
+def load_traces(path):
+    """Conversations as {"id", "turns": [{"content", "delay"}]} from JSONL or a CONVERSATION_DB log."""
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT conversation_id, role, content, created_at FROM messages "
+                                "ORDER BY conversation_id, seq").fetchall()
+        finally:
+            conn.close()
+        traces, last = {}, {}
+        for conversation_id, role, content, created_at in rows:
+            trace = traces.setdefault(conversation_id, {"id": conversation_id, "turns": []})
+            if role == "user":
+                delay = created_at - last[conversation_id] if conversation_id in last else 0.0
+                trace["turns"].append({"content": content, "delay": max(0.0, delay)})
+            last[conversation_id] = created_at
+        return [t for t in traces.values() if t["turns"]]
+    traces = []
+    with open(path) as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            trace = json.loads(line)
+            turns = [t if isinstance(t, dict) else {"content": t} for t in trace["turns"]]
+            traces.append({"id": trace.get("id", f"trace-{n}"), "turns": turns})
+    return traces
+
+
+def process_rss(pid):
+    """Resident set size in bytes of a process and its children."""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Tracks the peak RSS of a process tree while a replay runs."""
+
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = process_rss(pid)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, process_rss(self.pid))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return max(self.peak, process_rss(self.pid))
+
+
+async def one_turn(client, url, history, key, timeout):
+    """Posts one turn; returns (outcome, ttft, total, answer)."""
+    start = time.perf_counter()
+    ttft, parts, parser = None, [], EventParser()
+    try:
+        async with client.stream("POST", url, json={"messages": history}, headers={"X-API-Key": key},
+                                 timeout=timeout) as resp:
+            if resp.status_code != 200:
+                await resp.aread()
+                return f"http_{resp.status_code}", None, time.perf_counter() - start, ""
+            async for chunk in resp.aiter_bytes():
+                for event in parser.feed(chunk):
+                    if event.event != "message":
+                        continue  # progress event: not answer text
+                    if event.data.startswith("[Error]"):
+                        return "stream_error", ttft, time.perf_counter() - start, "".join(parts)
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(event.data)
+    except httpx.HTTPError as e:
+        return type(e).__name__, ttft, time.perf_counter() - start, ""
+    return "ok", ttft, time.perf_counter() - start, "".join(parts)
+
+
+async def replay(url, conversations, concurrency, think_time, timeout):
+    """Plays every conversation, `concurrency` at a time; returns per-turn results."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def play(client, conversation):
+        async with semaphore:
+            history = []
+            for turn in conversation["turns"]:
+                if think_time and turn.get("delay"):
+                    await asyncio.sleep(turn["delay"] * think_time)
+                history.append({"role": "user", "content": turn["content"]})
+                outcome, ttft, total, answer = await one_turn(client, url, history, conversation["id"], timeout)
+                results.append({"conversation": conversation["id"], "turn": len(history) // 2,
+                                "outcome": outcome, "ttft": ttft, "total": total})
+                if outcome != "ok":
+                    return  # the client would show the error and the user would retry by hand
+                history.append({"role": "assistant", "content": answer})
+
+    async with httpx.AsyncClient(limits=limits) as client:
+        await asyncio.gather(*(play(client, c) for c in conversations))
+    return results
+
+
+def summarize(results, elapsed, cpu, rss_start, rss_peak):
+    ok = [r for r in results if r["outcome"] == "ok"]
+    errors = {}
+    for r in results:
+        if r["outcome"] != "ok":
+            errors[r["outcome"]] = errors.get(r["outcome"], 0) + 1
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    totals = [r["total"] for r in ok]
+    summary = {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+        "ttft_s": {f"p{p}": round(percentile(ttfts, p), 4) for p in (50, 95, 99)} if ttfts else None,
+        "total_s": {f"p{p}": round(percentile(totals, p), 4) for p in (50, 95, 99)} if totals else None,
+    }
+    if cpu is not None:
+        summary.update(cpu_s=round(cpu, 3),
+                       cpu_ms_per_request=round(cpu * 1000 / len(results), 3) if results else None,
+                       rss_start_mb=round(rss_start / 2**20, 1), rss_peak_mb=round(rss_peak / 2**20, 1))
+    return summary
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+# Metrics compared by --compare: (label, path into "results", lower is better).
+COMPARED = [
+    ("throughput req/s", ("throughput_rps",), False),
+    ("ttft p50 s", ("ttft_s", "p50"), True),
+    ("ttft p95 s", ("ttft_s", "p95"), True),
+    ("ttft p99 s", ("ttft_s", "p99"), True),
+    ("total p50 s", ("total_s", "p50"), True),
+    ("total p99 s", ("total_s", "p99"), True),
+    ("cpu ms/request", ("cpu_ms_per_request",), True),
+    ("rss peak MB", ("rss_peak_mb",), True),
+]
+
+
+def lookup(results, path):
+    for key in path:
+        results = (results or {}).get(key)
+    return results
+
+
+def compare(base_path, new_path, compared=COMPARED):
+    """Prints two result files side by side, flagging >5% regressions."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'':>18} {base['commit'] + ('+' if base.get('dirty') else ''):>12} "
+          f"{new['commit'] + ('+' if new.get('dirty') else ''):>12} {'change':>9}")
+    for label, path, lower_is_better in compared:
+        a, b = lookup(base["results"], path), lookup(new["results"], path)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a if a else 0.0
+        worse = change > 0.05 if lower_is_better else change < -0.05
+        print(f"{label:>18} {a:>12.4g} {b:>12.4g} {change:>+8.1%}{'  worse' if worse else ''}")
+    base_errors, new_errors = base["results"].get("errors") or {}, new["results"].get("errors") or {}
+    if base_errors or new_errors:
+        print(f"{'errors':>18} {sum(base_errors.values()):>12} {sum(new_errors.values()):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--url", help="replay against this running server instead of starting one")
+    parser.add_argument("--pid", type=int, help="server pid for CPU/RSS with --url")
+    parser.add_argument("--trace", default=os.path.join(HERE, "traces", "coaching.jsonl"))
+    parser.add_argument("--conversations", type=int, default=40, help="conversations to play (trace repeated)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--think-time", type=float, default=0.0, help="multiplier on recorded pauses")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tps", type=float, default=80.0)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--chunk-chars", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--out", help="result file (default benchmarks/results/replay-<mode>-<commit>.json)")
+    parser.add_argument("--port", type=int, default=8921)
+    parser.add_argument("--provider-port", type=int, default=8920)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    traces = load_traces(args.trace)
+    conversations = [dict(traces[n % len(traces)], id=f"{traces[n % len(traces)]['id']}-{n}")
+                     for n in range(args.conversations)]
+    provider_settings = {flag: getattr(args, flag) for flag in PROVIDER_FLAGS}
+    provider = server = None
+    try:
+        if args.url:
+            url, pid, mode = args.url, args.pid, "external"
+        else:
+            provider = fake_provider.spawn(args.provider_port, **provider_settings)
+            env = {"RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "HTTP_WARMUP": "0"}
+            server, _ = start_server(args.mode, args.port, args.provider_port, env)
+            url, pid, mode = f"http://127.0.0.1:{args.port}/api/chat", server.pid, args.mode
+        asyncio.run(replay(url, conversations[:2], 2, 0, args.timeout))  # warm up
+        cpu_before = cpu_seconds(pid) if pid else None
+        rss_start = process_rss(pid) if pid else 0
+        sampler = RssSampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        results = asyncio.run(replay(url, conversations, args.concurrency, args.think_time, args.timeout))
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(pid) - cpu_before if pid else None
+        rss_peak = sampler.stop() if sampler else None
+    finally:
+        for proc in (server, provider):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    commit, dirty = git_revision()
+    report = {
+        "benchmark": "replay",
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "mode": mode,
+        "settings": {"trace": os.path.relpath(args.trace, ROOT), "conversations": args.conversations,
+                     "concurrency": args.concurrency, "think_time": args.think_time,
+                     "provider": provider_settings if not args.url else None},
+        "results": summarize(results, elapsed, cpu, rss_start, rss_peak or 0),
+    }
+    out = args.out or os.path.join(HERE, "results", f"replay-{mode}-{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    r = report["results"]
+    print(f"mode={mode} {len(conversations)} conversations, concurrency {args.concurrency}, "
+          f"{r['requests']} turns in {r['elapsed_s']:.1f}s ({r['throughput_rps']:.2f} req/s)")
+    if r["ttft_s"]:
+        print(f"ttft  p50 {r['ttft_s']['p50']:.3f}s  p95 {r['ttft_s']['p95']:.3f}s  p99 {r['ttft_s']['p99']:.3f}s")
+        print(f"total p50 {r['total_s']['p50']:.3f}s  p95 {r['total_s']['p95']:.3f}s  p99 {r['total_s']['p99']:.3f}s")
+    if r["errors"]:
+        print("errors " + ", ".join(f"{k}={v}" for k, v in sorted(r["errors"].items())))
+    if cpu is not None:
+        print(f"server cpu {r['cpu_s']:.2f}s ({r['cpu_ms_per_request']:.1f} ms/request), "
+              f"rss {r['rss_start_mb']:.0f} -> {r['rss_peak_mb']:.0f} MB peak")
+    print(f"wrote {os.path.relpath(out)}")
+
+
+if __name__ == "__main__":
+    main()
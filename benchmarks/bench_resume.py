@@ -0,0 +1,150 @@
+"""Resumable streams: drop a long answer mid-stream and reconnect with Last-Event-ID.
+
+    python benchmarks/bench_resume.py [--mode wsgi|asgi] [--after 40] [--gap 1.0]
+
+Starts the fake provider (a --tokens answer at --tps) and two servers,
+"a" and "b", with RESUMABLE_STREAMS and one RESUME_DB, standing in for two
+workers (a reconnect may land on either). First one answer is read whole,
+as the reference; then, for each case, a client reads --after answer
+frames from a, drops the connection, waits --gap seconds and reconnects
+with POST /api/chat and the last id it saw:
+
+  same      reconnects to a, which is still generating
+  other     reconnects to b, which follows a's recording from the store
+  finished  waits until a has finished the answer, then reconnects to b
+  expired   reconnects with a position the store never had: expects 404
+
+For each it reports the upstream requests the provider saw (1 means the
+reconnect cost no new generation), the time from reconnecting to the first
+resumed frame, and whether the frames before the drop plus the resumed
+ones add up to exactly the reference answer.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import httpx
+
+import fake_provider
+from bench_ttft import start_server
+from sse import EventParser
+
+PROMPT = "How do I lead my team through a long reorganisation without losing trust?"
+
+
+def read(resp, parser, parts, limit=None):
+    """Appends answer frames to `parts` (at most `limit` of them); returns the count."""
+    count = 0
+    for chunk in resp.iter_bytes():
+        for event in parser.feed(chunk):
+            if event.event == "message":
+                parts.append(event.data)
+                count += 1
+        if limit is not None and count >= limit:
+            break
+    return count
+
+
+def full_answer(base):
+    parser, parts = EventParser(), []
+    with httpx.stream("POST", f"{base}/api/chat", json={"messages": [{"role": "user", "content": PROMPT}]},
+                      timeout=120) as resp:
+        resp.raise_for_status()
+        read(resp, parser, parts)
+    return "".join(parts)
+
+
+def dropped(base, after):
+    """Reads `after` answer frames, then drops the connection; returns (parts, last event id)."""
+    parser, parts = EventParser(), []
+    client = httpx.Client(timeout=120)
+    try:
+        with client.stream("POST", f"{base}/api/chat",
+                           json={"messages": [{"role": "user", "content": PROMPT}]}) as resp:
+            resp.raise_for_status()
+            read(resp, parser, parts, limit=after)
+    finally:
+        client.close()  # unread body: the connection is dropped, not reused
+    return parts, parser.last_id
+
+
+def resumed(base, last_id):
+    """(status, seconds to the first resumed frame, resumed parts)."""
+    parser, parts = EventParser(), []
+    start = time.perf_counter()
+    first = None
+    with httpx.stream("POST", f"{base}/api/chat", headers={"Last-Event-ID": last_id},
+                      json={"messages": [{"role": "user", "content": PROMPT}]}, timeout=120) as resp:
+        if resp.status_code != 200:
+            resp.read()
+            return resp.status_code, None, parts
+        for chunk in resp.iter_bytes():
+            for event in parser.feed(chunk):
+                if event.event == "message":
+                    first = first if first is not None else time.perf_counter() - start
+                    parts.append(event.data)
+    return 200, first, parts
+
+
+def wait_until_idle(control, timeout=60):
+    start = time.perf_counter()
+    while control.get("/control").json()["active"] and time.perf_counter() - start < timeout:
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--tps", type=float, default=60.0, help="provider tokens per second")
+    parser.add_argument("--after", type=int, default=40, help="answer frames read before the drop")
+    parser.add_argument("--gap", type=float, default=1.0, help="seconds between the drop and the reconnect")
+    parser.add_argument("--ports", type=int, nargs=2, default=[8981, 8982])
+    parser.add_argument("--provider-port", type=int, default=8980)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=0.2, tps=args.tps, tokens=args.tokens)
+    control = httpx.Client(base_url=f"http://127.0.0.1:{args.provider_port}", timeout=10)
+    servers = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="gravitas-resume-") as tmp:
+            env = {"RESUMABLE_STREAMS": "true", "RESUME_DB": os.path.join(tmp, "recordings.db"),
+                   "RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "SINGLE_FLIGHT": "false",
+                   "HTTP_WARMUP": "0", "STREAM_STOP_DIR": os.path.join(tmp, "stops")}
+            for port in args.ports:
+                servers.append(start_server(args.mode, port, args.provider_port, env)[0])
+            a, b = (f"http://127.0.0.1:{port}" for port in args.ports)
+            reference = full_answer(a)
+            print(f"mode={args.mode}: {args.tokens}-token answer at {args.tps:.0f}/s, drop after {args.after} "
+                  f"frames, reconnect {args.gap:.1f}s later")
+            print(f"{'case':>9} {'status':>7} {'upstream':>9} {'first resumed frame':>20} {'complete':>9}")
+            for case in ("same", "other", "finished", "expired"):
+                wait_until_idle(control)
+                before = control.get("/control").json()["requests"]
+                parts, last_id = dropped(a, args.after)
+                if case == "finished":
+                    wait_until_idle(control)
+                    time.sleep(0.2)  # the final publish to the store
+                else:
+                    time.sleep(args.gap)
+                if case == "expired":
+                    last_id = f"{last_id.rpartition(':')[0]}:999999"
+                status, first, rest = resumed(a if case == "same" else b, last_id)
+                wait_until_idle(control)
+                upstream = control.get("/control").json()["requests"] - before
+                complete = "".join(parts + rest) == reference
+                first_ms = f"{first * 1000:>17.1f}ms" if first is not None else f"{'-':>19}"
+                print(f"{case:>9} {status:>7} {upstream:>9} {first_ms} {str(complete if status == 200 else '-'):>9}")
+            health = httpx.get(f"{b}/api/health").json().get("resumable", {})
+            print(f"server b: resumed {health.get('resumed')}")
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
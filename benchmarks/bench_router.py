@@ -0,0 +1,86 @@
+"""Routing cost per KB of input: app.route_agent against the legacy router.
+
+    python benchmarks/bench_router.py
+
+legacy_detect_agent below is the chained substring scan route_agent
+replaced, kept verbatim; tests/test_router.py checks that the two route
+alike (apart from the substring false positives the router fixes).
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def legacy_detect_agent(user_input: str):
+    """The pre-router implementation of app.detect_agent, returning the agent key."""
+    text = user_input.lower().strip()
+    leadership_terms = [
+        "leader", "leadership", "team", "emotion", "empathy", "speech", "presence", "communication",
+        "influence", "virtue", "authority", "values", "mindfulness", "presentation", "confidence",
+        "persuasion", "integrity", "motivation", "body language", "posture", "manage", "ceo",
+        "executive", "coach", "mentor", "guide", "develop", "improve", "skill", "career", "feedback",
+        "strategy", "vision", "decision making"
+    ]
+    is_short_irrelevant = len(text.split()) < 3 and text not in ["hi", "hello", "ok", "thanks", "thank you", "yes", "no", "why", "how"]
+    off_topic_keywords = ["code", "recipe", "math", "history", "science", "translate", "stock market", "weather", "movie", "book summary"]
+    is_clearly_off_topic = any(keyword in text for keyword in off_topic_keywords)
+
+    if (not any(term in text for term in leadership_terms) and is_short_irrelevant) or is_clearly_off_topic:
+        return "guardian"
+    if "senate" in text or "consult" in text or "all mentors" in text or "holistic" in text:
+        return "senate"
+    if any(w in text for w in ["emotion", "empathy", "feeling", "conflict", "sensitive", "eq", "stress management", "self-aware", "mood"]):
+        return "eidos"
+    if any(w in text for w in ["body", "gesture", "posture", "tone", "eye contact", "nonverbal", "voice modulation"]):
+        return "kinesis"
+    if any(w in text for w in ["gravitas", "composure", "calm strength", "seriousness", "poise"]):
+        return "gravis"
+    if any(w in text for w in ["virtue", "integrity", "values", "duty", "ethics", "honor", "moral", "principles"]):
+        return "virtus"
+    if any(w in text for w in ["persuade", "influence", "story", "speech", "pitch", "proposal", "negotiate", "argument", "convince"]):
+        return "ethos"
+    if any(w in text for w in ["presence", "authority", "executive presence", "command", "impact"]):
+        return "praxis"
+    if any(w in text for w in ["inner", "mindfulness", "alignment", "purpose", "anxiety", "stillness", "focus", "meditation"]):
+        return "anima"
+    if any(w in text for w in ["appearance", "attire", "style", "grooming", "energy", "brand", "perception"]):
+        if any(w in text for w in ["first impression", "introduce", "introduction", "elevator pitch", "rapport", "greeting"]):
+            return "impressa"
+        return "persona"
+    if any(w in text for w in ["empathic", "listen", "understand", "compassion", "care", "perspective", "connect", "relationship"]):
+        return "sentio"
+    if any(term in text for term in leadership_terms):
+        return "praxis"
+    return "guardian"
+
+
+def transcript(kb):
+    """A pasted-transcript style message of roughly `kb` KiB."""
+    sentence = ("In yesterday's quarterly review the regional directors walked through the pipeline, "
+                "the hiring plan and the customer escalations before we moved on to budgets. ")
+    text = sentence * (kb * 1024 // len(sentence) + 1)
+    return text[:kb * 1024] + " How do I project more authority?"
+
+
+def main():
+    print(f"{'input':>8} {'legacy us/KB':>13} {'router us/KB':>13} {'speedup':>8}")
+    for kb in (1, 16, 128):
+        text = transcript(kb)
+        number = max(5, 2000 // kb)
+        legacy = min(timeit.repeat(lambda: legacy_detect_agent(text), number=number, repeat=3)) / number
+        routed = min(timeit.repeat(lambda: app.route_agent(text), number=number, repeat=3)) / number
+        print(f"{kb:>6}KB {legacy / kb * 1e6:>13.1f} {routed / kb * 1e6:>13.1f} {legacy / routed:>7.1f}x")
+
+    short = "How can I improve my executive presence?"
+    number = 20000
+    legacy = min(timeit.repeat(lambda: legacy_detect_agent(short), number=number, repeat=3)) / number
+    routed = min(timeit.repeat(lambda: app.route_agent(short), number=number, repeat=3)) / number
+    print(f"{'short':>8} {legacy * 1e6:>10.1f} us {routed * 1e6:>10.1f} us {legacy / routed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
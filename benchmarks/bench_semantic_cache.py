@@ -0,0 +1,88 @@
+"""Lookup latency of the semantic cache at 10k / 100k / 1M cached entries.
+
+    python benchmarks/bench_semantic_cache.py [--sizes 10000,100000,1000000] [--dim 256]
+
+Each size fills one agent/model partition with synthetic unit vectors and
+reports the embed + nearest-neighbour lookup latency (p50/p99), the index
+memory, and the snapshot save/load (warm start) time. A short paraphrase
+table shows the similarity scores the default threshold is judged against.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_cache import HashingEmbedder, SemanticCache, _Partition  # noqa: E402
+
+PAIRS = [
+    ("How do I improve my executive presence?", "how can I improve my executive presence"),
+    ("How do I improve my executive presence?", "ways to improve executive presence"),
+    ("How do I stay calm before a board meeting?", "how can i stay calm before board meetings"),
+    ("How do I improve my executive presence?", "How do I improve my public speaking?"),
+    ("How do I stay calm before a board meeting?", "How do I prepare slides for a board meeting?"),
+    ("how to project authority", "how can I appear more authoritative"),
+    ("How do I give feedback to my boss?", "How do I give feedback to my team?"),
+    ("Should I fire my cofounder?", "Should I not fire my cofounder?"),
+]
+
+
+def fill(cache, size, dim, rng):
+    part = _Partition(size, dim, rows=size)
+    vectors = rng.standard_normal((size, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    part.vectors[:] = vectors
+    part.size = size
+    part.questions = [f"q{i}" for i in range(size)]
+    part.answers = [f"a{i}" for i in range(size)]
+    part.last_used[:] = np.arange(size)
+    cache._partitions[cache.partition_key("praxis", "gpt-4o")] = part
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    embedder = HashingEmbedder(dim=args.dim)
+    print("paraphrase similarity (hashing vectorizer):")
+    for a, b in PAIRS:
+        print(f"  {float(embedder.embed(a) @ embedder.embed(b)):.2f}  {a!r} ~ {b!r}")
+
+    rng = np.random.default_rng(0)
+    question = "How can I project calm authority in a tense negotiation?"
+    print(f"\n{'entries':>9} {'index MB':>9} {'p50 ms':>8} {'p99 ms':>8} {'save s':>7} {'load s':>7}")
+    for size in (int(x) for x in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SemanticCache(embedder=embedder, max_entries=size, snapshot_path=os.path.join(tmp, "sc.npz"))
+            fill(cache, size, args.dim, rng)
+            timings = []
+            for _ in range(args.lookups):
+                start = time.perf_counter()
+                cache.lookup("praxis", "gpt-4o", question)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+
+            start = time.perf_counter()
+            cache.save()
+            save_s = time.perf_counter() - start
+            warm = SemanticCache(embedder=embedder, max_entries=size, snapshot_path=cache.snapshot_path)
+            start = time.perf_counter()
+            warm.load()
+            load_s = time.perf_counter() - start
+
+            mb = size * args.dim * 4 / 2 ** 20
+            p50 = timings[len(timings) // 2] * 1e3
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e3
+            print(f"{size:>9} {mb:>9.1f} {p50:>8.3f} {p99:>8.3f} {save_s:>7.2f} {load_s:>7.2f}")
+            del cache, warm
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Senate council fan-out: sequential vs parallel mentors against the fake provider.
+
+    python benchmarks/bench_senate.py [--ttft 0.5] [--tokens 60] [--tps 40] [--async]
+
+Streams one Senate question ("consult all mentors ...") through
+app.stream_chat (or asgi.astream_chat with --async) with the council's
+worker limit set to 1 (mentors one after another) and then to the
+configured default, and reports the time until every perspective is in,
+the time to the first synthesis token and the total wall time. With N
+mentors the sequential fan-out costs about N x a single mentor; the
+parallel one about the slowest single mentor. A third run sets a deadline
+shorter than the fake provider's latency to show late mentors being
+dropped.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import fake_provider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUESTION = "Consult all mentors: how do I lead my team through a painful restructuring with empathy and authority?"
+
+
+def timed(frames):
+    """Consumes SSE frames, returning (perspectives_done_at, first_token_at, total, statuses)."""
+    start = time.perf_counter()
+    council_done = first_token = None
+    statuses = []
+    for frame in frames:
+        now = time.perf_counter() - start
+        frame = frame.decode()
+        if frame.startswith("event: progress"):
+            if '"stage": "perspective"' in frame:
+                statuses.append("ok" if '"status": "done"' in frame else "late" if "timeout" in frame else "err")
+            if '"stage": "synthesis"' in frame:
+                council_done = now
+        elif first_token is None:
+            first_token = now
+    return council_done, first_token, time.perf_counter() - start, statuses
+
+
+def run_sync(gravitas):
+    return timed(gravitas.stream_chat([{"role": "user", "content": QUESTION}], None))
+
+
+async def run_async(asgi):
+    start = time.perf_counter()
+    arrivals = []
+    async for frame in asgi.astream_chat([{"role": "user", "content": QUESTION}], None):
+        arrivals.append((time.perf_counter() - start, frame.decode()))
+    council_done = next((t for t, f in arrivals if '"stage": "synthesis"' in f), None)
+    first_token = next((t for t, f in arrivals if not f.startswith("event:")), None)
+    statuses = ["ok" if '"status": "done"' in f else "late" if "timeout" in f else "err"
+                for _, f in arrivals if '"stage": "perspective"' in f]
+    return council_done, first_token, time.perf_counter() - start, statuses
+
+
+async def run_all_async(gravitas, runs):
+    # One event loop for every run: the async clients' pooled connections belong to it.
+    import asgi
+    results = []
+    for _, council in runs:
+        gravitas.council = council
+        results.append(await run_async(asgi))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ttft", type=float, default=0.5)
+    parser.add_argument("--tps", type=float, default=40.0)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--members", type=int, default=4)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the ASGI path")
+    parser.add_argument("--port", type=int, default=8940)
+    args = parser.parse_args()
+
+    os.environ.update(GRAVITAS_AI_KEY="fake-key", PROVIDER="openai", OPENAI_BASE_URL=f"http://127.0.0.1:{args.port}/v1",
+                      RESPONSE_CACHE="false", SENATE_COUNCIL="true")
+    provider = fake_provider.spawn(args.port, ttft=args.ttft, tps=args.tps, tokens=args.tokens)
+    try:
+        import app as gravitas
+        from senate import Council
+        single = args.ttft + args.tokens / args.tps
+        print(f"fake mentor ~{single:.2f}s, {args.members} mentors, {'async' if args.use_async else 'sync'}")
+        print(f"{'fan-out':>24} {'council done':>13} {'first token':>12} {'total':>7}  perspectives")
+        runs = [
+            ("sequential (1 worker)", Council(max_members=args.members, workers=1, deadline=60)),
+            ("parallel", Council(max_members=args.members, workers=8, deadline=60)),
+            ("parallel, short deadline", Council(max_members=args.members, workers=8, deadline=single * 0.5)),
+        ]
+        if args.use_async:
+            results = asyncio.run(run_all_async(gravitas, runs))
+        else:
+            results = []
+            for _, council in runs:
+                gravitas.council = council
+                results.append(run_sync(gravitas))
+        for (label, _), (council_done, first_token, total, statuses) in zip(runs, results):
+            print(f"{label:>24} {council_done:>12.2f}s {first_token:>11.2f}s {total:>6.2f}s  {' '.join(statuses)}")
+    finally:
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
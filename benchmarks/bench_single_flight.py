@@ -0,0 +1,112 @@
+"""Single-flight: upstream streams and late-joiner latency for a burst of identical prompts.
+
+    python benchmarks/bench_single_flight.py [--mode wsgi|asgi] [--clients 16] [--spread 3] [--workers 2]
+
+Starts the fake provider (--ttft, then --tokens at --tps: a ~5 s answer by
+default) and, for each setup, a server with --workers workers. --clients
+clients send the same first-turn prompt, arriving evenly over --spread
+seconds (a workshop where everyone pastes the prompt from the slide):
+
+  off     SINGLE_FLIGHT=false: one upstream stream per request
+  local   SINGLE_FLIGHT=true: requests share streams within their worker
+  shared  SINGLE_FLIGHT=true with SINGLE_FLIGHT_DB: all workers share them
+
+The response caches are off so every request reaches the stream, and each
+gunicorn worker gets a thread per client so no request waits for one. For
+each setup it reports the upstream requests the provider saw, TTFT and
+total time for the first arrival and for the late ones (p50 / p95), and
+whether every client received the same complete answer.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+import httpx
+
+import fake_provider
+from bench_async_streams import percentile
+from bench_replay import one_turn
+from bench_ttft import start_server
+
+PROMPT = "What is the one habit that would make me a more decisive leader?"
+
+SETUPS = ["off", "local", "shared"]
+
+
+async def burst(url, clients, spread, timeout):
+    """[(arrival offset, outcome, ttft, total, answer)] for staggered identical requests."""
+    history = [{"role": "user", "content": PROMPT}]
+
+    async def client_at(client, offset):
+        await asyncio.sleep(offset)
+        outcome, ttft, total, answer = await one_turn(client, url, history, "bench", timeout)
+        return offset, outcome, ttft, total, answer
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits) as client:
+        step = spread / max(1, clients - 1)
+        return await asyncio.gather(*(client_at(client, i * step) for i in range(clients)))
+
+
+def env_for(setup, db_path):
+    env = {"RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "HTTP_WARMUP": "0",
+           "SINGLE_FLIGHT": "false" if setup == "off" else "true"}
+    if setup == "shared":
+        env["SINGLE_FLIGHT_DB"] = db_path
+    return env
+
+
+def ms(values, q):
+    return f"{percentile(values, q) * 1000:>7.0f}" if values else f"{'-':>7}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--spread", type=float, default=3.0, help="seconds over which the clients arrive")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--ttft", type=float, default=0.5, help="provider time-to-first-token (s)")
+    parser.add_argument("--tps", type=float, default=40.0, help="provider tokens per second")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8941)
+    parser.add_argument("--provider-port", type=int, default=8940)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=args.ttft, tps=args.tps, tokens=args.tokens)
+    control = httpx.Client(base_url=f"http://127.0.0.1:{args.provider_port}", timeout=10)
+    url = f"http://127.0.0.1:{args.port}/api/chat"
+    print(f"mode={args.mode} workers={args.workers} clients={args.clients} over {args.spread:.1f}s, "
+          f"answer {args.tokens} tokens at {args.tps:.0f}/s after {args.ttft:.2f}s")
+    print(f"{'setup':>7} {'upstream':>9} {'first ttft':>11} {'late ttft p50':>14} {'p95':>7} "
+          f"{'late total p50':>15} {'p95':>7} {'ok':>5} {'same answer':>12}")
+    try:
+        for setup in SETUPS:
+            with tempfile.TemporaryDirectory(prefix="gravitas-flight-") as tmp:
+                server, _ = start_server(args.mode, args.port, args.provider_port,
+                                         env_for(setup, os.path.join(tmp, "flights.db")),
+                                         workers=args.workers, threads=args.clients)
+                try:
+                    before = control.get("/control").json()["requests"]
+                    results = asyncio.run(burst(url, args.clients, args.spread, timeout=60))
+                    upstream = control.get("/control").json()["requests"] - before
+                finally:
+                    server.terminate()
+                    server.wait()
+            results.sort()
+            first, late = results[0], results[1:]
+            ok = [r for r in results if r[1] == "ok"]
+            late_ttft = [r[2] for r in late if r[1] == "ok"]
+            late_total = [r[3] for r in late if r[1] == "ok"]
+            same = len({r[4] for r in ok}) == 1 and len(ok[0][4].split()) >= args.tokens if ok else False
+            first_ttft = f"{first[2] * 1000:>9.0f}ms" if first[2] is not None else f"{'-':>11}"
+            print(f"{setup:>7} {upstream:>9} {first_ttft} {ms(late_ttft, 50)}ms {ms(late_ttft, 95)} "
+                  f"{ms(late_total, 50):>13}ms {ms(late_total, 95)} {len(ok):>5} {str(same):>12}")
+    finally:
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""SSE encoding and decoding: server and client CPU for a long (4k-token) answer.
+
+    python benchmarks/bench_sse.py [--tokens 4000] [--runs 5] [--mode wsgi|asgi]
+
+Three parts:
+
+  encode  per-frame server cost in-process: the old sse() (escape "\\n",
+          format a str, encode it on the way out) against sse.frame(),
+          over --tokens tokens of which every 40th is a paragraph break
+  server  worker CPU per answer, end to end: a server in --mode streams
+          --tokens tokens from the fake provider (coalescing off, one frame
+          per token), --runs times
+  client  browser-side cost of consuming the same frames, run with node
+          (skipped if it is not installed): the old loop, which re-split
+          the buffer, appended to one string and re-ran replace() over the
+          whole answer for every frame, against createEventParser() from
+          static/app.js appending each frame once. DOM work is not modelled:
+          the old loop also re-set textContent with the whole answer per
+          frame, so its real cost is higher still.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import ROOT
+from bench_coalesce import cpu_seconds
+from bench_ttft import start_server
+from sse import EventParser, frame
+
+PROMPT = "Write me a long leadership playbook for my first year as a manager."
+
+WORDS = ("Presence", "is", "built", "in", "the", "pauses", "between", "words,", "not", "the", "words.")
+
+
+def tokens(n):
+    return ["\n\n" if i % 40 == 39 else " " + WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def legacy_sse(data: str) -> bytes:
+    """The frame format before sse.py: newlines escaped for the client to undo."""
+    processed_data = data.replace('\n', '\\n')
+    return f"data: {processed_data}\n\n".encode()
+
+
+def encode_us(encode, pieces, runs):
+    """Microseconds per frame, best of `runs`."""
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        for piece in pieces:
+            encode(piece)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pieces) * 1e6
+
+
+def server_cpu(mode, runs, n, port, provider_port):
+    """(median worker CPU ms per answer, answer characters)."""
+    provider = fake_provider.spawn(provider_port, ttft=0.01, tps=20000, tokens=n)
+    server, _ = start_server(mode, port, provider_port, {
+        "RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "HTTP_WARMUP": "0", "SINGLE_FLIGHT": "false"})
+    body = {"messages": [{"role": "user", "content": PROMPT}], "coalesce": False}
+    try:
+        samples, chars = [], 0
+        with httpx.Client(timeout=120) as client:
+            for _ in range(runs + 1):  # the first one warms up the worker
+                before = cpu_seconds(server.pid)
+                parser, answer = EventParser(), []
+                with client.stream("POST", f"http://127.0.0.1:{port}/api/chat", json=body) as resp:
+                    resp.raise_for_status()
+                    for chunk in resp.iter_bytes():
+                        answer.extend(e.data for e in parser.feed(chunk) if e.event == "message")
+                samples.append(cpu_seconds(server.pid) - before)
+                chars = len("".join(answer))
+        return statistics.median(samples[1:]) * 1000, chars
+    finally:
+        server.terminate()
+        server.wait()
+        provider.terminate()
+        provider.wait()
+
+
+CLIENT_JS = r"""
+const input = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const encode = list => list.map(f => new TextEncoder().encode(f));
+const runs = input.runs;
+%s
+
+function legacy(frames) {
+    const decoder = new TextDecoder();
+    let buffer = '', currentContent = '', shown = '';
+    for (const value of frames) {
+        buffer += decoder.decode(value, { stream: true });
+        let lines = buffer.split('\n\n');
+        buffer = lines.pop() || '';
+        for (const line of lines) {
+            if (line.startsWith('data: ')) {
+                const data = line.substring(6);
+                if (currentContent.length > 0 && !/\s$/.test(currentContent) && !/^\s/.test(data)) {
+                    currentContent += ' ';
+                }
+                currentContent += data;
+                shown = currentContent.replace(/\\n/g, '\n');
+            }
+        }
+    }
+    return shown;
+}
+
+function current(frames) {
+    const parts = [];
+    const feed = createEventParser((event, data) => { if (event === 'message') parts.push(data); });
+    for (const value of frames) feed(value);
+    return parts.join('');
+}
+
+function best(fn, input) {
+    let min = Infinity, out;
+    for (let i = 0; i < runs; i++) {
+        const start = process.hrtime.bigint();
+        out = fn(input);
+        min = Math.min(min, Number(process.hrtime.bigint() - start) / 1e6);
+    }
+    return [min, out.length];
+}
+
+const [legacyMs] = best(legacy, encode(input.legacy));
+const [currentMs, chars] = best(current, encode(input.current));
+console.log(JSON.stringify({ legacy_ms: legacyMs, current_ms: currentMs, chars }));
+"""
+
+
+def client_cpu(pieces, runs):
+    """{"legacy_ms", "current_ms", "chars"} from node, or None without node."""
+    node = shutil.which("node")
+    if node is None:
+        return None
+    with open(os.path.join(ROOT, "static", "app.js")) as f:
+        source = f.read()
+    parser_js = re.search(r"\n( *)function createEventParser\(onEvent\) \{.*?\n\1\}\n", source, re.S).group(0)
+    frames = {"runs": runs, "current": [frame(p).decode() for p in pieces],
+              "legacy": [legacy_sse(p).decode() for p in pieces]}
+    proc = subprocess.run([node, "-e", CLIENT_JS % parser_js], input=json.dumps(frames),
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--port", type=int, default=8971)
+    parser.add_argument("--provider-port", type=int, default=8970)
+    args = parser.parse_args()
+
+    pieces = tokens(args.tokens)
+    old_us, new_us = encode_us(legacy_sse, pieces, args.runs), encode_us(frame, pieces, args.runs)
+    print(f"encode  {args.tokens} frames: old sse() {old_us:.2f} us/frame, sse.frame() {new_us:.2f} us/frame "
+          f"({old_us * args.tokens / 1000:.1f} -> {new_us * args.tokens / 1000:.1f} ms per answer)")
+
+    cpu_ms, chars = server_cpu(args.mode, args.runs, args.tokens, args.port, args.provider_port)
+    print(f"server  {args.mode}: {cpu_ms:.0f} ms worker CPU per {args.tokens}-token answer ({chars} chars), "
+          f"median of {args.runs}")
+
+    client = client_cpu(pieces, args.runs)
+    if client is None:
+        print("client  skipped: node is not installed")
+    else:
+        print(f"client  old loop {client['legacy_ms']:.1f} ms, createEventParser {client['current_ms']:.1f} ms "
+              f"per answer ({client['chars']} chars, best of {args.runs}, without DOM updates)")
+
+
+if __name__ == "__main__":
+    main()
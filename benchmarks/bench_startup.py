@@ -0,0 +1,221 @@
+"""Startup cost: app import time and time-to-first-served-request, with and without --preload.
+
+    python benchmarks/bench_startup.py [--workers 2] [--runs 3] [--out FILE]
+    python benchmarks/bench_startup.py --compare BASE.json NEW.json
+
+Two parts, both tracked as regression metrics:
+
+  import   ``python -X importtime -c "import app"`` in a fresh interpreter:
+           total time and the packages app.py pulls in, by cumulative time,
+           then the time to build the first provider client (where the
+           provider SDK import lands now that it is lazy)
+  boot     gunicorn with --workers workers, started --runs times as
+           "default" and "preload" (--preload): seconds from exec until
+           the first /api/health answer and the first complete /api/chat
+           answer (from the fake provider), plus the proportional set size
+           (PSS) of master and workers once every worker has served a chat,
+           which shows the pages the workers share with a preloading master,
+           and the seconds until a chat is answered again after every
+           worker is killed (the master respawns them)
+
+Results are written as JSON to benchmarks/results/startup-<commit>.json
+(see bench_replay.py for the layout; --compare prints two of them side by
+side).
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import ROOT
+from bench_replay import HERE, compare, git_revision
+
+PROMPT = "How do I lead my team through a reorganisation?"
+
+COMPARED = [
+    ("import app ms", ("import", "app_ms"), True),
+    ("first client ms", ("import", "first_client_ms"), True),
+    ("default health s", ("boot", "default", "first_health_s"), True),
+    ("default chat s", ("boot", "default", "first_chat_s"), True),
+    ("default pss MB", ("boot", "default", "pss_mb"), True),
+    ("default respawn s", ("boot", "default", "respawn_s"), True),
+    ("preload health s", ("boot", "preload", "first_health_s"), True),
+    ("preload chat s", ("boot", "preload", "first_chat_s"), True),
+    ("preload pss MB", ("boot", "preload", "pss_mb"), True),
+    ("preload respawn s", ("boot", "preload", "respawn_s"), True),
+]
+
+
+def server_env(provider_port):
+    return dict(os.environ, PROVIDER="openai", GRAVITAS_AI_KEY="fake-key", ADMISSION_MAX_IN_FLIGHT="0",
+                OPENAI_BASE_URL=f"http://127.0.0.1:{provider_port}/v1", HTTP_WARMUP="0",
+                RESPONSE_CACHE="false", SEMANTIC_CACHE="false")
+
+
+def import_profile(provider_port, top=8):
+    """Import-time breakdown of app.py in a fresh interpreter (milliseconds)."""
+    probe = ("import time; t = time.perf_counter(); import app; "
+             "c = app.primary.client; print(round((time.perf_counter() - t) * 1000, 1))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=ROOT, env=server_env(provider_port),
+                          capture_output=True, text=True, check=True)
+    # importtime lists a module's imports (indented one level more) before the module itself.
+    app_ms, direct, children, seen_app = None, [], [], False
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if not match:
+            continue
+        ms, depth, name = int(match.group(1)) / 1000, len(match.group(2)) // 2, match.group(3)
+        if depth == 1:
+            children.append((ms, name))
+        elif depth == 0:
+            if name == "app":
+                app_ms, seen_app = ms, True
+                direct.extend(children)
+            elif seen_app:
+                direct.append((ms, name))  # imported on first use, after app
+            children = []
+    direct.sort(reverse=True)
+    total_ms = float(proc.stdout.strip().splitlines()[-1])
+    return {
+        "app_ms": round(app_ms, 1),
+        "first_client_ms": round(max(0.0, total_ms - app_ms), 1),
+        "modules": {name: round(ms, 1) for ms, name in direct[:top]},
+    }
+
+
+def process_pss(pid):
+    """Proportional set size in bytes of a process and its children (Linux)."""
+    total, pids = 0, [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/smaps_rollup") as f:
+                total += next(int(line.split()[1]) * 1024 for line in f if line.startswith("Pss:"))
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, StopIteration):
+            pass
+    return total
+
+
+def worker_pids(master):
+    with open(f"/proc/{master}/task/{master}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def wait_for_chat(base, start, timeout=60):
+    """Seconds from `start` until the server answers a complete chat."""
+    body = {"messages": [{"role": "user", "content": PROMPT}]}
+    while True:
+        try:
+            if httpx.post(f"{base}/api/chat", json=body, timeout=10).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError("the server did not answer")
+        time.sleep(0.005)
+
+
+def boot_once(preload, workers, port, provider_port):
+    """(seconds to first health answer, seconds to first chat answer, PSS bytes,
+    seconds until a chat is answered again after every worker was killed)."""
+    cmd = [sys.executable, "-m", "gunicorn", "app:app", "--workers", str(workers), "--threads", "8",
+           "--bind", f"127.0.0.1:{port}", "--log-level", "warning"] + (["--preload"] if preload else [])
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=server_env(provider_port), stdout=subprocess.DEVNULL)
+    client = httpx.Client(timeout=30)
+    try:
+        while True:
+            try:
+                if client.get(f"{base}/api/health", timeout=2).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.perf_counter() - start > 60:
+                raise RuntimeError("the server did not become ready")
+            time.sleep(0.005)
+        health = time.perf_counter() - start
+        body = {"messages": [{"role": "user", "content": PROMPT}]}
+        client.post(f"{base}/api/chat", json=body).raise_for_status()
+        chat = time.perf_counter() - start
+        # Enough chats on fresh connections that every worker has built its client.
+        for _ in range(4 * workers):
+            httpx.post(f"{base}/api/chat", json=body, timeout=30).raise_for_status()
+        pss = process_pss(proc.pid)
+        # The master respawns killed workers: a crash, --max-requests or scaling out with TTIN.
+        start = time.perf_counter()
+        for pid in worker_pids(proc.pid):
+            os.kill(pid, signal.SIGKILL)
+        return health, chat, pss, wait_for_chat(base, start)
+    finally:
+        client.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--out", help="result file (default: benchmarks/results/startup-<commit>.json)")
+    parser.add_argument("--port", type=int, default=8961)
+    parser.add_argument("--provider-port", type=int, default=8960)
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare, compared=COMPARED)
+        return
+
+    provider = fake_provider.spawn(args.provider_port, ttft=0.05, tps=2000, tokens=20)
+    try:
+        imports = import_profile(args.provider_port)
+        boot = {}
+        for name, preload in (("default", False), ("preload", True)):
+            runs = [boot_once(preload, args.workers, args.port, args.provider_port) for _ in range(args.runs)]
+            boot[name] = {
+                "first_health_s": round(statistics.median(r[0] for r in runs), 3),
+                "first_chat_s": round(statistics.median(r[1] for r in runs), 3),
+                "pss_mb": round(statistics.median(r[2] for r in runs) / 2**20, 1),
+                "respawn_s": round(statistics.median(r[3] for r in runs), 3),
+            }
+    finally:
+        provider.terminate()
+        provider.wait()
+
+    commit, dirty = git_revision()
+    report = {
+        "benchmark": "startup",
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {"workers": args.workers, "runs": args.runs, "python": sys.version.split()[0]},
+        "results": {"import": imports, "boot": boot},
+    }
+    out = args.out or os.path.join(HERE, "results", f"startup-{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"import app {imports['app_ms']:.0f} ms, first provider client {imports['first_client_ms']:.0f} ms")
+    for name, ms in imports["modules"].items():
+        print(f"  {name:<24} {ms:>7.1f} ms")
+    print(f"{'boot':>8} {'first health':>13} {'first chat':>11} {'pss':>9} {'respawn':>8}   "
+          f"({args.workers} workers, median of {args.runs})")
+    for name, r in boot.items():
+        print(f"{name:>8} {r['first_health_s']:>12.3f}s {r['first_chat_s']:>10.3f}s {r['pss_mb']:>6.1f} MB "
+              f"{r['respawn_s']:>7.3f}s")
+    print(f"wrote {os.path.relpath(out)}")
+
+
+if __name__ == "__main__":
+    main()
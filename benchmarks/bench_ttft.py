@@ -0,0 +1,102 @@
+"""Time-to-first-token with and without connection pooling and warm-up.
+
+    python benchmarks/bench_ttft.py [--handshake 0.15] [--idle 8] [--mode wsgi|asgi]
+
+Starts the fake provider with a per-connection setup delay (--handshake,
+standing in for TCP + TLS to a real provider) and boots one server worker
+twice:
+
+  sdk-defaults  HTTP_KEEPALIVE_EXPIRY=5, no warm-up (the SDKs' own httpx
+                defaults, i.e. the behaviour before http_pool.py)
+  pooled        HTTP_KEEPALIVE_EXPIRY=60, HTTP_WARMUP=4
+
+For each it reports client-seen TTFT for a burst of 4 concurrent requests
+right after boot, a single request after --idle seconds of silence, and
+the median of sequential steady-state requests.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+import fake_provider
+from bench_async_streams import ROOT, one_stream
+
+CONFIGS = {
+    "sdk-defaults": {"HTTP_KEEPALIVE_EXPIRY": "5", "HTTP_WARMUP": "0"},
+    "pooled": {"HTTP_KEEPALIVE_EXPIRY": "60", "HTTP_WARMUP": "4"},
+}
+
+
+def start_server(mode, port, provider_port, extra_env, workers=1, threads=8):
+    # Admission control off unless a benchmark sets it: bursts come from one client IP.
+    env = dict(os.environ, PROVIDER="openai", GRAVITAS_AI_KEY="fake-key", ADMISSION_MAX_IN_FLIGHT="0",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{provider_port}/v1")
+    env.update(extra_env)
+    if mode == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"]
+        if workers > 1:
+            cmd += ["--workers", str(workers)]
+    else:
+        # Run from the repo root so gunicorn.conf.py (the warm-up hook) is picked up.
+        cmd = [sys.executable, "-m", "gunicorn", "app:app", "--workers", str(workers), "--threads", str(threads),
+               "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    start = time.perf_counter()
+    while time.perf_counter() - start < 30:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1).status_code == 200:
+                return proc, time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"server did not become ready on port {port}")
+
+
+async def burst(url, n):
+    async with httpx.AsyncClient(timeout=60) as client:
+        results = await asyncio.gather(*(one_stream(client, url) for _ in range(n)))
+    return [ttft for ttft, _ in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "wsgi"], default="wsgi")
+    parser.add_argument("--handshake", type=float, default=0.15, help="provider connection setup (s)")
+    parser.add_argument("--ttft", type=float, default=0.2, help="provider time-to-first-token (s)")
+    parser.add_argument("--idle", type=float, default=8.0, help="idle gap before the second probe (s)")
+    parser.add_argument("--steady", type=int, default=5, help="sequential steady-state requests")
+    parser.add_argument("--port", type=int, default=8911)
+    parser.add_argument("--provider-port", type=int, default=8910)
+    args = parser.parse_args()
+
+    provider = fake_provider.spawn(args.provider_port, ttft=args.ttft, tps=200, tokens=10, handshake=args.handshake)
+    url = f"http://127.0.0.1:{args.port}/api/chat"
+    try:
+        print(f"mode={args.mode} provider handshake={args.handshake}s ttft={args.ttft}s idle={args.idle}s")
+        print(f"{'config':>13} {'ready s':>8} {'boot burst p50':>15} {'max':>7} {'after idle':>11} {'steady p50':>11}")
+        for name, env in CONFIGS.items():
+            server, ready = start_server(args.mode, args.port, args.provider_port, env)
+            try:
+                boot = asyncio.run(burst(url, 4))
+                time.sleep(args.idle)
+                idle = asyncio.run(burst(url, 1))[0]
+                steady = [asyncio.run(burst(url, 1))[0] for _ in range(args.steady)]
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{name:>13} {ready:>8.2f} {statistics.median(boot):>14.3f}s {max(boot):>6.3f}s "
+                  f"{idle:>10.3f}s {statistics.median(steady):>10.3f}s")
+    finally:
+        provider.terminate()
+        provider.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Offline evaluation of the model cascade's decisions over recorded conversations.
+
+    python benchmarks/eval_cascade.py [--trace traces/cascade.jsonl] [--answer-tokens 350]
+                                      [--out result.json]
+    python benchmarks/eval_cascade.py --compare old.json new.json
+
+No server and no provider: each conversation is played turn by turn
+through app.build_request (routing, history trimming and Cascade.choose,
+exactly as in stream_chat) with CASCADE on, and a stand-in answer of
+--answer-tokens words appended after every turn so later turns see a
+realistic history. CASCADE_* variables set in the environment apply, so
+thresholds can be tuned against the same traces.
+
+Traces are the JSONL or CONVERSATION_DB files bench_replay.py reads. A
+JSONL turn may carry a "tier" label, the tier a reviewer judged the turn
+needs; labelled turns are scored as
+
+  under  the cascade picked a smaller tier than the label (quality risk)
+  over   it picked a larger one (spend with no benefit)
+
+The report covers the share of turns per tier and agent, the signals that
+escalated them, the label agreement, and the estimated spend against
+sending every turn to the large tier (prompt tokens as trimmed, plus
+--answer-tokens completion tokens per turn, at the cascade's prices). It
+is written as JSON (--out, by default benchmarks/results/cascade-<commit>.json);
+--compare prints the change between two such files.
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+
+os.environ.setdefault("PROVIDER", "openai")
+os.environ.setdefault("GRAVITAS_AI_KEY", "offline-eval")
+os.environ["CASCADE"] = "true"
+for off in ("RESPONSE_CACHE", "SEMANTIC_CACHE"):
+    os.environ.setdefault(off, "false")
+
+from bench_async_streams import ROOT  # noqa: E402
+from bench_replay import HERE, compare, git_revision, load_traces  # noqa: E402
+
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+
+ANSWER_WORDS = ("Start", "with", "one", "clear", "message", "and", "repeat", "it", "until", "it", "lands.")
+
+# Metrics compared by --compare: (label, path into "results", lower is better).
+COMPARED = [
+    ("small share", ("tiers", "small"), False),
+    ("under-escalated", ("labels", "under_rate"), True),
+    ("over-escalated", ("labels", "over_rate"), True),
+    ("cost usd", ("cost_usd", "cascade"), True),
+    ("cost vs large", ("cost_usd", "ratio"), True),
+]
+
+
+def answer(tokens):
+    return " ".join(ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(tokens))
+
+
+def evaluate(traces, answer_tokens):
+    """Per-turn decisions: dicts of agent, tier, reason, label, model and estimated cost."""
+    cascade, large = app.cascade, app.cascade.model("large")
+    turns = []
+    for trace in traces:
+        history = []
+        for turn in trace["turns"]:
+            history.append({"role": "user", "content": turn["content"]})
+            agent_key, selected, _, model, trim, tier = app.build_request(history, None)
+            path = cascade.path(selected) if tier else []
+            name, reason = tier or ("none", agent_key)
+            large_prompt = trim.prompt_tokens if model == large else \
+                app.history_manager.trim({"role": "system", "content": selected["system"]}, history,
+                                         large).prompt_tokens
+            turns.append({
+                "trace": trace["id"], "agent": agent_key, "tier": name, "reason": reason,
+                "label": turn.get("tier"), "rank": path.index(name) if name in path else None,
+                "label_rank": path.index(turn["tier"]) if turn.get("tier") in path else None,
+                "cost": cascade.cost(model, trim.prompt_tokens, answer_tokens) if tier else 0.0,
+                "large_cost": cascade.cost(large, large_prompt, answer_tokens) if tier else 0.0,
+            })
+            history.append({"role": "assistant", "content": answer(answer_tokens)})
+    return turns
+
+
+def summarize(turns):
+    total = len(turns)
+    tiers = collections.Counter(t["tier"] for t in turns)
+    by_agent = collections.defaultdict(collections.Counter)
+    for t in turns:
+        by_agent[t["agent"]][t["tier"]] += 1
+    labelled = [t for t in turns if t["rank"] is not None and t["label_rank"] is not None]
+    under = [t for t in labelled if t["rank"] < t["label_rank"]]
+    over = [t for t in labelled if t["rank"] > t["label_rank"]]
+    cost, large_cost = sum(t["cost"] for t in turns), sum(t["large_cost"] for t in turns)
+    return {
+        "turns": total,
+        "tiers": {tier: count / total for tier, count in sorted(tiers.items())},
+        "agents": {agent: dict(counts) for agent, counts in sorted(by_agent.items())},
+        "reasons": dict(collections.Counter(t["reason"] for t in turns if t["tier"] != "none")),
+        "labels": {
+            "labelled": len(labelled),
+            "agree": len(labelled) - len(under) - len(over),
+            "under": len(under), "over": len(over),
+            "under_rate": len(under) / len(labelled) if labelled else None,
+            "over_rate": len(over) / len(labelled) if labelled else None,
+            "mistakes": [{k: t[k] for k in ("trace", "agent", "tier", "label", "reason")} for t in under + over],
+        },
+        "cost_usd": {"cascade": cost, "all_large": large_cost, "ratio": cost / large_cost if large_cost else None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--trace", default=os.path.join(HERE, "traces", "cascade.jsonl"))
+    parser.add_argument("--answer-tokens", type=int, default=350, help="assumed completion tokens per turn")
+    parser.add_argument("--out", help="result file (default benchmarks/results/cascade-<commit>.json)")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare, compared=COMPARED)
+        return
+    if app.cascade is None:
+        sys.exit("the cascade is disabled: PROVIDER has no default model")
+
+    results = summarize(evaluate(load_traces(args.trace), args.answer_tokens))
+    print(f"{results['turns']} turns from {args.trace}, models {app.cascade.models}")
+    print("tiers    " + ", ".join(f"{tier} {share:.0%}" for tier, share in results["tiers"].items()))
+    for agent, counts in results["agents"].items():
+        print(f"  {agent:<10} " + ", ".join(f"{tier} {n}" for tier, n in sorted(counts.items())))
+    print("reasons  " + ", ".join(f"{reason} {n}" for reason, n in sorted(results["reasons"].items())))
+    labels = results["labels"]
+    if labels["labelled"]:
+        print(f"labels   {labels['agree']}/{labels['labelled']} agree, {labels['under']} under-escalated, "
+              f"{labels['over']} over-escalated")
+        for m in labels["mistakes"]:
+            print(f"  {m['trace']:<18} {m['agent']:<10} picked {m['tier']:<6} labelled {m['label']:<6} ({m['reason']})")
+    cost = results["cost_usd"]
+    ratio = f" ({cost['ratio']:.0%})" if cost["ratio"] is not None else ""
+    print(f"cost     ${cost['cascade']:.4f} with the cascade vs ${cost['all_large']:.4f} all large{ratio}, "
+          f"at {args.answer_tokens} answer tokens per turn")
+
+    commit, dirty = git_revision()
+    out = args.out or os.path.join(HERE, "results", f"cascade-{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"commit": commit, "dirty": dirty, "trace": args.trace, "answer_tokens": args.answer_tokens,
+                   "models": app.cascade.models, "env": {k: v for k, v in os.environ.items()
+                                                         if k.startswith("CASCADE_")},
+                   "results": results}, f, indent=2)
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""Local fake OpenAI/Groq chat-completions server for benchmarks.
+
+Speaks just enough of the chat-completions API (streaming and non-streaming)
+for the OpenAI and Groq SDKs to talk to it, with configurable latency:
+
+    python benchmarks/fake_provider.py --port 8900 --ttft 0.3 --tps 40 --tokens 120
+
+--handshake adds a delay to the first request on each new client
+connection, standing in for the TCP + TLS setup a real provider costs.
+--error-rate and --slow-rate/--slow-ttft inject faults: a share of chat
+requests fail with a 500, or wait --slow-ttft seconds before the first
+token. --chunk-chars re-cuts the streamed text into pieces of that many
+characters, mimicking providers that stream sub-word chunks. --rpm enforces
+a requests-per-minute token bucket: responses carry x-ratelimit-* headers
+and requests over the limit get a 429 with Retry-After.
+
+--prefix-cache simulates provider prompt caching the way OpenAI reports
+it: the longest previously seen message-boundary prefix of the prompt
+counts as cached (from 1024 tokens, in 128-token steps), only the uncached
+rest costs --prefill-ms per 1k tokens before the first token, and usage
+(sent when the request asks with stream_options) reports cached_tokens.
+
+A streaming request stops generating as soon as its client disconnects,
+like a real provider. ``GET /control`` reports the streams in progress
+(active), the tokens streamed (generated) and the streams cut short by a
+disconnect (cancelled).
+
+The batch API is emulated as well (POST /v1/files, POST /v1/batches,
+GET /v1/batches/<id>, GET /v1/files/<id>/content): a batch completes
+--batch-delay seconds after it is created, answering every request line
+with a non-streaming completion (failing a share of them at --error-rate).
+
+All latency and fault settings can be changed while running with
+``POST /control`` and a JSON body such as ``{"ttft": 2.0, "error_rate": 1}``.
+
+Point the app at it with ``OPENAI_BASE_URL=http://127.0.0.1:8900/v1`` (or
+``GROQ_BASE_URL=http://127.0.0.1:8900`` for PROVIDER=groq) and any non-empty
+API key.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+
+import uvicorn
+from email.parser import BytesParser
+from email.policy import default as email_policy
+
+WORDS = ("Presence", "is", "built", "in", "the", "pauses", "between", "words,",
+         "not", "in", "the", "volume", "of", "the", "voice.")
+
+
+class FakeProvider:
+    """ASGI app emulating a chat-completions endpoint."""
+
+    SETTINGS = ("ttft", "tps", "tokens", "handshake", "error_rate", "slow_rate", "slow_ttft", "chunk_chars", "rpm",
+                "prefix_cache", "prefill_ms", "batch_delay")
+
+    def __init__(self, ttft=0.3, tps=40.0, tokens=120, handshake=0.0, error_rate=0.0, slow_rate=0.0,
+                 slow_ttft=3.0, chunk_chars=0, rpm=0, prefix_cache=0, prefill_ms=0.0, batch_delay=1.0, seed=None):
+        self.ttft = ttft
+        self.tps = tps
+        self.tokens = tokens
+        self.handshake = handshake
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_ttft = slow_ttft
+        self.chunk_chars = chunk_chars
+        self.rpm = rpm
+        self.bucket = float(rpm)
+        self.bucket_at = time.monotonic()
+        self.throttled = 0
+        self.prefix_cache = prefix_cache
+        self.prefill_ms = prefill_ms
+        self.prefixes = {}  # prefix hash -> last use, bounded below
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.generated = 0
+        self.cancelled = 0
+        self.connections = set()
+        self.batch_delay = batch_delay
+        self.files = {}
+        self.batches = {}
+
+    def token_stream(self):
+        words = (("" if i == 0 else " ") + WORDS[i % len(WORDS)] for i in range(self.tokens))
+        if not self.chunk_chars:
+            yield from words
+            return
+        text = "".join(words)
+        for start in range(0, len(text), self.chunk_chars):
+            yield text[start:start + self.chunk_chars]
+
+    def prompt_usage(self, messages):
+        """(prompt_tokens, cached_tokens) for a prompt, remembering its prefixes."""
+        digest = hashlib.sha256()
+        total, cached = 0, 0
+        for message in messages:
+            content = message.get("content")
+            digest.update(json.dumps([message.get("role"), content]).encode())
+            total += len(str(content or "")) // 4 + 4
+            key = digest.hexdigest()  # covers the whole prefix up to this message
+            if self.prefix_cache and key in self.prefixes:
+                cached = total
+            self.prefixes[key] = time.monotonic()
+        if len(self.prefixes) > 100000:
+            for key in sorted(self.prefixes, key=self.prefixes.get)[:50000]:
+                del self.prefixes[key]
+        if cached < 1024:
+            cached = 0
+        return total, cached - cached % 128
+
+    def rate_limit(self):
+        """Takes one request from the rpm bucket: (allowed, x-ratelimit-* headers)."""
+        now = time.monotonic()
+        self.bucket = min(self.rpm, self.bucket + (now - self.bucket_at) * self.rpm / 60.0)
+        self.bucket_at = now
+        allowed = self.bucket >= 1
+        if allowed:
+            self.bucket -= 1
+        reset = (self.rpm - self.bucket) * 60.0 / self.rpm
+        headers = [(b"x-ratelimit-limit-requests", str(self.rpm).encode()),
+                   (b"x-ratelimit-remaining-requests", str(int(self.bucket)).encode()),
+                   (b"x-ratelimit-reset-requests", f"{reset:.3f}s".encode())]
+        if not allowed:
+            headers.append((b"retry-after", f"{(1 - self.bucket) * 60.0 / self.rpm:.3f}".encode()))
+        return allowed, headers
+
+    def completion(self, model, usage):
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(self.token_stream())},
+                         "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    def batch_view(self, batch):
+        """The batch object, completing it (and writing its output file) once its delay is over."""
+        if batch["status"] == "in_progress" and time.time() >= batch["created_at"] + self.batch_delay:
+            output, failed = [], 0
+            for n, line in enumerate(self.files[batch["input_file_id"]]["content"].decode().splitlines()):
+                request = json.loads(line)
+                body = request.get("body") or {}
+                self.requests += 1
+                if self.rng.random() < self.error_rate:
+                    failed += 1
+                    response = {"status_code": 500, "request_id": f"req-{n}",
+                                "body": {"error": {"message": "injected fault", "type": "server_error"}}}
+                else:
+                    prompt_tokens, _ = self.prompt_usage(body.get("messages") or [])
+                    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self.tokens,
+                             "total_tokens": prompt_tokens + self.tokens}
+                    response = {"status_code": 200, "request_id": f"req-{n}",
+                                "body": self.completion(body.get("model", "fake-model"), usage)}
+                output.append(json.dumps({"id": f"batch_req_{n}", "custom_id": request.get("custom_id"),
+                                          "response": response, "error": None}))
+            batch["output_file_id"] = self.store_file("\n".join(output).encode() + b"\n", "batch_output")
+            batch.update(status="completed", completed_at=int(time.time()),
+                         request_counts={"total": len(output), "completed": len(output) - failed, "failed": failed})
+        return batch
+
+    def store_file(self, content, purpose, filename="batch.jsonl"):
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                               "filename": filename, "purpose": purpose, "status": "processed", "content": content}
+        return file_id
+
+    async def batch_api(self, scope, body, send):
+        """Handles the files and batches endpoints; returns False for any other path."""
+        path, method = scope["path"], scope["method"]
+        if path.endswith("/files") and method == "POST":
+            ctype = dict(scope["headers"]).get(b"content-type", b"")
+            form = BytesParser(policy=email_policy).parsebytes(b"Content-Type: " + ctype + b"\r\n\r\n" + body)
+            fields = {part.get_param("name", header="content-disposition"): part for part in form.iter_parts()}
+            upload = fields["file"]
+            file_id = self.store_file(upload.get_payload(decode=True), fields["purpose"].get_content().strip(),
+                                      upload.get_filename() or "batch.jsonl")
+            await self.send_json(send, {k: v for k, v in self.files[file_id].items() if k != "content"})
+            return True
+        match = re.search(r"/files/([^/]+)/content$", path)
+        if match and match.group(1) in self.files:
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"application/octet-stream")]})
+            await send({"type": "http.response.body", "body": self.files[match.group(1)]["content"]})
+            return True
+        if path.endswith("/batches") and method == "POST":
+            request = json.loads(body or b"{}")
+            if request.get("input_file_id") not in self.files:
+                await self.send_json(send, {"error": {"message": "No such file", "type": "invalid_request_error"}},
+                                     status=404)
+                return True
+            batch_id = f"batch_{len(self.batches) + 1}"
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request.get("endpoint"),
+                "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window"),
+                "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                "error_file_id": None, "metadata": request.get("metadata"),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+            await self.send_json(send, self.batches[batch_id])
+            return True
+        match = re.search(r"/batches/([^/]+)$", path)
+        if match and match.group(1) in self.batches:
+            await self.send_json(send, self.batch_view(self.batches[match.group(1)]))
+            return True
+        return False
+
+    def chunk(self, model, delta, finish_reason=None):
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        peer = scope.get("client")
+        if self.handshake and peer not in self.connections:
+            # A new (host, port) pair is a new connection: charge the setup cost once.
+            self.connections.add(peer)
+            await asyncio.sleep(self.handshake)
+
+        if scope["path"] == "/control":
+            if scope["method"] == "POST":
+                for key, value in json.loads(body or b"{}").items():
+                    if key in self.SETTINGS:
+                        setattr(self, key, type(getattr(self, key))(value))
+            state = {key: getattr(self, key) for key in self.SETTINGS}
+            await self.send_json(send, dict(state, requests=self.requests, errors=self.errors,
+                                            throttled=self.throttled, active=self.active,
+                                            generated=self.generated, cancelled=self.cancelled))
+            return
+
+        if "/files" in scope["path"] or "/batches" in scope["path"]:
+            if not await self.batch_api(scope, body, send):
+                await self.send_json(send, {"error": {"message": "Not found", "type": "invalid_request_error"}},
+                                     status=404)
+            return
+
+        if not scope["path"].endswith("/chat/completions"):
+            await self.send_json(send, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+            return
+
+        self.requests += 1
+        limit_headers = []
+        if self.rpm:
+            allowed, limit_headers = self.rate_limit()
+            if not allowed:
+                self.throttled += 1
+                await self.send_json(send, {"error": {"message": "rate limit reached", "type": "requests"}},
+                                     status=429, headers=limit_headers)
+                return
+        request = json.loads(body or b"{}")
+        model = request.get("model", "fake-model")
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            await asyncio.sleep(self.ttft / 4)
+            await self.send_json(send, {"error": {"message": "injected fault", "type": "server_error"}}, status=500)
+            return
+        prompt_tokens, cached_tokens = self.prompt_usage(request.get("messages") or [])
+        prefill = (prompt_tokens - cached_tokens) / 1000.0 * self.prefill_ms / 1000.0
+        await asyncio.sleep(prefill + (self.slow_ttft if self.rng.random() < self.slow_rate else self.ttft))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self.tokens,
+                 "total_tokens": prompt_tokens + self.tokens,
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+        if not request.get("stream"):
+            await asyncio.sleep(self.tokens / self.tps)
+            await self.send_json(send, self.completion(model, usage))
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")] + limit_headers})
+        disconnected = asyncio.Event()
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            self.active -= 1  # counted when the connection drops, not at the next token
+
+        watcher = asyncio.ensure_future(watch())
+        self.active += 1
+        try:
+            delay = 1.0 / self.tps if self.tps else 0
+            for i, token in enumerate(self.token_stream()):
+                if i:
+                    await asyncio.sleep(delay)
+                if disconnected.is_set():
+                    self.cancelled += 1
+                    return
+                self.generated += 1
+                frame = self.chunk(model, {"role": "assistant", "content": token})
+                await send({"type": "http.response.body", "body": f"data: {json.dumps(frame)}\n\n".encode(),
+                            "more_body": True})
+        finally:
+            watcher.cancel()
+            if not disconnected.is_set():
+                self.active -= 1
+        done = f"data: {json.dumps(self.chunk(model, {}, finish_reason='stop'))}\n\n"
+        if (request.get("stream_options") or {}).get("include_usage"):
+            final = dict(self.chunk(model, {}), choices=[], usage=usage)
+            done += f"data: {json.dumps(final)}\n\n"
+        await send({"type": "http.response.body", "body": f"{done}data: [DONE]\n\n".encode()})
+
+    async def send_json(self, send, payload, status=200, headers=()):
+        body = json.dumps(payload).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")] + list(headers)})
+        await send({"type": "http.response.body", "body": body})
+
+
+def spawn(port, **options):
+    """Runs the fake provider in a subprocess so it does not compete with the
+    benchmark client for the GIL. Options map to the CLI flags."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--port", str(port)]
+    for key, value in options.items():
+        cmd += ["--" + key.replace("_", "-"), str(value)]
+    proc = subprocess.Popen(cmd)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/v1/models", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"fake provider did not come up on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tps", type=float, default=40.0, help="tokens per second after the first")
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per completion")
+    parser.add_argument("--handshake", type=float, default=0.0, help="seconds of setup per new connection")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of chat requests failing with 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of chat requests with a slow first token")
+    parser.add_argument("--slow-ttft", type=float, default=3.0, help="first-token delay of slow requests (s)")
+    parser.add_argument("--chunk-chars", type=int, default=0, help="stream text in pieces of N characters (0 = words)")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--prefix-cache", type=int, default=0, help="1 to simulate provider prompt caching")
+    parser.add_argument("--prefill-ms", type=float, default=0.0, help="ms of prefill per 1k uncached prompt tokens")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="seconds until a batch API batch completes")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    provider = FakeProvider(ttft=args.ttft, tps=args.tps, tokens=args.tokens, handshake=args.handshake,
+                            error_rate=args.error_rate, slow_rate=args.slow_rate, slow_ttft=args.slow_ttft,
+                            chunk_chars=args.chunk_chars, rpm=args.rpm,
+                            prefix_cache=args.prefix_cache, prefill_ms=args.prefill_ms,
+                            batch_delay=args.batch_delay, seed=args.seed)
+    # Keep idle connections open like a real provider edge (uvicorn closes them after 5s by default).
+    uvicorn.run(provider, host="127.0.0.1", port=args.port, log_level="warning", backlog=4096,
+                timeout_keep_alive=75)
+
+
+if __name__ == "__main__":
+    main()
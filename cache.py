@@ -0,0 +1,164 @@
+"""Response cache for repeated prompts.
+
+Answers are keyed on a hash of everything that determines the upstream
+request (agent system prompt, model, temperature and the trimmed message
+list) and kept in an in-process LRU bounded by total bytes, with a TTL.
+An optional SQLite file shared by all gunicorn workers on the host acts as
+a second tier, so one worker's answer is a hit for the other.
+
+Configured from the environment (see from_env):
+    RESPONSE_CACHE            "true" to enable (default off)
+    RESPONSE_CACHE_TTL        seconds an answer stays valid (default 3600)
+    RESPONSE_CACHE_MAX_BYTES  in-process size bound (default 16 MiB)
+    RESPONSE_CACHE_DB         path of the shared SQLite file (default none)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(system: str, model: str, temperature: float, messages) -> str:
+    """Stable hash of the request fields that determine the answer."""
+    payload = json.dumps(
+        {"system": system, "model": model, "temperature": temperature,
+         "messages": [{"role": m.get("role"), "content": m.get("content")} for m in messages]},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteBackend:
+    """Shared cache tier in a local SQLite file (one connection per thread)."""
+
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._puts = 0
+        # Throwaway connection: per-thread ones are opened lazily in the workers.
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        """Returns (value, expires_at) for a live entry, or None."""
+        return self._connect().execute(
+            "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+
+    def put(self, key: str, value: str, expires_at: float):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at),
+        )
+        self._puts += 1
+        if self._puts % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+
+class ResponseCache:
+    """Thread-safe LRU with TTL and a total-bytes bound, plus an optional shared backend."""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=3600.0, backend=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._remove(key)
+                self.expirations += 1
+
+        row = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            value, expires_at = row
+            self.shared_hits += 1
+            # Keep the shared row's expiry: a fresh TTL here would let the answer outlive it.
+            self._insert(key, value, expires_at)
+        return value
+
+    def put(self, key: str, value: str):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._insert(key, value, expires_at)
+        if self.backend is not None:
+            self.backend.put(key, value, expires_at)
+
+    def _insert(self, key, value, expires_at):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, expires_at)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "shared_backend": self.backend.path if self.backend is not None else None,
+            }
+
+    @classmethod
+    def from_env(cls):
+        """Builds the cache from RESPONSE_CACHE_* variables, or returns None if disabled."""
+        if os.getenv("RESPONSE_CACHE", "false").lower() != "true":
+            return None
+        db_path = os.getenv("RESPONSE_CACHE_DB")
+        return cls(
+            max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+            backend=SQLiteBackend(db_path) if db_path else None,
+        )
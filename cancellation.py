@@ -0,0 +1,215 @@
+"""Stopping chat streams early: client disconnects and the stop endpoint.
+
+Every /api/chat stream gets an id (sent back in X-Stream-Id; the client
+may choose it with "stream_id" in the body) and a StopSignal. The provider
+loop checks the signal once per upstream chunk and, when it is set, closes
+the upstream response, so the provider stops generating and the worker
+thread is free within one chunk interval. The signal is set by:
+
+    disconnected  the browser went away. On gunicorn the client socket is
+                  peeked (MSG_PEEK, non-blocking) on each check, since a
+                  closed tab is otherwise only noticed when a write fails;
+                  the ASGI app listens for http.disconnect instead.
+    stopped       POST /api/chat/<stream_id>/stop (the stop button).
+
+A stop request can land on any gunicorn worker. The worker that owns the
+stream sets its signal directly; any other one leaves a marker file in
+STREAM_STOP_DIR, which the owner looks for every STREAM_STOP_POLL seconds.
+
+Cancelled streams are counted in the metrics together with the tokens
+pulled from the provider that never reached the client (wasted) and an
+estimate of the tokens and stream seconds saved, taken from the average
+length of completed answers.
+
+Configured from the environment (see StreamRegistry.from_env):
+    STREAM_STOP_DIR   directory shared by the workers for stop requests
+                      (gunicorn.conf.py sets one per server run; default: this process only)
+    STREAM_STOP_POLL  seconds between checks for a marker per stream (default 0.1)
+"""
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+
+from metrics import registry
+
+CANCELLED_STREAMS = registry.counter(
+    "gravitas_cancelled_streams_total", "Chat streams ended early, by reason (disconnected, stopped).", ["reason"])
+WASTED_TOKENS = registry.counter(
+    "gravitas_cancel_wasted_tokens_total",
+    "Chunks received from the provider for cancelled streams that never reached the client.", ["reason"])
+SAVED_TOKENS = registry.counter(
+    "gravitas_cancel_saved_tokens_total",
+    "Estimated completion tokens not generated because a cancelled stream was closed upstream.", ["reason"])
+SAVED_SECONDS = registry.counter(
+    "gravitas_cancel_saved_seconds_total",
+    "Estimated stream seconds not spent because a cancelled stream was closed upstream.", ["reason"])
+
+STREAM_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+def client_gone(sock) -> bool:
+    """True if the peer has closed the connection (peeks without consuming)."""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError):
+        return False  # nothing to read: still connected
+    except OSError:
+        return True
+
+
+class StopSignal:
+    """The cancellation flag of one stream; duck-types threading.Event.is_set."""
+
+    __slots__ = ("id", "reason", "notify", "_sock", "_marker", "_poll", "_next_poll", "_registry")
+
+    def __init__(self, stream_id, sock=None, marker=None, poll=0.1, owner=None):
+        self.id = stream_id
+        self.reason = None
+        self.notify = None  # called (from any thread) when the signal is set
+        self._sock = sock
+        self._marker = marker
+        self._poll = poll
+        self._next_poll = time.monotonic() + poll
+        self._registry = owner
+
+    def set(self, reason="stopped"):
+        if self.reason is None:
+            self.reason = reason
+            if self.notify is not None:
+                self.notify()
+
+    def is_set(self) -> bool:
+        if self.reason is not None:
+            return True
+        if self._sock is not None:
+            try:
+                if client_gone(self._sock):
+                    self.set("disconnected")
+                    return True
+            except ValueError:
+                self._sock = None  # e.g. a TLS socket, which cannot peek: rely on write errors
+        if self._marker is not None:
+            now = time.monotonic()
+            if now >= self._next_poll:
+                self._next_poll = now + self._poll
+                if os.path.exists(self._marker):
+                    self.set("stopped")
+        return self.reason is not None
+
+    def close(self):
+        """Unregisters the stream (idempotent)."""
+        if self._registry is not None:
+            self._registry._forget(self)
+            self._registry = None
+
+
+class StreamRegistry:
+    """The streams of this worker by id, plus the averages behind the savings estimate."""
+
+    MARKER_TTL = 300.0  # stop markers nobody picked up are removed after this long
+
+    def __init__(self, directory=None, poll=0.1):
+        self.directory = directory or None
+        self.poll = poll
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.avg_chunks = None
+        self.avg_seconds = None
+        self.cancelled = {"disconnected": 0, "stopped": 0}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _marker(self, stream_id):
+        return os.path.join(self.directory, f"{stream_id}.stop") if self.directory else None
+
+    def open(self, stream_id=None, sock=None) -> StopSignal:
+        """Registers a new stream, keeping the client's id if it is valid and unused."""
+        with self._lock:
+            if not (isinstance(stream_id, str) and STREAM_ID.match(stream_id)) or stream_id in self._streams:
+                stream_id = uuid.uuid4().hex
+            signal = StopSignal(stream_id, sock, self._marker(stream_id), self.poll, self)
+            self._streams[stream_id] = signal
+        return signal
+
+    def _forget(self, signal):
+        with self._lock:
+            if self._streams.get(signal.id) is signal:
+                del self._streams[signal.id]
+        if signal._marker is not None:
+            try:
+                os.remove(signal._marker)
+            except OSError:
+                pass
+
+    def stop(self, stream_id):
+        """Stops a stream: "stopped" if it runs in this worker, "requested" if a
+        marker was left for the other workers, None if it is unknown."""
+        if not STREAM_ID.match(stream_id or ""):
+            return None
+        with self._lock:
+            signal = self._streams.get(stream_id)
+        if signal is not None:
+            signal.set("stopped")
+            return "stopped"
+        if not self.directory:
+            return None
+        self._purge_markers()
+        with open(self._marker(stream_id), "w"):
+            pass
+        return "requested"
+
+    def _purge_markers(self):
+        cutoff = time.time() - self.MARKER_TTL
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith(".stop") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def finished(self, outcome, chunks, delivered, seconds):
+        """Records how a stream ended: completed answers feed the averages,
+        cancelled ones the wasted/saved counters."""
+        if outcome == "ok":
+            with self._lock:
+                if self.avg_chunks is None:
+                    self.avg_chunks, self.avg_seconds = float(chunks), seconds
+                else:
+                    self.avg_chunks = 0.8 * self.avg_chunks + 0.2 * chunks
+                    self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * seconds
+            return
+        if outcome not in self.cancelled:
+            return
+        with self._lock:
+            self.cancelled[outcome] += 1
+            avg_chunks, avg_seconds = self.avg_chunks, self.avg_seconds
+        CANCELLED_STREAMS.labels(outcome).inc()
+        if chunks > delivered:
+            WASTED_TOKENS.labels(outcome).inc(chunks - delivered)
+        if avg_chunks is not None and chunks:
+            # Only streams that were generating count: one cancelled while queued never reached a provider.
+            SAVED_TOKENS.labels(outcome).inc(max(0.0, avg_chunks - chunks))
+            SAVED_SECONDS.labels(outcome).inc(max(0.0, avg_seconds - seconds))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._streams),
+                "cancelled": dict(self.cancelled),
+                "shared": self.directory is not None,
+                "avg_answer_chunks": round(self.avg_chunks, 1) if self.avg_chunks is not None else None,
+            }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv("STREAM_STOP_DIR"),
+            poll=float(os.getenv("STREAM_STOP_POLL", 0.1)),
+        )
@@ -0,0 +1,146 @@
+"""Model cascade: simple turns go to a small, fast model; the large one only when needed.
+
+Without it every request goes to the provider's default (large) model
+unless the client names one. With CASCADE on, each agent has an escalation
+path of tiers (its "tiers" entry in app.AGENTS, default small -> large),
+and a turn moves one step along that path for each of these cheap local
+signals that fires:
+
+    detail  the message asks for a framework, plan, step-by-step or
+            in-depth answer (the kind Praxis and the Senate give)
+    prompt  the trimmed prompt is longer than CASCADE_MAX_PROMPT_TOKENS
+    depth   the conversation is deeper than CASCADE_MAX_DEPTH user turns
+
+So an acknowledgement or a short follow-up starts on the small model, and
+any signal escalates it. An agent whose path is a single tier (the Senate,
+which synthesizes a whole council) always uses that tier. A request that
+names a model keeps it.
+
+Only the primary provider serves the tier's model; a failover provider
+serves its own default (see providers.Provider.model_for).
+
+Per tier, /metrics reports requests by agent and reason, time to first
+token and the estimated spend (prompt tokens from history trimming,
+completion tokens from streamed chunks, at CASCADE_PRICES).
+benchmarks/eval_cascade.py evaluates the decisions offline over traces.
+
+Configured from the environment (see Cascade.from_env):
+    CASCADE                    "true" to enable (default off)
+    CASCADE_MODELS             JSON object of tier -> model (default: small is the
+                               provider's small model, large its default model)
+    CASCADE_MAX_PROMPT_TOKENS  prompt tokens above which a turn escalates (default 1500)
+    CASCADE_MAX_DEPTH          user turns above which a turn escalates (default 4)
+    CASCADE_PRICES             JSON object of model -> [input, output] USD per 1M tokens,
+                               merged over the built-in list
+"""
+import json
+import os
+
+from metrics import registry
+from router import KeywordRouter
+
+# The small model of each provider, for the default "small" tier.
+SMALL_MODELS = {"openai": "gpt-4o-mini", "groq": "llama3-8b-8192"}
+
+# List prices, USD per 1M (input, output) tokens.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "llama3-70b-8192": (0.59, 0.79),
+    "llama3-8b-8192": (0.05, 0.08),
+    "llama-3.1-70b-versatile": (0.59, 0.79),
+}
+
+# Requests for the structured, substantial answers a small model does worst.
+DETAIL_TERMS = [
+    "framework", "step by step", "step-by-step", "detailed", "in detail", "in depth", "in-depth",
+    "comprehensive", "thorough", "action plan", "roadmap", "playbook", "strategy", "strategies",
+    "compare", "pros and cons", "trade-off", "tradeoff", "analyse", "analyze", "analysis",
+]
+
+DEFAULT_PATH = ("small", "large")
+
+CASCADE_REQUESTS = registry.counter(
+    "gravitas_cascade_requests_total",
+    "Chat requests by cascade tier, agent and the first signal that escalated them (simple: none; "
+    "fixed: the agent has a single tier).", ["tier", "agent", "reason"])
+CASCADE_TTFT = registry.histogram(
+    "gravitas_cascade_ttft_seconds", "Time from the start of a chat stream to its first answer frame, by tier.",
+    ["tier"])
+CASCADE_COST = registry.counter(
+    "gravitas_cascade_cost_usd_total",
+    "Estimated spend by tier: trimmed prompt tokens and streamed chunks at CASCADE_PRICES.", ["tier", "model"])
+
+
+class Cascade:
+    """Picks a tier (and its model) per request from cheap local signals."""
+
+    def __init__(self, models, max_prompt_tokens=1500, max_depth=4, prices=None):
+        self.models = dict(models)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_depth = max_depth
+        self.prices = dict(MODEL_PRICES, **(prices or {}))
+        self.detail = KeywordRouter({"detail": DETAIL_TERMS})
+
+    def path(self, agent):
+        """The agent's escalation path, limited to the tiers that have a model."""
+        path = [tier for tier in agent.get("tiers", DEFAULT_PATH) if tier in self.models]
+        return path or [DEFAULT_PATH[-1]]
+
+    def signals(self, text: str, prompt_tokens: int, depth: int):
+        """The escalation signals that fire for a turn, in order of precedence."""
+        fired = []
+        if self.detail.scan(text.lower()):
+            fired.append("detail")
+        if prompt_tokens > self.max_prompt_tokens:
+            fired.append("prompt")
+        if depth > self.max_depth:
+            fired.append("depth")
+        return fired
+
+    def choose(self, agent, text: str, prompt_tokens: int, depth: int):
+        """(tier, reason) for one turn: one step along the agent's path per signal."""
+        path = self.path(agent)
+        if len(path) == 1:
+            return path[0], "fixed"
+        fired = self.signals(text, prompt_tokens, depth)
+        return path[min(len(fired), len(path) - 1)], fired[0] if fired else "simple"
+
+    def model(self, tier: str) -> str:
+        return self.models[tier]
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """USD for a request at list price (0 for a model without a price)."""
+        price_in, price_out = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * price_in + completion_tokens * price_out) / 1e6
+
+    def record(self, tier, agent_key, reason, model, ttft, prompt_tokens, completion_tokens):
+        """Metrics for one request that was sent to a tier."""
+        CASCADE_REQUESTS.labels(tier, agent_key, reason).inc()
+        if ttft is not None:
+            CASCADE_TTFT.labels(tier).observe(ttft)
+        if completion_tokens:
+            CASCADE_COST.labels(tier, model).inc(self.cost(model, prompt_tokens, completion_tokens))
+
+    def stats(self):
+        return {
+            "models": dict(self.models),
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "max_depth": self.max_depth,
+        }
+
+    @classmethod
+    def from_env(cls, provider: str, default_model: str):
+        """Builds the cascade from CASCADE_* variables, or returns None if disabled."""
+        if os.getenv("CASCADE", "false").lower() != "true" or not default_model:
+            return None
+        models = {"small": SMALL_MODELS.get(provider, default_model), "large": default_model}
+        models.update(json.loads(os.getenv("CASCADE_MODELS", "{}")))
+        prices = {model: tuple(price) for model, price in json.loads(os.getenv("CASCADE_PRICES", "{}")).items()}
+        return cls(
+            models,
+            max_prompt_tokens=int(os.getenv("CASCADE_MAX_PROMPT_TOKENS", 1500)),
+            max_depth=int(os.getenv("CASCADE_MAX_DEPTH", 4)),
+            prices=prices,
+        )
@@ -0,0 +1,162 @@
+"""Coalescing of streamed tokens into fewer, larger SSE frames.
+
+Providers stream content in chunks of a few characters. Writing each one as
+its own SSE frame costs a WSGI write, a TCP send and a client-side re-render
+per chunk. This stage sits between the provider iterator and the response:
+text is buffered and flushed once `flush_bytes` are pending or the oldest
+pending text is `flush_ms` old, whichever comes first. The first token is
+always sent at once so time-to-first-token is unchanged.
+
+Flushes are cut after the last space in the buffer, holding back a partial
+word until the next flush. Frames carry the text verbatim (see sse.py) and
+the client appends each one as is, so where a flush is cut never changes
+the answer; cutting between words only means the incremental renderer in
+static/app.js never shows half a word.
+
+On the async (ASGI) path the time window is enforced with a timer. A WSGI
+generator can only write when it resumes, so the sync path checks the
+window as chunks arrive; during an upstream stall, pending text waits for
+the next chunk.
+
+Configured from the environment (see Coalescing.from_env), overridable per
+request with {"coalesce": {"bytes": 256, "ms": 30}} or {"coalesce": false}:
+    SSE_FLUSH_BYTES  pending bytes that trigger a flush (default 160; 0 = every chunk)
+    SSE_FLUSH_MS     max age of pending text in milliseconds (default 30)
+"""
+import asyncio
+import os
+import time
+
+MAX_FLUSH_BYTES = 16384
+MAX_FLUSH_MS = 1000
+
+
+class Coalescing:
+    """Flush thresholds for one stream; 0 bytes disables coalescing."""
+
+    __slots__ = ("flush_bytes", "flush_ms")
+
+    def __init__(self, flush_bytes=160, flush_ms=30):
+        self.flush_bytes = flush_bytes
+        self.flush_ms = flush_ms
+
+    @property
+    def enabled(self):
+        return self.flush_bytes > 0 and self.flush_ms > 0
+
+    def for_request(self, option):
+        """Applies a request's "coalesce" option (dict, false or absent), clamped to sane bounds."""
+        if option is None or option is True:
+            return self
+        if option is False:
+            return Coalescing(0, 0)
+        if not isinstance(option, dict):
+            return self
+        try:
+            flush_bytes = int(option.get("bytes", self.flush_bytes))
+            flush_ms = float(option.get("ms", self.flush_ms))
+        except (TypeError, ValueError):
+            return self
+        return Coalescing(min(max(flush_bytes, 0), MAX_FLUSH_BYTES), min(max(flush_ms, 0.0), MAX_FLUSH_MS))
+
+    def stats(self):
+        return {"flush_bytes": self.flush_bytes, "flush_ms": self.flush_ms}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            flush_bytes=int(os.getenv("SSE_FLUSH_BYTES", 160)),
+            flush_ms=float(os.getenv("SSE_FLUSH_MS", 30)),
+        )
+
+
+class _Buffer:
+    """Pending text plus the time its oldest character arrived."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.window = settings.flush_ms / 1000.0
+        self.hard_limit = settings.flush_bytes * 4  # flush mid-word past this (URLs, code)
+        self.text = ""
+        self.since = 0.0
+        self.sent_first = False
+
+    def add(self, content, now):
+        if not self.text:
+            self.since = now
+        self.text += content
+
+    def due(self, now):
+        return bool(self.text) and (len(self.text) >= self.settings.flush_bytes or now - self.since >= self.window)
+
+    def take(self, final=False):
+        """Removes and returns the text to send now ("" to keep waiting)."""
+        text = self.text
+        if final or not self.sent_first or len(text) >= self.hard_limit:
+            cut = len(text)
+        else:
+            cut = text.rfind(" ") + 1
+        self.text = text[cut:]
+        self.since = time.monotonic()
+        if cut:
+            self.sent_first = True
+        return text[:cut]
+
+
+def coalesce(chunks, settings):
+    """Re-chunks an iterable of text into coalesced pieces (sync path)."""
+    if not settings.enabled:
+        yield from chunks
+        return
+    buffer = _Buffer(settings)
+    for content in chunks:
+        now = time.monotonic()
+        buffer.add(content, now)
+        if not buffer.sent_first or buffer.due(now):
+            text = buffer.take()
+            if text:
+                yield text
+    if buffer.text:
+        yield buffer.take(final=True)
+
+
+async def acoalesce(chunks, settings):
+    """Async twin of coalesce(); flushes on a timer even while the provider stalls."""
+    if not settings.enabled:
+        async for content in chunks:
+            yield content
+        return
+    buffer = _Buffer(settings)
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if buffer.text:
+                timeout = max(0.0, buffer.since + buffer.window - time.monotonic())
+                await asyncio.wait({pending}, timeout=timeout)
+                if not pending.done():
+                    # Window elapsed while the provider is quiet: flush what we can.
+                    text = buffer.take()
+                    if text:
+                        yield text
+                    continue
+            try:
+                content = await pending
+            except StopAsyncIteration:
+                break
+            finally:
+                if pending.done():
+                    pending = None
+            now = time.monotonic()
+            buffer.add(content, now)
+            if not buffer.sent_first or buffer.due(now):
+                text = buffer.take()
+                if text:
+                    yield text
+        if buffer.text:
+            yield buffer.take(final=True)
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,186 @@
+"""Server-side conversation store for the opt-in conversation-id mode.
+
+Clients that opt in send only the new user message plus a conversation id
+instead of the whole history on every turn. The history lives here: an
+in-process LRU of recent conversations, optionally backed by an
+append-only SQLite log so that every gunicorn worker on the host sees the
+same conversations. A worker that has a conversation cached only reads the
+messages appended since it last looked.
+
+Configured from the environment (see from_env):
+    CONVERSATION_MAX  conversations kept in memory per worker (default 10000)
+    CONVERSATION_TTL  idle seconds before a conversation expires (default 86400)
+    CONVERSATION_DB   path of the shared SQLite log (default: memory only)
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class SQLiteConversationLog:
+    """Append-only message log shared across workers (one connection per thread)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (conversation_id, seq))"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def append(self, conversation_id: str, seq: int, role: str, content: str):
+        self._connect().execute(
+            "INSERT OR IGNORE INTO messages (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, seq, role, content, time.time()),
+        )
+
+    def read_since(self, conversation_id: str, seq: int, not_before: float):
+        """Messages with sequence number >= seq, or None if the conversation is unknown or idle too long."""
+        conn = self._connect()
+        last = conn.execute(
+            "SELECT MAX(seq), MAX(created_at) FROM messages WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if last[0] is None or last[1] < not_before:
+            return None
+        rows = conn.execute(
+            "SELECT role, content FROM messages WHERE conversation_id = ? AND seq >= ? ORDER BY seq",
+            (conversation_id, seq),
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def purge(self, not_before: float):
+        self._connect().execute(
+            "DELETE FROM messages WHERE conversation_id IN ("
+            "SELECT conversation_id FROM messages GROUP BY conversation_id HAVING MAX(created_at) < ?)",
+            (not_before,),
+        )
+
+
+class ConversationStore:
+    """Thread-safe LRU of conversations with an optional shared append-only log."""
+
+    PURGE_EVERY = 1024  # appends between purges of idle conversations in the shared log
+
+    def __init__(self, max_conversations=10000, ttl=86400.0, backend=None):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.backend = backend
+        self._conversations = OrderedDict()  # id -> [messages, last_active]
+        self._lock = threading.Lock()
+        self._appends = 0
+        self.created = 0
+        self.hits = 0
+        self.shared_loads = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def create(self, messages=()):
+        """Starts a conversation (optionally seeded with existing messages); returns its id."""
+        conversation_id = uuid.uuid4().hex
+        with self._lock:
+            self._conversations[conversation_id] = [[], time.time()]
+            self.created += 1
+            self._evict()
+        for message in messages:
+            self.append(conversation_id, message["role"], message["content"])
+        return conversation_id
+
+    def history(self, conversation_id: str):
+        """Returns a copy of the conversation's messages, or None if unknown or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is not None and entry[1] < now - self.ttl:
+                del self._conversations[conversation_id]
+                entry = None
+            known = len(entry[0]) if entry is not None else 0
+
+        if self.backend is not None:
+            # Another worker may have appended turns since this one last looked.
+            newer = self.backend.read_since(conversation_id, known, now - self.ttl)
+            with self._lock:
+                entry = self._conversations.get(conversation_id)
+                if newer is not None and entry is None:
+                    entry = self._conversations[conversation_id] = [[], now]
+                    self._evict()
+                if newer and entry is not None and len(entry[0]) == known:
+                    entry[0].extend(newer)
+                    self.shared_loads += 1
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            entry[1] = now
+            if conversation_id in self._conversations:
+                self._conversations.move_to_end(conversation_id)
+            self.hits += 1
+            return list(entry[0])
+
+    def append(self, conversation_id: str, role: str, content: str):
+        if self.backend is not None:
+            with self._lock:
+                cached = conversation_id in self._conversations
+            if not cached:
+                # Evicted here but possibly live in the shared log: catch up first
+                # so the new message gets the right sequence number.
+                self.history(conversation_id)
+        message = {"role": role, "content": content}
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                entry = self._conversations[conversation_id] = [[], time.time()]
+                self._evict()
+            seq = len(entry[0])
+            entry[0].append(message)
+            entry[1] = time.time()
+            self._conversations.move_to_end(conversation_id)
+            self._appends += 1
+            purge_due = self._appends % self.PURGE_EVERY == 0
+        if self.backend is not None:
+            self.backend.append(conversation_id, seq, role, content)
+            if purge_due:
+                self.backend.purge(time.time() - self.ttl)
+
+    def _evict(self):
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "created": self.created,
+                "hits": self.hits,
+                "shared_loads": self.shared_loads,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "shared_backend": self.backend.path if self.backend is not None else None,
+            }
+
+    @classmethod
+    def from_env(cls):
+        db_path = os.getenv("CONVERSATION_DB")
+        return cls(
+            max_conversations=int(os.getenv("CONVERSATION_MAX", 10000)),
+            ttl=float(os.getenv("CONVERSATION_TTL", 86400)),
+            backend=SQLiteConversationLog(db_path) if db_path else None,
+        )
@@ -0,0 +1,79 @@
+"""Gunicorn settings hooks (loaded automatically from the working directory).
+
+The command-line flags in the Procfile still set workers, threads, timeout
+and --preload; this file only adds the per-worker provider warm-up, the
+directories the workers share (metrics, stop requests) and the fork
+handling for a preloaded app.
+
+With --preload the master imports app.py once (agent tables, compiled
+routers, caches, the configured provider SDKs) and the workers are forked
+from it, sharing those pages copy-on-write. Everything that is per process
+is made after the fork: provider clients on first use (providers.Provider),
+the logging listener here, the metrics flusher on the first request.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+
+# Directories the workers share for one server run, unless set in the environment.
+SHARED_DIRS = {"METRICS_DIR": "gravitas-metrics-", "STREAM_STOP_DIR": "gravitas-stops-"}
+
+
+def make_shared_dirs():
+    """Gives the workers a fresh METRICS_DIR (so /metrics sums all of them)
+    and STREAM_STOP_DIR (so a stop request reaches the worker streaming).
+
+    Runs when this file is loaded: a --preload master imports the app
+    (which reads both) before the on_starting hook.
+    """
+    created = []
+    for name, prefix in SHARED_DIRS.items():
+        if not os.getenv(name):
+            os.environ[name] = tempfile.mkdtemp(prefix=prefix)
+            created.append(name)
+    if created:
+        os.environ["GRAVITAS_TMP_DIRS"] = ",".join(created)
+
+
+make_shared_dirs()
+
+
+def on_exit(server):
+    for name in filter(None, os.environ.pop("GRAVITAS_TMP_DIRS", "").split(",")):
+        shutil.rmtree(os.environ.get(name, ""), ignore_errors=True)
+
+
+def when_ready(server):
+    """In a --preload master: imports the provider SDKs, then freezes the
+    heap so the workers' garbage collections do not write to (and so copy)
+    the pages they share with it."""
+    if not server.cfg.preload_app:
+        return
+    import app as gravitas
+    gravitas.preload()
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Restarts the logging listener, whose thread does not survive a fork."""
+    from logs import setup_logging
+    setup_logging()
+
+
+def post_worker_init(worker):
+    """Sizes admission control and the provider connection pool to the
+    worker's threads and opens pooled connections once the worker has
+    loaded the app.
+
+    Warm-up is enabled with HTTP_WARMUP=<connections>; /api/health answers
+    503 "warming" until the connections are up.
+    """
+    if "uvicorn" in type(worker).__module__:
+        return  # asgi.py warms its async client in the lifespan startup instead
+    import app as gravitas
+    gravitas.admission.size_for(worker.cfg.threads)
+    gravitas.http_pool.threads = worker.cfg.threads  # clients are built on first use, after this
+    gravitas.start_warm_up()
@@ -0,0 +1,202 @@
+"""Token-budget-aware history trimming.
+
+Replaces the fixed "last 10 messages" window: the newest turns are packed
+into a per-model prompt-token budget, so ten pasted speeches no longer blow
+past the context window while ten "ok" messages no longer waste it.
+Optionally, turns that no longer fit are collapsed into a short extractive
+summary that rides along as a second system message.
+
+Token counts are cached per message (role + content), so a conversation's
+earlier turns are not re-counted on every request.
+
+Old turns are dropped in whole blocks of HISTORY_BLOCK messages, counted
+from the start of the conversation, rather than one message at a time. The
+prompt then keeps the same prefix (system prompt plus the same first kept
+message) for several turns in a row, which is what provider-side prompt
+caching keys on; a per-message sliding window changes the prefix on every
+turn once the budget is reached. The price is up to HISTORY_BLOCK - 1
+messages less context right after a block is dropped.
+
+Configured from the environment (see from_env):
+    HISTORY_TOKEN_BUDGET    default prompt budget in tokens (default 6000)
+    HISTORY_TOKEN_BUDGETS   JSON object of per-model overrides
+    HISTORY_BLOCK           messages dropped together when trimming (default 8; 1 = sliding window)
+    HISTORY_SUMMARY         "true" to summarize dropped turns (default off)
+    HISTORY_SUMMARY_TOKENS  size bound of that summary (default 200)
+    HISTORY_TOKENIZER       "tiktoken" to count exactly (needs tiktoken and
+                            its BPE files); default is a ~4 chars/token estimate
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+# Prompt budgets (history + system prompt) per model, leaving room for the answer.
+MODEL_TOKEN_BUDGETS = {
+    "gpt-4o": 12000,
+    "gpt-4o-mini": 12000,
+    "gpt-4.1": 12000,
+    "llama3-70b-8192": 5000,
+    "llama3-8b-8192": 5000,
+    "llama-3.1-70b-versatile": 12000,
+}
+
+MESSAGE_OVERHEAD = 4  # role and separator tokens per chat message
+SENTENCE_RE = re.compile(r"(.+?[.!?])(\s|$)", re.S)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+@functools.lru_cache(maxsize=16384)
+def first_sentence(content: str, limit: int = 200) -> str:
+    match = SENTENCE_RE.match(content)
+    return (match.group(1) if match else content)[:limit].replace("\n", " ")
+
+
+def tiktoken_counter():
+    """Returns an exact counter backed by tiktoken, or None if unavailable."""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        log.warning("tiktoken unavailable (%s); estimating token counts.", e)
+        return None
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class TrimResult:
+    """Outcome of trimming one request's history."""
+
+    __slots__ = ("messages", "prompt_tokens", "original_tokens", "dropped", "summarized")
+
+    def __init__(self, messages, prompt_tokens, original_tokens, dropped, summarized):
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.original_tokens = original_tokens
+        self.dropped = dropped
+        self.summarized = summarized
+
+    @property
+    def saved_tokens(self):
+        return self.original_tokens - self.prompt_tokens
+
+
+class HistoryManager:
+    """Packs the newest turns of a conversation into a per-model token budget."""
+
+    def __init__(self, default_budget=6000, budgets=None, summarize=False, summary_tokens=200,
+                 count=None, cache_size=65536, block=8):
+        self.default_budget = default_budget
+        self.block = max(1, block)
+        self.budgets = dict(MODEL_TOKEN_BUDGETS, **(budgets or {}))
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        count = count or estimate_tokens
+        # Cached per (role, content): earlier turns are counted once, not every turn.
+        self.message_tokens = functools.lru_cache(maxsize=cache_size)(
+            lambda role, content: count(content) + MESSAGE_OVERHEAD
+        )
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.tokens_saved = 0
+
+    def budget_for(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+    def tokens(self, message) -> int:
+        return self.message_tokens(message.get("role", ""), str(message.get("content", "")))
+
+    def trim(self, system_message, messages, model: str) -> TrimResult:
+        """Returns the system message plus the newest messages that fit the budget.
+
+        The cut is rounded up to a multiple of `block` so the kept prefix
+        stays put between turns. The latest message is always kept, even if
+        it alone exceeds the budget.
+        """
+        budget = self.budget_for(model)
+        system_tokens = self.tokens(system_message)
+        counts = [self.tokens(m) for m in messages]
+        original = system_tokens + sum(counts)
+
+        reserve = self.summary_tokens + MESSAGE_OVERHEAD if self.summarize and original > budget else 0
+        used = system_tokens
+        start = len(messages)
+        while start > 0:
+            if start < len(messages) and used + counts[start - 1] > budget - reserve:
+                break
+            start -= 1
+            used += counts[start]
+
+        if start % self.block:
+            stable = start + self.block - start % self.block
+            if stable < len(messages):
+                used -= sum(counts[start:stable])
+                start = stable
+
+        kept = [system_message] + messages[start:]
+        summarized = False
+        if start > 0 and self.summarize:
+            summary = self.summarize_turns(messages[:start])
+            if summary:
+                note = {"role": "system", "content": summary}
+                kept.insert(1, note)
+                used += self.tokens(note)
+                summarized = True
+
+        with self._lock:
+            self.requests += 1
+            if start > 0:
+                self.trimmed_requests += 1
+            self.tokens_saved += original - used
+        return TrimResult(kept, used, original, start, summarized)
+
+    def summarize_turns(self, dropped) -> str:
+        """Extractive rolling summary: the first sentence of the most recent dropped turns."""
+        lines, used = [], estimate_tokens("Earlier in this conversation:")
+        for message in reversed(dropped):
+            content = str(message.get("content", "")).strip()
+            if not content or message.get("role") == "system":
+                continue
+            label = "User" if message.get("role") == "user" else "Coach"
+            line = f"- {label}: {first_sentence(content)}"
+            cost = estimate_tokens(line)
+            if used + cost > self.summary_tokens:
+                continue
+            lines.append(line)
+            used += cost
+            if self.summary_tokens - used < 16:
+                break
+        if not lines:
+            return ""
+        return "Earlier in this conversation:\n" + "\n".join(reversed(lines))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "trimmed_requests": self.trimmed_requests,
+                "prompt_tokens_saved": self.tokens_saved,
+                "default_budget": self.default_budget,
+                "block": self.block,
+                "summary": self.summarize,
+            }
+
+    @classmethod
+    def from_env(cls):
+        count = tiktoken_counter() if os.getenv("HISTORY_TOKENIZER", "").lower() == "tiktoken" else None
+        return cls(
+            default_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 6000)),
+            budgets=json.loads(os.getenv("HISTORY_TOKEN_BUDGETS", "{}")),
+            summarize=os.getenv("HISTORY_SUMMARY", "false").lower() == "true",
+            summary_tokens=int(os.getenv("HISTORY_SUMMARY_TOKENS", 200)),
+            count=count,
+            block=int(os.getenv("HISTORY_BLOCK", 8)),
+        )
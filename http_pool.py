@@ -0,0 +1,158 @@
+"""Pooled HTTP transport for the provider SDK clients.
+
+The OpenAI and Groq SDKs each build an httpx client with library defaults:
+a 5-second keep-alive expiry (so any pause longer than that pays TCP and
+TLS setup again on the next request) and no way to tune the pool per
+deployment. Here the client is built explicitly and shared by every
+thread (or coroutine) in a worker, and can optionally be warmed up at
+boot so the first user request after a deploy finds open connections.
+
+The sync client (Flask under gunicorn gthread) needs at most one connection
+per thread that can be calling a provider at once: the worker's request
+threads (twice over with hedging) plus the Senate and batch executors, so
+that is its default limit. The async client (asgi.py) multiplexes every
+stream of the worker on one event loop, so it is not limited by default.
+
+Configured from the environment (see HttpPool.from_env):
+    HTTP_POOL_MAX_CONNECTIONS  open connections of the sync client (default: one per
+                               calling thread, see HttpPool.sync_limit)
+    HTTP_POOL_MAX_ASYNC_CONNECTIONS  open connections of the async client (default 0, unlimited)
+    HTTP_POOL_MAX_KEEPALIVE    idle connections kept open (default 10)
+    HTTP_KEEPALIVE_EXPIRY      seconds an idle connection is kept (default 60)
+    HTTP2                      "true" to negotiate HTTP/2 (needs the h2 package)
+    HTTP_CONNECT_TIMEOUT       connect timeout in seconds (default 5)
+    HTTP_READ_TIMEOUT          read/write timeout in seconds (default 120)
+    HTTP_WARMUP                connections to open at worker boot (default 0, off)
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def httpx_module(client_class):
+    """The httpx package client_class is built on.
+
+    Some OpenAI SDK releases ship on a renamed httpx fork; Limits and Timeout
+    must come from the same package as the client.
+    """
+    for base in client_class.__mro__:
+        package = base.__module__.split(".")[0]
+        if package.startswith("httpx"):
+            return sys.modules[package]
+    raise TypeError(f"{client_class!r} is not an httpx client")
+
+
+class HttpPool:
+    """Connection-pool settings plus a factory for pooled httpx clients."""
+
+    def __init__(self, max_connections=None, max_async_connections=None, max_keepalive=10, keepalive_expiry=60.0,
+                 http2=False, connect_timeout=5.0, read_timeout=120.0, warmup_connections=0):
+        self.max_connections = max_connections
+        self.max_async_connections = max_async_connections
+        # What the default sync limit is sized from; gunicorn.conf.py sets the
+        # worker's threads, app.py the rest.
+        self.threads = 8
+        self.connections_per_thread = 1
+        self.background_threads = 0
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2 and self._h2_available()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.warmup_connections = warmup_connections
+
+    @staticmethod
+    def _h2_available():
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log.warning("HTTP2=true but the h2 package is not installed; using HTTP/1.1.")
+            return False
+        return True
+
+    def sync_limit(self) -> int:
+        """Connections for the sync client: HTTP_POOL_MAX_CONNECTIONS, or one
+        per thread that can be calling a provider at once."""
+        if self.max_connections:
+            return self.max_connections
+        return self.threads * self.connections_per_thread + self.background_threads
+
+    def build(self, client_class):
+        """Instantiates client_class (httpx.Client, httpx.AsyncClient or an SDK subclass)."""
+        httpx = httpx_module(client_class)
+        asynchronous = issubclass(client_class, httpx.AsyncClient)
+        return client_class(
+            limits=httpx.Limits(
+                max_connections=(self.max_async_connections or None) if asynchronous else self.sync_limit(),
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            http2=self.http2,
+        )
+
+    def stats(self):
+        return {
+            "max_connections": self.sync_limit(),
+            "max_async_connections": self.max_async_connections or None,
+            "max_keepalive": self.max_keepalive,
+            "keepalive_expiry": self.keepalive_expiry,
+            "http2": self.http2,
+            "warmup_connections": self.warmup_connections,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_connections=int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", 0)) or None,
+            max_async_connections=int(os.getenv("HTTP_POOL_MAX_ASYNC_CONNECTIONS", 0)) or None,
+            max_keepalive=int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", 10)),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60)),
+            http2=os.getenv("HTTP2", "false").lower() == "true",
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", 120)),
+            warmup_connections=int(os.getenv("HTTP_WARMUP", 0)),
+        )
+
+
+# ----- Warm-up -----
+def warm_up(provider_client, connections: int):
+    """Opens `connections` pooled connections by listing models concurrently.
+
+    Any HTTP response (even 401) means the connection and TLS session are
+    up, so errors are counted but not raised. Returns (ok, seconds).
+    """
+    start = time.perf_counter()
+    barrier = threading.Barrier(connections)
+    ok = []
+
+    def probe():
+        try:
+            barrier.wait(timeout=5)
+            provider_client.with_options(max_retries=0).models.list()
+            ok.append(True)
+        except Exception as e:
+            log.warning("Warm-up request failed: %s", e)
+
+    threads = [threading.Thread(target=probe, daemon=True) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(ok), time.perf_counter() - start
+
+
+async def awarm_up(provider_client, connections: int):
+    """Async twin of warm_up for the ASGI client."""
+    start = time.perf_counter()
+    client = provider_client.with_options(max_retries=0)
+    results = await asyncio.gather(*(client.models.list() for _ in range(connections)), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            log.warning("Warm-up request failed: %s", result)
+    return sum(not isinstance(r, Exception) for r in results), time.perf_counter() - start
@@ -0,0 +1,91 @@
+"""Structured, levelled, non-blocking logging.
+
+Request threads and the event loop only put log records on an in-memory
+queue (logging.handlers.QueueHandler); a listener thread formats them and
+does the actual stdout writes. Fields passed with ``extra={...}`` become
+key=value pairs (text) or top-level keys (json).
+
+Configured from the environment (see setup_logging):
+    LOG_LEVEL   DEBUG, INFO, WARNING or ERROR (default INFO)
+    LOG_FORMAT  "json" for one JSON object per line, or "text" (default)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+# Attributes every LogRecord has; anything else on a record came from extra={...}.
+_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_state = {"pid": None, "listener": None}
+
+
+def _fields(record):
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        line = f"{stamp} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def _drain(listener):
+    """Flushes what is still queued on a clean exit (no-op if already stopped)."""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def setup_logging():
+    """Routes the root logger through a queue to a stdout listener thread.
+
+    Idempotent per process; call it again after a fork (the listener thread
+    does not survive one).
+    """
+    if _state["pid"] == os.getpid():
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else TextFormatter())
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=False)
+    listener.start()
+    atexit.register(_drain, listener)
+
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if getattr(h, "_gravitas", False)]:
+        root.removeHandler(handler)
+    handler = logging.handlers.QueueHandler(records)
+    handler._gravitas = True
+    root.addHandler(handler)
+    level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+    root.setLevel(level)
+    # The HTTP clients log every request at INFO; keep that for LOG_LEVEL=DEBUG.
+    for name in ("httpx", "httpx2", "httpcore"):
+        logging.getLogger(name).setLevel(max(level, logging.WARNING) if level > logging.DEBUG else level)
+    _state.update(pid=os.getpid(), listener=listener)
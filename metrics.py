@@ -0,0 +1,254 @@
+"""In-process Prometheus-style metrics, aggregated across gunicorn workers.
+
+Counters and fixed-bucket histograms are kept per label set in plain
+Python lists behind a lock, so recording a value costs a bisect and an
+increment. Label children are resolved once (`hist.labels(...)`) and can
+be reused on hot paths such as per-token timing.
+
+Each worker writes a JSON snapshot of its values to METRICS_DIR every
+METRICS_FLUSH_INTERVAL seconds (and at exit); /metrics sums every
+worker's snapshot with the live values of the worker answering, in the
+Prometheus text format. Snapshots of exited workers are kept, so counters
+never go backwards across worker restarts. gunicorn.conf.py points
+METRICS_DIR at a fresh directory per server run; without it the numbers
+cover only the current process.
+
+Configured from the environment:
+    METRICS_DIR             directory shared by the workers (default: per-process only)
+    METRICS_FLUSH_INTERVAL  seconds between snapshot writes (default 5)
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Latency buckets in seconds, from sub-millisecond routing to minute-long streams.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The child for one label set, created on first use."""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+    def dump(self):
+        return {json.dumps(k): c.value for k, c in list(self._children.items())}
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0.0) + value
+
+    def render(self, values):
+        lines = []
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, json.loads(key))} {value:g}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def dump(self):
+        dumped = {}
+        for key, child in list(self._children.items()):
+            with child._lock:
+                dumped[json.dumps(key)] = child.counts + [child.sum]
+        return dumped
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self, values):
+        lines = []
+        for key, data in sorted(values.items()):
+            labels = json.loads(key)
+            counts, total = data[:-1], data[-1]
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {total:g}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """All metrics of the process, plus the snapshot files of its sibling workers."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self.interval = 5.0
+        self._flusher_pid = None
+        self._path = None
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def configure(self, directory=None, interval=5.0):
+        self.directory = directory or None
+        self.interval = interval
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def ensure_flusher(self):
+        """Starts this process's snapshot writer (once per pid, so it survives forks)."""
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            # pid plus start time: a recycled pid must not overwrite an exited worker's totals.
+            self._path = os.path.join(self.directory, f"metrics-{os.getpid()}-{time.time_ns()}.json")
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            self.flush()
+
+    def _snapshot(self):
+        return {name: metric.dump() for name, metric in list(self._metrics.items())}
+
+    def flush(self):
+        """Writes this process's values to METRICS_DIR (atomically)."""
+        if not self.directory or self._flusher_pid != os.getpid():
+            return
+        try:
+            with open(self._path + ".tmp", "w") as f:
+                json.dump(self._snapshot(), f)
+            os.replace(self._path + ".tmp", self._path)
+        except OSError:
+            pass
+
+    def collect(self):
+        """Merged values: every other worker's last snapshot plus our live ones."""
+        snapshots = [self._snapshot()]
+        if self.directory:
+            own = self._path if self._flusher_pid == os.getpid() else None
+            for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                target = merged.setdefault(name, {})
+                for key, value in values.items():
+                    target[key] = metric.merge(target.get(key), value)
+        return merged
+
+    def render(self):
+        """The Prometheus text exposition (format 0.0.4) of collect()."""
+        merged = self.collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged.get(name, {})))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.configure(os.getenv("METRICS_DIR"), float(os.getenv("METRICS_FLUSH_INTERVAL", 5)))
@@ -0,0 +1,780 @@
+"""Provider pool: latency-ranked routing, failover and hedged requests.
+
+Keeps one client per configured provider (OpenAI, Groq) and tracks a
+rolling window of time-to-first-token (TTFT) and failures for each. Every
+request goes to the healthy provider with the lowest recent median TTFT;
+a provider that fails before its first token is skipped in favour of the
+next one, and one that fails several times in a row is put in cooldown.
+A provider with too few recent samples to rank (at startup, after a
+cooldown, or an idle fallback once its window has rolled over) ranks
+after the ones that have them; once per PROVIDER_PROBE_INTERVAL it gets a
+request first, as a probe, so it can earn its place back.
+
+With hedging on, a second provider is asked as well when the first has not
+produced a token within its own p95 TTFT (capped at a multiple of its
+median, so a slow patch that drags the p95 itself up still gets hedged).
+Whichever streams first wins and the other request is cancelled. Hedging trades some duplicate upstream
+spend for a shorter tail; it is off by default.
+
+Once a token has been streamed to the user the request is committed to that
+provider: a mid-stream error is surfaced rather than retried elsewhere, so
+the user never sees two answers spliced together.
+
+Each provider also paces its own requests with a token bucket fed by the
+x-ratelimit-*-requests headers of its responses (and Retry-After on a
+429), so a burst waits briefly for the provider's refill rate instead of
+running into its rate limit. A provider that would need a longer wait than
+PROVIDER_PACE_MAX_WAIT is ranked last and skipped while others can serve.
+
+Configured from the environment (see ProviderPool.from_env):
+    PROVIDERS                 comma-separated pool, in preference order
+                              (default: just PROVIDER, i.e. no failover)
+    PROVIDER_HEDGE            "true" to hedge slow first tokens (default off)
+    PROVIDER_HEDGE_QUANTILE   TTFT quantile used as the hedge deadline (default 0.95)
+    PROVIDER_HEDGE_DELAY      deadline while a provider has too few samples (default 2.0s)
+    PROVIDER_HEDGE_MAX_FACTOR cap on the deadline as a multiple of the median (default 3)
+    PROVIDER_STATS_WINDOW     seconds of history behind the rolling stats (default 300)
+    PROVIDER_COOLDOWN         seconds a tripped provider is skipped (default 30)
+    PROVIDER_PROBE_INTERVAL   seconds between probes of a provider with too few samples (default 30)
+    PROVIDER_PACE_MAX_WAIT    longest pacing wait before failing over (default 5s)
+"""
+import asyncio
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+UPSTREAM_CONNECT = registry.histogram(
+    "gravitas_upstream_connect_seconds",
+    "Time until the provider answered a streaming request with its response headers.", ["provider"])
+INTER_TOKEN_GAP = registry.histogram(
+    "gravitas_inter_token_gap_seconds", "Time between consecutive content chunks from a provider.", ["provider"])
+PROMPT_TOKENS = registry.counter(
+    "gravitas_prompt_tokens_total", "Prompt tokens reported in provider usage.", ["provider", "model"])
+CACHED_PROMPT_TOKENS = registry.counter(
+    "gravitas_cached_prompt_tokens_total", "Prompt tokens the provider served from its prompt cache.",
+    ["provider", "model"])
+COMPLETION_TOKENS = registry.counter(
+    "gravitas_completion_tokens_total", "Completion tokens reported in provider usage.", ["provider", "model"])
+
+_DONE = object()
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _seconds(value):
+    """Parses a rate-limit reset such as "1s", "6m0s" or "20ms" (or a bare number)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    return sum(float(n) * _UNITS[unit] for n, unit in parts) if parts else None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderBusy(Exception):
+    """Raised instead of waiting longer than the pacing limit for a rate-limited provider."""
+
+    def __init__(self, wait):
+        super().__init__(f"rate limited for another {wait:.1f}s")
+        self.wait = wait  # seconds until the provider can take the request
+
+
+class RateLimitPacer:
+    """Token bucket learned from a provider's rate-limit headers (thread-safe).
+
+    Until a response has carried x-ratelimit-* headers nothing is paced.
+    Every reserve() is settled by observe() (the response's headers) or
+    settle() (no response); requests reserved but not yet answered are
+    not in the provider's remaining count, so they are taken off it.
+    """
+
+    def __init__(self, max_wait=5.0):
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self.capacity = None
+        self.tokens = None
+        self.rate = None  # requests per second
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.pending = 0  # reserved, not yet answered
+        self.paced = 0
+        self.seconds = 0.0
+
+    def _refill(self, now):
+        if self.tokens is not None and self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def observe(self, headers):
+        """Settles a request and syncs the bucket with its response's x-ratelimit-* headers."""
+        with self._lock:
+            self.pending = max(0, self.pending - 1)
+        if headers is None:
+            return
+        limit = _int(headers.get("x-ratelimit-limit-requests"))
+        remaining = _int(headers.get("x-ratelimit-remaining-requests"))
+        reset = _seconds(headers.get("x-ratelimit-reset-requests"))
+        tokens_left = _int(headers.get("x-ratelimit-remaining-tokens"))
+        tokens_reset = _seconds(headers.get("x-ratelimit-reset-tokens"))
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit and remaining is not None:
+                self.capacity = limit
+                self.tokens = remaining - self.pending
+                if reset and limit > remaining:
+                    # The reset is the time to refill the whole deficit.
+                    self.rate = (limit - remaining) / reset
+                elif self.rate is None:
+                    self.rate = limit / 60.0  # limits are usually per minute
+            if tokens_left == 0 and tokens_reset:
+                self.blocked_until = max(self.blocked_until, now + tokens_reset)
+
+    def settle(self):
+        """Settles a reserved request that got no response."""
+        with self._lock:
+            self.pending = max(0, self.pending - 1)
+
+    def penalize(self, headers):
+        """Honours Retry-After (or the reset headers) from a 429."""
+        retry = _seconds(headers.get("retry-after")) if headers is not None else None
+        if retry is None and headers is not None:
+            retry = _seconds(headers.get("x-ratelimit-reset-requests"))
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + (retry or 1.0))
+            if self.tokens is not None:
+                self.tokens = min(self.tokens, 0)
+
+    def delay(self):
+        """Seconds the next request would have to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.blocked_until - now)
+            if self.tokens is not None and self.tokens < 1 and self.rate:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            return wait
+
+    def reserve(self):
+        """Takes a request from the bucket, returning how long to sleep first.
+
+        Raises ProviderBusy rather than wait longer than max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.blocked_until - now)
+            if self.tokens is not None and self.rate:
+                if self.tokens < 1:
+                    wait = max(wait, (1 - self.tokens) / self.rate)
+                if wait > self.max_wait:
+                    raise ProviderBusy(wait)
+                self.tokens -= 1
+            elif wait > self.max_wait:
+                raise ProviderBusy(wait)
+            if wait:
+                self.paced += 1
+                self.seconds += wait
+            self.pending += 1
+            return wait
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "tokens": round(self.tokens, 1) if self.tokens is not None else None,
+                "rate_per_s": round(self.rate, 3) if self.rate else None,
+                "paced": self.paced,
+                "paced_seconds": round(self.seconds, 2),
+            }
+
+
+def _headers(obj):
+    """Response headers of an SDK stream or API error, if it has them."""
+    response = getattr(obj, "response", None)
+    return getattr(response, "headers", None)
+
+
+class ProviderStats:
+    """Rolling TTFT samples and outcomes for one provider (thread-safe)."""
+
+    MIN_SAMPLES = 5       # samples needed before quantiles are trusted
+    TRIP_FAILURES = 3     # consecutive failures that trigger a cooldown
+    UNSAMPLED_TTFT = 1.0  # nominal median of a provider with too few samples
+
+    def __init__(self, window=300.0, cooldown=30.0, max_samples=512, probe_interval=30.0):
+        self.window = window
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self._next_probe = 0.0
+        self._samples = deque(maxlen=max_samples)  # (timestamp, ttft seconds or None for a failure)
+        self._lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record_ttft(self, seconds: float):
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds))
+            self.requests += 1
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self._samples.append((now, None))
+            self.requests += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.TRIP_FAILURES:
+                self.cooldown_until = now + self.cooldown
+
+    def record_usage(self, prompt_tokens, cached_tokens):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window
+        return [ttft for t, ttft in self._samples if t >= cutoff]
+
+    def quantile(self, q: float):
+        """TTFT quantile over the window, or None with too few samples."""
+        with self._lock:
+            ttfts = sorted(x for x in self._recent() if x is not None)
+        if len(ttfts) < self.MIN_SAMPLES:
+            return None
+        return ttfts[min(len(ttfts) - 1, int(q * len(ttfts)))]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            recent = self._recent()
+        return sum(x is None for x in recent) / len(recent) if recent else 0.0
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def sampled(self) -> bool:
+        """Whether there are enough recent TTFT samples to rank by."""
+        return self.quantile(0.5) is not None
+
+    def score(self) -> float:
+        """Lower is better: median TTFT (UNSAMPLED_TTFT while too few samples)
+        inflated by the error rate."""
+        p50 = self.quantile(0.5)
+        if p50 is None:
+            p50 = self.UNSAMPLED_TTFT
+        return p50 / max(0.05, 1.0 - self.error_rate())
+
+    def probe(self) -> bool:
+        """Takes the probe slot: True at most once per probe_interval."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_probe:
+                return False
+            self._next_probe = now + self.probe_interval
+            return True
+
+    def snapshot(self):
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "healthy": self.healthy(),
+            "ttft_p50": round(p50, 3) if p50 is not None else None,
+            "ttft_p95": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "requests": self.requests,
+            "failures": self.failures,
+            "prompt_tokens": self.prompt_tokens,
+            "prompt_cache_hit_rate": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+        }
+
+
+class Provider:
+    """One upstream provider: its lazily built sync and async clients and its stats.
+
+    Clients are built on first use in each process: one made before a fork
+    (gunicorn --preload) would share its connection pool with every worker.
+    """
+
+    def __init__(self, name, client, model, make_async=None, primary=False, stats=None, pacer=None,
+                 make_client=None):
+        self.name = name
+        self.model = model
+        self.primary = primary
+        self.stats = stats or ProviderStats()
+        self.pacer = pacer or RateLimitPacer()
+        self._make_client = make_client
+        self._client = client
+        self._client_pid = os.getpid() if client is not None else None
+        self._make_async = make_async
+        self._async_client = None
+        self._async_pid = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client_pid != os.getpid() and self._make_client is not None:
+            with self._build_lock:
+                if self._client_pid != os.getpid():
+                    self._client, self._client_pid = self._make_client(), os.getpid()
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_pid != os.getpid() and self._make_async is not None:
+            self._async_client, self._async_pid = self._make_async(), os.getpid()
+        return self._async_client
+
+    def sdk(self, asynchronous=False, retries=True):
+        """The client to call; without SDK retries when another provider can
+        take over, so a failing provider is abandoned quickly."""
+        client = self.async_client if asynchronous else self.client
+        if client is None:
+            raise RuntimeError(f"the {self.name} client could not be initialized")
+        return client if retries else client.with_options(max_retries=0)
+
+    def model_for(self, requested):
+        """A requested model name only applies to the primary provider; the
+        others serve their own default model."""
+        return requested if requested and self.primary else self.model
+
+
+def _content(chunk):
+    if not chunk.choices:
+        return None
+    return getattr(chunk.choices[0].delta, "content", None)
+
+
+def _field(obj, name):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _usage(chunk):
+    """(prompt, cached, completion) tokens from a usage-bearing chunk, else None.
+
+    OpenAI sends usage in a final chunk when asked with stream_options;
+    Groq attaches it to the last chunk under x_groq.
+    """
+    usage = getattr(chunk, "usage", None) or _field(getattr(chunk, "x_groq", None), "usage")
+    if not usage:
+        return None
+    details = _field(usage, "prompt_tokens_details")
+    cached = _field(details, "cached_tokens") if details else None
+    return _field(usage, "prompt_tokens") or 0, cached or 0, _field(usage, "completion_tokens") or 0
+
+
+def _record_usage(provider, model, chunk):
+    usage = _usage(chunk)
+    if usage is None:
+        return
+    prompt, cached, completion = usage
+    PROMPT_TOKENS.labels(provider.name, model).inc(prompt)
+    CACHED_PROMPT_TOKENS.labels(provider.name, model).inc(cached)
+    COMPLETION_TOKENS.labels(provider.name, model).inc(completion)
+    provider.stats.record_usage(prompt, cached)
+
+
+class ProviderPool:
+    """Routes streaming chat completions across providers (see module docstring)."""
+
+    def __init__(self, providers, hedge=False, hedge_quantile=0.95, hedge_delay=2.0, hedge_max_factor=3.0):
+        self.providers = list(providers)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay_default = hedge_delay
+        self.hedge_max_factor = hedge_max_factor
+        # Models that get their own metric label; app.py adds the cascade's.
+        self.metric_models = {p.model for p in self.providers}
+        self._lock = threading.Lock()
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.probes = 0
+
+    def ranked(self, probe=False):
+        """Healthy providers with enough samples by score, then those with too
+        few (by error rate), then the ones in cooldown or paced beyond the
+        pacing limit (as a last resort).
+
+        With probe (a request about to be routed), an available provider with
+        too few samples whose probe slot is free goes first instead.
+        """
+        order = {p.name: i for i, p in enumerate(self.providers)}
+        state = {p.name: (not p.stats.healthy() or p.pacer.delay() > p.pacer.max_wait, not p.stats.sampled())
+                 for p in self.providers}
+        ranked = sorted(self.providers, key=lambda p: (*state[p.name], p.stats.score(), order[p.name]))
+        if probe and any(not unsampled for _, unsampled in state.values()):
+            for i, p in enumerate(ranked):
+                unavailable, unsampled = state[p.name]
+                if not unavailable and unsampled and p.stats.probe():
+                    self._count("probes")
+                    return [p] + ranked[:i] + ranked[i + 1:]
+        return ranked
+
+    def hedge_delay(self, provider) -> float:
+        delay = provider.stats.quantile(self.hedge_quantile)
+        if delay is None:
+            return self.hedge_delay_default
+        return max(0.05, min(delay, self.hedge_max_factor * provider.stats.quantile(0.5)))
+
+    def model_label(self, model):
+        """The model as a metric label: any other model (a client can name
+        one) is "other", so clients cannot add label sets."""
+        return model if model in self.metric_models else "other"
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    # ----- Sync (Flask) -----
+    def _stream_one(self, provider, request, cancel=None, retries=True):
+        """Streams one provider's content deltas, recording its TTFT or failure."""
+        wait = provider.pacer.reserve()
+        if wait:
+            time.sleep(wait)
+        start = time.monotonic()
+        first = True
+        resp = None
+        try:
+            resp = provider.sdk(retries=retries).chat.completions.create(stream=True, **request)
+            last = time.monotonic()
+            UPSTREAM_CONNECT.labels(provider.name).observe(last - start)
+            provider.pacer.observe(_headers(resp))
+            gap = INTER_TOKEN_GAP.labels(provider.name)
+            for chunk in resp:
+                if cancel is not None and cancel.is_set():
+                    break
+                content = _content(chunk)
+                if not content:
+                    _record_usage(provider, self.model_label(request["model"]), chunk)
+                    continue
+                now = time.monotonic()
+                if first:
+                    provider.stats.record_ttft(now - start)
+                    first = False
+                else:
+                    gap.observe(now - last)
+                last = now
+                yield content
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                provider.pacer.penalize(_headers(e))
+            if cancel is None or not cancel.is_set():
+                provider.stats.record_failure()
+            raise
+        finally:
+            if resp is not None:
+                resp.close()
+            else:
+                provider.pacer.settle()
+        if first:
+            # Empty answer, or a hedge loser cancelled before its first token:
+            # the elapsed time is a lower bound on its TTFT.
+            provider.stats.record_ttft(time.monotonic() - start)
+
+    def stream(self, request_for, served=None, cancel=None, retries=True):
+        """Yields content deltas from the best provider.
+
+        request_for(provider) returns the create() kwargs (model, messages,
+        temperature) for that provider. `served`, if given, is a dict that
+        receives the name and model of the provider that answered. `cancel`
+        (anything with is_set(), checked once per upstream chunk) ends the
+        stream early and closes the upstream response. With retries=False
+        the last provider is not retried by its SDK either, for a caller
+        that retries through the pacer itself (see batch.py).
+        """
+        ranked = self.ranked(probe=True)
+        if self.hedge and len(ranked) > 1:
+            yield from self._hedged(ranked, request_for, served, cancel, retries)
+            return
+
+        for i, provider in enumerate(ranked):
+            request = request_for(provider)
+            if served is not None:
+                served.update(provider=provider.name, model=request["model"])
+            started = False
+            try:
+                for content in self._stream_one(provider, request, cancel, retries=retries and i == len(ranked) - 1):
+                    started = True
+                    yield content
+                return
+            except Exception as e:
+                if started or i == len(ranked) - 1:
+                    raise
+                log.warning("Provider %s failed before its first token (%s); failing over.", provider.name, e)
+                self._count("failovers")
+
+    def _hedged(self, ranked, request_for, served, cancel=None, retries=True):
+        results = queue.Queue()
+        cancels = {}
+        candidates = iter(ranked)
+
+        def run(provider, request, cancel, retries):
+            try:
+                for content in self._stream_one(provider, request, cancel, retries):
+                    results.put((provider, content))
+                results.put((provider, _DONE))
+            except Exception as e:
+                results.put((provider, e))
+
+        def launch():
+            provider = next(candidates, None)
+            if provider is None:
+                return None
+            request = request_for(provider)
+            cancels[provider.name] = (threading.Event(), request["model"])
+            threading.Thread(target=run, args=(provider, request, cancels[provider.name][0],
+                                               retries and provider is ranked[-1]),
+                             name=f"hedge-{provider.name}", daemon=True).start()
+            return provider
+
+        primary = launch()
+        deadline = time.monotonic() + self.hedge_delay(primary)
+        winner, running, hedged = None, 1, False
+        try:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    return
+                timeout = None
+                if winner is None and not hedged:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    provider, item = results.get(timeout=timeout)
+                except queue.Empty:
+                    hedged = True
+                    if launch() is not None:
+                        running += 1
+                        self._count("hedges")
+                    continue
+
+                if winner is None:
+                    if isinstance(item, Exception):
+                        running -= 1
+                        if running == 0:
+                            if launch() is None:
+                                raise item
+                            running += 1
+                            self._count("failovers")
+                        continue
+                    winner = provider
+                    if winner is not primary:
+                        self._count("hedge_wins")
+                    if served is not None:
+                        served.update(provider=winner.name, model=cancels[winner.name][1])
+                    for name, (event, _) in cancels.items():
+                        if name != winner.name:
+                            event.set()
+                if provider is not winner:
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Client disconnects and losers alike: stop every producer.
+            for event, _ in cancels.values():
+                event.set()
+
+    # ----- Async (ASGI) -----
+    async def _astream_one(self, provider, request, retries=True):
+        wait = provider.pacer.reserve()
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                provider.pacer.settle()
+                raise
+        start = time.monotonic()
+        first = True
+        resp = None
+        try:
+            resp = await provider.sdk(asynchronous=True, retries=retries).chat.completions.create(
+                stream=True, **request)
+            last = time.monotonic()
+            UPSTREAM_CONNECT.labels(provider.name).observe(last - start)
+            provider.pacer.observe(_headers(resp))
+            gap = INTER_TOKEN_GAP.labels(provider.name)
+            async for chunk in resp:
+                content = _content(chunk)
+                if not content:
+                    _record_usage(provider, self.model_label(request["model"]), chunk)
+                    continue
+                now = time.monotonic()
+                if first:
+                    provider.stats.record_ttft(now - start)
+                    first = False
+                else:
+                    gap.observe(now - last)
+                last = now
+                yield content
+        except asyncio.CancelledError:
+            if first:
+                provider.stats.record_ttft(time.monotonic() - start)
+            raise
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                provider.pacer.penalize(_headers(e))
+            provider.stats.record_failure()
+            raise
+        finally:
+            if resp is not None:
+                await resp.close()
+            else:
+                provider.pacer.settle()
+        if first:
+            provider.stats.record_ttft(time.monotonic() - start)
+
+    async def astream(self, request_for, served=None):
+        """Async twin of stream(), using each provider's async client."""
+        ranked = [p for p in self.ranked(probe=True) if p.async_client is not None]
+        if self.hedge and len(ranked) > 1:
+            async for content in self._ahedged(ranked, request_for, served):
+                yield content
+            return
+
+        for i, provider in enumerate(ranked):
+            request = request_for(provider)
+            if served is not None:
+                served.update(provider=provider.name, model=request["model"])
+            started = False
+            try:
+                async for content in self._astream_one(provider, request, retries=i == len(ranked) - 1):
+                    started = True
+                    yield content
+                return
+            except Exception as e:
+                if started or i == len(ranked) - 1:
+                    raise
+                log.warning("Provider %s failed before its first token (%s); failing over.", provider.name, e)
+                self._count("failovers")
+
+    async def _ahedged(self, ranked, request_for, served):
+        results = asyncio.Queue()
+        tasks = {}
+        candidates = iter(ranked)
+
+        async def run(provider, request, retries):
+            try:
+                async for content in self._astream_one(provider, request, retries):
+                    await results.put((provider, content))
+                await results.put((provider, _DONE))
+            except Exception as e:
+                await results.put((provider, e))
+
+        def launch():
+            provider = next(candidates, None)
+            if provider is None:
+                return None
+            request = request_for(provider)
+            task = asyncio.create_task(run(provider, request, provider is ranked[-1]))
+            tasks[provider.name] = (task, request["model"])
+            return provider
+
+        primary = launch()
+        deadline = time.monotonic() + self.hedge_delay(primary)
+        winner, running, hedged = None, 1, False
+        try:
+            while True:
+                timeout = None
+                if winner is None and not hedged:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    provider, item = await asyncio.wait_for(results.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedged = True
+                    if launch() is not None:
+                        running += 1
+                        self._count("hedges")
+                    continue
+
+                if winner is None:
+                    if isinstance(item, Exception):
+                        running -= 1
+                        if running == 0:
+                            if launch() is None:
+                                raise item
+                            running += 1
+                            self._count("failovers")
+                        continue
+                    winner = provider
+                    if winner is not primary:
+                        self._count("hedge_wins")
+                    if served is not None:
+                        served.update(provider=winner.name, model=tasks[winner.name][1])
+                    for name, (task, _) in tasks.items():
+                        if name != winner.name:
+                            task.cancel()
+                if provider is not winner:
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task, _ in tasks.values():
+                task.cancel()
+
+    async def aclose(self):
+        for provider in self.providers:
+            if provider._async_client is not None:
+                await provider._async_client.close()
+
+    def stats(self):
+        with self._lock:
+            counters = {"failovers": self.failovers, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                        "probes": self.probes}
+        providers = {p.name: dict(p.stats.snapshot(), pacing=p.pacer.snapshot()) for p in self.providers}
+        return dict(counters, hedge=self.hedge, providers=providers)
+
+    @classmethod
+    def from_env(cls, primary, make_client, default_model, configured=lambda name: True):
+        """Builds the pool from PROVIDERS (primary first if listed) using app.make_client.
+
+        Providers for which configured(name) is false (e.g. no API key) are
+        left out; the others' clients are only built when first used.
+        """
+        names = [n.strip().lower() for n in os.getenv("PROVIDERS", primary).split(",") if n.strip()]
+        window = float(os.getenv("PROVIDER_STATS_WINDOW", 300))
+        cooldown = float(os.getenv("PROVIDER_COOLDOWN", 30))
+        probe_interval = float(os.getenv("PROVIDER_PROBE_INTERVAL", 30))
+        max_wait = float(os.getenv("PROVIDER_PACE_MAX_WAIT", 5))
+        providers = []
+        for name in dict.fromkeys(names):
+            if not configured(name):
+                continue
+            providers.append(Provider(
+                name, None, default_model(name),
+                make_client=lambda name=name: make_client(provider=name),
+                make_async=lambda name=name: make_client(asynchronous=True, provider=name),
+                primary=name == primary,
+                stats=ProviderStats(window=window, cooldown=cooldown, probe_interval=probe_interval),
+                pacer=RateLimitPacer(max_wait=max_wait),
+            ))
+        return cls(
+            providers,
+            hedge=os.getenv("PROVIDER_HEDGE", "false").lower() == "true",
+            hedge_quantile=float(os.getenv("PROVIDER_HEDGE_QUANTILE", 0.95)),
+            hedge_delay=float(os.getenv("PROVIDER_HEDGE_DELAY", 2.0)),
+            hedge_max_factor=float(os.getenv("PROVIDER_HEDGE_MAX_FACTOR", 3.0)),
+        )
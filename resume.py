@@ -0,0 +1,525 @@
+"""Resumable chat streams: SSE ids, Last-Event-ID and a bounded replay buffer.
+
+When a phone drops its connection halfway through a long answer, the
+answer should not be lost and paid for again. With RESUMABLE_STREAMS every
+/api/chat frame carries an SSE id, "<stream id>:<n>", and the response is
+generated by its own thread (a task under ASGI) into a recording; the
+request only follows the recording. A client that reconnects with
+POST /api/chat and a Last-Event-ID header gets the frames after that id
+and then the live ones, without a new upstream call, whether the answer
+has finished or is still being generated.
+
+A recording keeps at most RESUME_MAX_BYTES of frames, dropping the oldest,
+and is kept RESUME_TTL seconds after it finishes. Once nobody is reading a
+stream it keeps generating for RESUME_GRACE seconds, then it is stopped
+as "disconnected" (see cancellation.py); the stop endpoint stops it at
+once. A reconnect for a position the recording no longer has, or for an
+unknown stream, is answered 404 and the client resends its request.
+A new stream cannot take the id of a recording that can still be resumed
+(the client chooses stream ids): it gets a fresh id, in X-Stream-Id.
+
+With RESUME_DB the workers of a host share recordings through a SQLite
+file: the producing worker publishes frames every RESUME_POLL seconds, so
+a reconnect that lands on another worker follows the recording from there.
+
+Configured from the environment (see ResumableStreams.from_env):
+    RESUMABLE_STREAMS  "true" to enable (default off)
+    RESUME_TTL         seconds a finished recording can still be resumed (default 60)
+    RESUME_MAX_BYTES   frame bytes kept per recording (default 1 MiB)
+    RESUME_GRACE       seconds an unread stream keeps generating (default 15)
+    RESUME_DB          path of the SQLite store shared by the workers (default none)
+    RESUME_POLL        seconds between store publishes and polls (default 0.05)
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from cancellation import STREAM_ID
+from metrics import registry
+from sse import frame
+
+log = logging.getLogger(__name__)
+
+RESUMED_STREAMS = registry.counter(
+    "gravitas_resumed_streams_total",
+    "Reconnects with Last-Event-ID, by result: local (recording in this worker), shared (followed from "
+    "the store) or missing (not resumable, answered 404).", ["result"])
+
+BEHIND = frame("[Error] This connection fell too far behind the answer. Please try again.")
+
+
+class Gone(Exception):
+    """A reader asked for frames the recording has already dropped."""
+
+
+def tag(data: bytes, event_id: str) -> bytes:
+    """Adds an id field to an encoded frame (several frames: the last one)."""
+    return data[:-1] + f"id: {event_id}\n\n".encode()
+
+
+def parse_event_id(last_event_id):
+    """(stream id, frames already received) from a Last-Event-ID, or None."""
+    stream_id, _, seq = (last_event_id or "").strip().rpartition(":")
+    if not STREAM_ID.match(stream_id) or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class Recording:
+    """The frames of one response, readable from any position still kept."""
+
+    WAIT = 0.25  # seconds between checks of a reader waiting for a frame
+
+    def __init__(self, stream_id, max_bytes):
+        self.id = stream_id
+        self.max_bytes = max_bytes
+        self.frames = deque()
+        self.base = 0  # frames dropped from the front; frames[0] is number base + 1
+        self.total = 0
+        self.bytes = 0
+        self.done = False
+        self.finished_at = None
+        self.readers = 0
+        self.on_idle = None  # called when the last reader leaves an unfinished recording
+        self._cond = threading.Condition()
+        self._wakeups = set()  # (loop, asyncio.Event) of async readers
+
+    def append(self, data: bytes) -> bytes:
+        """Records a frame, returning it with its id."""
+        with self._cond:
+            self.total += 1
+            data = tag(data, f"{self.id}:{self.total}")
+            self.frames.append(data)
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and len(self.frames) > 1:
+                self.bytes -= len(self.frames.popleft())
+                self.base += 1
+            self._notify()
+        return data
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, wake in list(self._wakeups):
+            loop.call_soon_threadsafe(wake.set)
+
+    def join(self):
+        with self._cond:
+            self.readers += 1
+
+    def leave(self):
+        with self._cond:
+            self.readers -= 1
+            idle = not self.readers and not self.done
+        if idle and self.on_idle is not None:
+            self.on_idle()
+
+    def has(self, after) -> bool:
+        """Whether the frames after number `after` can still be replayed."""
+        with self._cond:
+            return self.base <= after <= self.total
+
+    def _take(self, after):
+        """(frames after number `after`, finished); call with the lock held."""
+        if after < self.base:
+            raise Gone()
+        batch = list(self.frames)[after - self.base:] if after < self.total else []
+        return batch, self.done and not batch
+
+    def follow(self, after=0):
+        """Yields the frames after number `after`: the recorded ones, then live ones."""
+        while True:
+            with self._cond:
+                while after == self.total and not self.done:
+                    self._cond.wait(self.WAIT)
+                batch, finished = self._take(after)
+            if finished:
+                return
+            after += len(batch)
+            yield from batch
+
+    async def afollow(self, after=0):
+        """Async twin of follow()."""
+        wake = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            self._wakeups.add(wake)
+        try:
+            while True:
+                with self._cond:
+                    batch, finished = self._take(after)
+                    if not batch:
+                        wake[1].clear()
+                if finished:
+                    return
+                if not batch:
+                    await wake[1].wait()
+                after += len(batch)
+                for data in batch:
+                    yield data
+        finally:
+            with self._cond:
+                self._wakeups.discard(wake)
+
+
+class SQLiteRecordings:
+    """Recordings shared by the workers of a host through a SQLite file (one connection per thread)."""
+
+    STALE = 30.0  # an unfinished recording not updated for this long is taken to be dead
+    PURGE_EVERY = 64
+
+    def __init__(self, path: str, ttl=60.0, poll=0.05):
+        self.path = path
+        self.ttl = ttl
+        self.poll = poll
+        self._local = threading.local()
+        self._starts = 0
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recordings ("
+                "id TEXT PRIMARY KEY, done INTEGER NOT NULL DEFAULT 0, base INTEGER NOT NULL DEFAULT 0, "
+                "total INTEGER NOT NULL DEFAULT 0, readers INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recording_frames ("
+                "id TEXT NOT NULL, seq INTEGER NOT NULL, frame BLOB NOT NULL, PRIMARY KEY (id, seq))"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")  # transient frames: no fsync per publish
+            self._local.conn = conn
+        return conn
+
+    def start(self, stream_id) -> bool:
+        """Registers a new recording; False if one with the same id is still kept (by any worker)."""
+        conn = self._connect()
+        now = time.time()
+        expired = "updated < ? AND (done = 1 OR updated < ?)"
+        args = (now - self.ttl, now - self.STALE)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._starts += 1
+            if self._starts % self.PURGE_EVERY == 0:
+                conn.execute(f"DELETE FROM recording_frames WHERE id IN (SELECT id FROM recordings WHERE {expired})",
+                             args)
+                conn.execute(f"DELETE FROM recordings WHERE {expired}", args)
+            elif conn.execute(f"DELETE FROM recordings WHERE id = ? AND {expired}", (stream_id, *args)).rowcount:
+                conn.execute("DELETE FROM recording_frames WHERE id = ?", (stream_id,))
+            started = conn.execute("INSERT OR IGNORE INTO recordings (id, updated) VALUES (?, ?)",
+                                   (stream_id, now)).rowcount == 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return started
+
+    def publish(self, stream_id, first, frames, base, done=False):
+        """Stores frames numbered from `first`, dropping those up to `base`."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO recording_frames (id, seq, frame) VALUES (?, ?, ?)",
+                             [(stream_id, first + i, data) for i, data in enumerate(frames)])
+            conn.execute("DELETE FROM recording_frames WHERE id = ? AND seq <= ?", (stream_id, base))
+            conn.execute("UPDATE recordings SET done = ?, base = ?, total = ?, updated = ? WHERE id = ?",
+                         (int(done), base, first + len(frames) - 1, time.time(), stream_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def state(self, stream_id):
+        """(done, base, total, updated) of a recording, or None."""
+        return self._connect().execute("SELECT done, base, total, updated FROM recordings WHERE id = ?",
+                                       (stream_id,)).fetchone()
+
+    def read(self, stream_id, after):
+        """(frames after number `after` as (seq, frame), recording state) read consistently."""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            rows = conn.execute("SELECT seq, frame FROM recording_frames WHERE id = ? AND seq > ? ORDER BY seq",
+                                (stream_id, after)).fetchall()
+            state = conn.execute("SELECT done, base, total, updated FROM recordings WHERE id = ?",
+                                 (stream_id,)).fetchone()
+        finally:
+            conn.execute("COMMIT")
+        return rows, state
+
+    def join(self, stream_id):
+        self._connect().execute("UPDATE recordings SET readers = readers + 1 WHERE id = ?", (stream_id,))
+
+    def leave(self, stream_id):
+        self._connect().execute("UPDATE recordings SET readers = readers - 1 WHERE id = ?", (stream_id,))
+
+    def readers(self, stream_id) -> int:
+        row = self._connect().execute("SELECT readers FROM recordings WHERE id = ?", (stream_id,)).fetchone()
+        return row[0] if row else 0
+
+
+class ResumableStreams:
+    """The recordings of this worker by stream id (see module docstring)."""
+
+    def __init__(self, ttl=60.0, max_bytes=1024 * 1024, grace=15.0, store=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.store = store
+        self._recordings = {}
+        self._lock = threading.Lock()
+        self.counts = {"local": 0, "shared": 0, "missing": 0}
+        self.abandoned = 0
+
+    def claim(self, stream_id) -> bool:
+        """Reserves `stream_id` for a new recording: False if a recording with that
+        id can still be resumed, here or (with a store) from another worker."""
+        now = time.monotonic()
+        with self._lock:
+            old = self._recordings.get(stream_id)
+            if old is not None and not (old.done and now - old.finished_at > self.ttl):
+                return False
+        return self.store is None or self.store.start(stream_id)
+
+    async def aclaim(self, stream_id) -> bool:
+        """Async twin of claim()."""
+        if self.store is None:
+            return self.claim(stream_id)
+        return await asyncio.to_thread(self.claim, stream_id)
+
+    def _open(self, stop):
+        """A new recording for the stream of `stop`, which is stopped once unread for `grace`."""
+        recording = Recording(stop.id, self.max_bytes)
+        recording.on_idle = lambda: self._idle(recording, stop)
+        now = time.monotonic()
+        with self._lock:
+            for stream_id, old in list(self._recordings.items()):
+                if old.done and now - old.finished_at > self.ttl:
+                    del self._recordings[stream_id]
+            self._recordings[stop.id] = recording
+        return recording
+
+    def _idle(self, recording, stop):
+        def check():
+            if recording.readers or recording.done or stop.is_set():
+                return
+            if self.store is not None and self.store.readers(recording.id) > 0:
+                self._idle(recording, stop)  # followed from another worker: check again later
+                return
+            with self._lock:
+                self.abandoned += 1
+            stop.set("disconnected")
+
+        timer = threading.Timer(self.grace, check)
+        timer.daemon = True
+        timer.start()
+
+    def _count(self, result):
+        with self._lock:
+            self.counts[result] += 1
+        RESUMED_STREAMS.labels(result).inc()
+
+    # ----- Sync (Flask) -----
+    def start(self, stop, frames, on_done=None):
+        """Generates `frames` into a new recording in a thread of its own.
+
+        `stop.id` must have been claimed (see claim()). Returns the request's
+        own reader; on_done() runs when generation ends.
+        """
+        recording = self._open(stop)
+        recording.join()
+        threading.Thread(target=self._produce, args=(recording, frames, on_done), name="resumable-stream",
+                         daemon=True).start()
+        return self._read(recording, 0)
+
+    def _produce(self, recording, frames, on_done):
+        published, last = 0, time.monotonic()
+        try:
+            for data in frames:
+                recording.append(data)
+                if self.store is not None and time.monotonic() - last >= self.store.poll:
+                    published, last = self._publish(recording, published), time.monotonic()
+        except Exception:
+            log.exception("Resumable stream %s failed", recording.id)
+        finally:
+            recording.finish()
+            try:
+                if self.store is not None:
+                    self._publish(recording, published, done=True)
+            finally:
+                if on_done is not None:
+                    on_done()
+
+    def _publish(self, recording, published, done=False):
+        """Stores the frames recorded since the last publish; returns the new count."""
+        with recording._cond:
+            first = max(published, recording.base) + 1
+            batch = list(recording.frames)[first - recording.base - 1:]
+            base = recording.base
+        self.store.publish(recording.id, first, batch, base, done)
+        return first + len(batch) - 1
+
+    def _read(self, recording, after):
+        """The frames of a recording for one request: ends with an error frame if it falls behind."""
+        try:
+            yield from recording.follow(after)
+        except Gone:
+            yield BEHIND
+        finally:
+            recording.leave()
+
+    def resume(self, last_event_id):
+        """The frames after `last_event_id` for a reconnect, or None if they cannot be replayed."""
+        position = parse_event_id(last_event_id)
+        if position is not None:
+            stream_id, after = position
+            with self._lock:
+                recording = self._recordings.get(stream_id)
+            if recording is not None and recording.has(after):
+                recording.join()
+                self._count("local")
+                return self._read(recording, after)
+            if recording is None and self.store is not None and self._stored(stream_id, after):
+                self.store.join(stream_id)
+                self._count("shared")
+                return self._follow(stream_id, after)
+        self._count("missing")
+        return None
+
+    def _stored(self, stream_id, after):
+        state = self.store.state(stream_id)
+        if state is None:
+            return False
+        done, base, total, updated = state
+        fresh = time.time() - updated < (self.ttl if done else self.store.STALE)
+        return fresh and base <= after <= total
+
+    def _follow(self, stream_id, after):
+        """Yields a recording another worker is publishing to the store."""
+        store = self.store
+        try:
+            while True:
+                rows, state = store.read(stream_id, after)
+                if state is None or state[1] > after:
+                    yield BEHIND
+                    return
+                for after, data in rows:
+                    yield data
+                if state[0] and not rows:
+                    return
+                if time.time() - state[3] > store.STALE:
+                    yield frame("[Error] The server generating this answer stopped responding.")
+                    return
+                if not rows:
+                    time.sleep(store.poll)
+        finally:
+            store.leave(stream_id)
+
+    # ----- Async (ASGI) -----
+    async def astart(self, stop, frames):
+        """Async twin of start(): returns (the request's reader, the producer coroutine),
+        which the caller runs as a task with its own cancellation."""
+        recording = self._open(stop)
+        recording.join()
+        return self._aread(recording, 0), self._aproduce(recording, frames)
+
+    async def _aproduce(self, recording, frames):
+        published, last = 0, time.monotonic()
+        try:
+            async for data in frames:
+                recording.append(data)
+                if self.store is not None and time.monotonic() - last >= self.store.poll:
+                    published = await asyncio.to_thread(self._publish, recording, published)
+                    last = time.monotonic()
+        finally:
+            recording.finish()
+            if self.store is not None:
+                await asyncio.shield(asyncio.to_thread(self._publish, recording, published, True))
+
+    async def _aread(self, recording, after):
+        try:
+            async for data in recording.afollow(after):
+                yield data
+        except Gone:
+            yield BEHIND
+        finally:
+            recording.leave()
+
+    async def aresume(self, last_event_id):
+        """Async twin of resume()."""
+        position = parse_event_id(last_event_id)
+        if position is not None:
+            stream_id, after = position
+            with self._lock:
+                recording = self._recordings.get(stream_id)
+            if recording is not None and recording.has(after):
+                recording.join()
+                self._count("local")
+                return self._aread(recording, after)
+            if recording is None and self.store is not None and \
+                    await asyncio.to_thread(self._stored, stream_id, after):
+                await asyncio.to_thread(self.store.join, stream_id)
+                self._count("shared")
+                return self._afollow(stream_id, after)
+        self._count("missing")
+        return None
+
+    async def _afollow(self, stream_id, after):
+        store = self.store
+        try:
+            while True:
+                rows, state = await asyncio.to_thread(store.read, stream_id, after)
+                if state is None or state[1] > after:
+                    yield BEHIND
+                    return
+                for after, data in rows:
+                    yield data
+                if state[0] and not rows:
+                    return
+                if time.time() - state[3] > store.STALE:
+                    yield frame("[Error] The server generating this answer stopped responding.")
+                    return
+                if not rows:
+                    await asyncio.sleep(store.poll)
+        finally:
+            await asyncio.shield(asyncio.to_thread(store.leave, stream_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "recordings": len(self._recordings),
+                "generating": sum(not r.done for r in self._recordings.values()),
+                "resumed": dict(self.counts),
+                "abandoned": self.abandoned,
+                "ttl": self.ttl,
+                "max_bytes": self.max_bytes,
+                "shared_store": self.store.path if self.store is not None else None,
+            }
+
+    @classmethod
+    def from_env(cls):
+        """Builds the registry from RESUME_* variables, or returns None if disabled."""
+        if os.getenv("RESUMABLE_STREAMS", "false").lower() != "true":
+            return None
+        ttl = float(os.getenv("RESUME_TTL", 60))
+        db_path = os.getenv("RESUME_DB")
+        return cls(
+            ttl=ttl,
+            max_bytes=int(os.getenv("RESUME_MAX_BYTES", 1024 * 1024)),
+            grace=float(os.getenv("RESUME_GRACE", 15)),
+            store=SQLiteRecordings(db_path, ttl, float(os.getenv("RESUME_POLL", 0.05))) if db_path else None,
+        )
@@ -0,0 +1,104 @@
+"""Keyword router used by app.detect_agent (and the cascade's detail terms).
+
+Every keyword is expanded once, at import, into the words it matches: the
+keyword itself plus its inflections from an explicit suffix list. A scan
+then splits the message into words once (str.translate and str.split,
+which run at several times the speed of a regex tokenizer) and intersects
+them with that vocabulary, instead of one substring scan per keyword.
+Keywords of more than one word ("body language", "self-aware") are looked
+for only when their first word is present.
+
+Matching rules:
+  * keywords match whole words, so "eq" does not fire on "request",
+    "inner" not on "dinner" and "moral" not on "morale";
+  * keywords of up to SHORT_KEYWORD characters ("eq", "ceo") match only
+    themselves and their plural ("ceos");
+  * longer ones also match the keyword (the last word of a phrase) plus
+    one of SUFFIXES: "leaders", "leadership", "emotional", "compassionate".
+    Before a suffix in E_DROP_SUFFIXES a final "e" is dropped ("managing",
+    "manager", "sensitivity"; so "care" does not match "career"), and
+    before one starting with "e" a final "y" becomes "i" ("strategies").
+"""
+import re
+
+SHORT_KEYWORD = 3
+SUFFIXES = (
+    "s", "es", "ed", "ing", "er", "ers", "or", "ors", "al", "ally", "ly", "ful", "fully", "ment", "ments",
+    "ship", "ships", "ive", "ity", "ness", "ary", "ate", "ation", "ations",
+)
+E_DROP_SUFFIXES = frozenset(("ed", "ing", "er", "ers", "ity", "ive", "ation", "ations"))
+WORD = re.compile(r"\w+")
+# Characters that separate words: ASCII and Latin-1 punctuation, and the
+# Unicode general and CJK punctuation blocks (curly quotes, dashes ...).
+SEPARATORS = {
+    cp: " " for block in (range(0x80), range(0xA0, 0xC0), range(0x2000, 0x2070), range(0x3000, 0x3040))
+    for cp in block if not (chr(cp).isalnum() or chr(cp) == "_" or chr(cp).isspace())
+}
+
+
+def forms(keyword):
+    """The words (or phrases) a keyword matches under the rules above."""
+    if len(keyword) <= SHORT_KEYWORD:
+        return {keyword, keyword + "s"}
+    found = {keyword}
+    for suffix in SUFFIXES:
+        if keyword.endswith("e") and suffix in E_DROP_SUFFIXES:
+            found.add(keyword[:-1] + suffix)
+        elif keyword.endswith("y") and suffix.startswith("e"):
+            found.add(keyword[:-1] + "i" + suffix)
+        else:
+            found.add(keyword + suffix)
+    return found
+
+
+class KeywordRouter:
+    """Compiled keyword table mapping each group (agent) to its keywords.
+
+    scan() reads the text once and returns, for every group, the keywords
+    it matched.
+    """
+
+    def __init__(self, groups):
+        self.groups = {name: tuple(words) for name, words in groups.items()}
+        owners = {}
+        for name, words in self.groups.items():
+            for word in words:
+                owners.setdefault(word.lower(), []).append(name)
+
+        # word -> ((group, keyword), ...) for single-word keywords
+        self._words = {}
+        # first word -> compiled pattern of its phrases' forms, and phrase form -> hits
+        phrases = {}
+        self._phrase_hits = {}
+        for keyword, names in owners.items():
+            for form in forms(keyword):
+                hits = tuple((name, keyword) for name in names)
+                if WORD.fullmatch(form):
+                    self._words[form] = self._words.get(form, ()) + hits
+                else:
+                    phrases.setdefault(WORD.match(form).group(), set()).add(form)
+                    self._phrase_hits[form] = self._phrase_hits.get(form, ()) + hits
+        self._phrases = {
+            first: re.compile(r"\b(?:" + "|".join(re.escape(f) for f in sorted(found, key=len, reverse=True)) + r")\b")
+            for first, found in phrases.items()
+        }
+        self._vocabulary = frozenset(self._words) | frozenset(self._phrases)
+
+    def scan(self, text: str):
+        """Returns {group: [matched keywords]} for all groups with at least one hit.
+
+        `text` is expected to be lower-cased already.
+        """
+        present = self._vocabulary.intersection(text.translate(SEPARATORS).split())
+        if not present:
+            return {}
+        hits = {}
+        for word in present:
+            for name, keyword in self._words.get(word, ()):
+                hits.setdefault(name, []).append(keyword)
+            pattern = self._phrases.get(word)
+            if pattern is not None:
+                for form in set(pattern.findall(text)):
+                    for name, keyword in self._phrase_hits[form]:
+                        hits.setdefault(name, []).append(keyword)
+        return hits
@@ -0,0 +1,362 @@
+"""Semantic near-duplicate cache for first-turn questions.
+
+Exact-match caching (cache.py) misses rephrasings of the same opening
+question. This layer embeds the first user message, looks up the nearest
+stored question in a NumPy index partitioned per agent and model, and
+serves the stored answer when the cosine similarity clears a threshold.
+
+Embeddings come from a CPU-only hashing vectorizer (word unigrams plus
+character trigrams, signed feature hashing, L2-normalised). Before hashing,
+each content word is folded to a canonical form: plurals are singularised
+and the words in one SYNONYMS group ("appear", "project", "seem" ...) map
+to the group's first word. Reordered questions, changes of case,
+punctuation or filler words, and paraphrases within the lexicon ("how to
+project authority" vs "how can I appear more authoritative") score close
+to 1; questions about different things do not ("improve my executive
+presence" vs "improve my public speaking", 0.33). The lexicon covers the
+vocabulary of the agents' questions, not English: a paraphrase outside it
+is a miss, never a wrong answer. The default threshold is 0.95. For open
+vocabulary, SEMANTIC_CACHE_MODEL names a sentence-transformers model (if
+the package is installed), with a default threshold of 0.85, at the cost
+of a heavier import.
+
+Whatever the embedder, a stored answer is never served for a question
+that differs from the stored one in negation ("not", "never", "n't" ...)
+or in the numbers it mentions ("10 people" vs "1000 people"): similarity
+is blind to exactly the words that reverse or rescale a question. The
+next-nearest stored question above the threshold is tried instead.
+
+Each partition is a contiguous float32 matrix, so a lookup is one
+matrix-vector product. Memory is bounded by max_entries rows per
+partition; when a partition is full, the least recently used row is
+overwritten. The index can be snapshotted to a .npz file for a fast
+warm start.
+
+Configured from the environment (see from_env):
+    SEMANTIC_CACHE              "true" to enable (default off)
+    SEMANTIC_CACHE_THRESHOLD    minimum cosine similarity for a hit (default 0.95 with the
+                                hashing vectorizer, 0.85 with SEMANTIC_CACHE_MODEL)
+    SEMANTIC_CACHE_MAX_ENTRIES  rows per agent/model partition (default 10000)
+    SEMANTIC_CACHE_DIM          hashing vectorizer dimensions (default 256)
+    SEMANTIC_CACHE_SNAPSHOT     .npz path loaded at start and saved on exit
+    SEMANTIC_CACHE_MODEL        optional sentence-transformers model name
+"""
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+STOPWORDS = frozenset(
+    "a an the how do does did i to can could my me you your what is are be more of in on "
+    "for with and or as at it that this should would will about way ways tips".split()
+)
+# Words used interchangeably in the agents' questions; the first word of a group is canonical.
+SYNONYMS = (
+    "appear project seem convey exude radiate",
+    "authority authoritative authoritatively gravitas",
+    "confident confidence confidently assured",
+    "calm composed composure poise poised unflappable",
+    "nervous anxious anxiety nerves nervousness jittery",
+    "improve boost strengthen enhance",
+    "boss manager supervisor",
+    "fire dismiss terminate sack",
+    "hire recruit",
+    "quit resign",
+    "salary pay compensation",
+    "negotiate negotiation negotiating bargain",
+    "presentation pitch keynote",
+    "feedback criticism critique",
+)
+CANONICAL = {word: group.split()[0] for group in SYNONYMS for word in group.split()}
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+NEGATIONS = frozenset("not no never without nor neither none nobody nothing nowhere cannot".split())
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+HASHING_THRESHOLD = 0.95
+MODEL_THRESHOLD = 0.85
+CANDIDATES = 5  # stored questions above the threshold checked by the guard, nearest first
+
+
+def polarity(text: str):
+    """What similarity cannot be trusted with: the negations and the numbers in a question."""
+    text = text.lower().replace("n't", " not").replace("n’t", " not")
+    negations = sum(word in NEGATIONS for word in TOKEN_RE.findall(text))
+    numbers = sorted(n.replace(",", "") for n in NUMBER_RE.findall(text))
+    return negations % 2, numbers
+
+
+def canonical(word: str) -> str:
+    """Folds a lower-case word to its SYNONYMS group, or to its singular."""
+    if word in CANONICAL:
+        return CANONICAL[word]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+    return CANONICAL.get(word, word)
+
+
+def compatible(question: str, stored: str) -> bool:
+    """False if the stored question's answer may be the wrong one despite the
+    similarity: one of them is negated and the other is not, or they mention
+    different numbers."""
+    return polarity(question) == polarity(stored)
+
+
+class HashingEmbedder:
+    """Stateless feature-hashing text embedder (stable across processes)."""
+
+    def __init__(self, dim=256, ngram=3, word_weight=1.0, gram_weight=0.5):
+        self.dim = dim
+        self.ngram = ngram
+        self.word_weight = word_weight
+        self.gram_weight = gram_weight
+        self.name = f"hashing-v2-{dim}"  # v2: canonical words; older snapshots are ignored
+
+    def embed(self, text: str) -> np.ndarray:
+        features, weights = [], []
+        for word in TOKEN_RE.findall(text.lower()):
+            if word in STOPWORDS:
+                continue
+            word = canonical(word)
+            features.append("w:" + word)
+            weights.append(self.word_weight)
+            padded = f"<{word}>"
+            for i in range(len(padded) - self.ngram + 1):
+                features.append(padded[i:i + self.ngram])
+                weights.append(self.gram_weight)
+        if not features:
+            return np.zeros(self.dim, dtype=np.float32)
+        hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+        signs = np.where(hashes >> 31, -1.0, 1.0) * np.asarray(weights)
+        vec = np.bincount((hashes % self.dim).astype(np.intp), weights=signs, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+class SentenceTransformerEmbedder:
+    """Wraps a local sentence-transformers model (optional dependency)."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+
+class _Partition:
+    """Bounded vector index with LRU replacement.
+
+    Rows are allocated geometrically up to `capacity`, so rarely used
+    agents do not pay for a full matrix.
+    """
+
+    INITIAL_ROWS = 64
+
+    def __init__(self, capacity, dim, rows=None):
+        self.capacity = capacity
+        rows = min(capacity, max(rows or 0, self.INITIAL_ROWS))
+        self.vectors = np.zeros((rows, dim), dtype=np.float32)
+        self.last_used = np.zeros(rows, dtype=np.int64)
+        self.questions = []
+        self.answers = []
+        self.size = 0
+
+    def _grow(self):
+        rows = min(self.capacity, len(self.vectors) * 2)
+        vectors = np.zeros((rows, self.vectors.shape[1]), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        last_used = np.zeros(rows, dtype=np.int64)
+        last_used[:self.size] = self.last_used[:self.size]
+        self.vectors, self.last_used = vectors, last_used
+
+    def search(self, vec, threshold, limit=CANDIDATES):
+        """Rows scoring at least threshold, nearest first (at most limit)."""
+        if self.size == 0:
+            return []
+        scores = self.vectors[:self.size] @ vec
+        if limit < self.size:
+            top = np.argpartition(scores, -limit)[-limit:]
+        else:
+            top = np.arange(self.size)
+        top = top[scores[top] >= threshold]
+        return [int(row) for row in top[np.argsort(-scores[top])]]
+
+    def insert(self, vec, question, answer, tick):
+        if self.size < self.capacity:
+            if self.size == len(self.vectors):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.questions.append(question)
+            self.answers.append(answer)
+            evicted = False
+        else:
+            row = int(np.argmin(self.last_used))
+            self.questions[row] = question
+            self.answers[row] = answer
+            evicted = True
+        self.vectors[row] = vec
+        self.last_used[row] = tick
+        return evicted
+
+
+class SemanticCache:
+    """Thread-safe semantic cache partitioned by (agent, model)."""
+
+    SNAPSHOT_EVERY = 500  # stores between background snapshots
+
+    def __init__(self, embedder=None, threshold=None, max_entries=10000, snapshot_path=None):
+        self.embedder = embedder or HashingEmbedder()
+        if threshold is None:
+            threshold = HASHING_THRESHOLD if isinstance(self.embedder, HashingEmbedder) else MODEL_THRESHOLD
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.snapshot_path = snapshot_path
+        self._partitions = {}
+        self._lock = threading.Lock()
+        self._tick = 0
+        self._stores = 0
+        self.hits = 0
+        self.misses = 0
+        self.guarded = 0  # near-duplicates not served for a negation or number mismatch
+        self.evictions = 0
+
+    @staticmethod
+    def partition_key(agent: str, model: str) -> str:
+        return f"{agent}|{model}"
+
+    def lookup(self, agent: str, model: str, question: str):
+        """Returns the cached answer for a near-duplicate question, or None."""
+        vec = self.embedder.embed(question)
+        with self._lock:
+            part = self._partitions.get(self.partition_key(agent, model))
+            rows = part.search(vec, self.threshold) if part is not None else []
+            row = next((row for row in rows if compatible(question, part.questions[row])), None)
+            if row is None:
+                self.guarded += bool(rows)
+                self.misses += 1
+                return None
+            self._tick += 1
+            part.last_used[row] = self._tick
+            self.hits += 1
+            return part.answers[row]
+
+    def store(self, agent: str, model: str, question: str, answer: str):
+        vec = self.embedder.embed(question)
+        if not vec.any():
+            return
+        with self._lock:
+            key = self.partition_key(agent, model)
+            part = self._partitions.get(key)
+            if part is None:
+                part = self._partitions[key] = _Partition(self.max_entries, len(vec))
+            self._tick += 1
+            if part.insert(vec, question, answer, self._tick):
+                self.evictions += 1
+            self._stores += 1
+            snapshot_due = self.snapshot_path and self._stores % self.SNAPSHOT_EVERY == 0
+        if snapshot_due:
+            threading.Thread(target=self.save, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "guarded": self.guarded,
+                "evictions": self.evictions,
+                "entries": sum(p.size for p in self._partitions.values()),
+                "partitions": len(self._partitions),
+                "threshold": self.threshold,
+                "embedder": self.embedder.name,
+            }
+
+    # ----- Snapshots -----
+    def save(self, path=None):
+        """Writes all partitions to a .npz file (atomically replaced)."""
+        path = path or self.snapshot_path
+        if not path:
+            return
+        with self._lock:
+            arrays = {}
+            meta = {"embedder": self.embedder.name, "partitions": {}}
+            for i, (key, part) in enumerate(self._partitions.items()):
+                arrays[f"v{i}"] = part.vectors[:part.size].copy()
+                meta["partitions"][key] = {
+                    "index": i,
+                    "questions": list(part.questions),
+                    "answers": list(part.answers),
+                }
+        arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    def save_on_exit(self):
+        """Saves unless nothing was stored in this process: a gunicorn --preload
+        master must not overwrite its workers' snapshot with the one it loaded."""
+        if self._stores:
+            self.save()
+
+    def load(self, path=None):
+        """Loads a snapshot written by save(); ignores snapshots from another embedder."""
+        path = path or self.snapshot_path
+        if not path or not os.path.exists(path):
+            return 0
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            if meta.get("embedder") != self.embedder.name:
+                log.warning("Semantic cache snapshot %s was built with %s; ignoring it.", path, meta.get("embedder"))
+                return 0
+            loaded = 0
+            with self._lock:
+                for key, info in meta["partitions"].items():
+                    vectors = data[f"v{info['index']}"][-self.max_entries:]
+                    if vectors.shape[1] != self.embedder.dim:
+                        continue
+                    part = _Partition(self.max_entries, vectors.shape[1], rows=len(vectors))
+                    part.size = len(vectors)
+                    part.vectors[:part.size] = vectors
+                    part.questions = info["questions"][-self.max_entries:]
+                    part.answers = info["answers"][-self.max_entries:]
+                    part.last_used[:part.size] = np.arange(part.size)
+                    self._partitions[key] = part
+                    loaded += part.size
+                self._tick = max((p.size for p in self._partitions.values()), default=0)
+        return loaded
+
+    @classmethod
+    def from_env(cls):
+        """Builds the cache from SEMANTIC_CACHE_* variables, or returns None if disabled."""
+        if os.getenv("SEMANTIC_CACHE", "false").lower() != "true":
+            return None
+        model_name = os.getenv("SEMANTIC_CACHE_MODEL")
+        embedder = None
+        if model_name:
+            try:
+                embedder = SentenceTransformerEmbedder(model_name)
+            except ImportError:
+                log.warning("sentence-transformers not installed; using the hashing vectorizer.")
+        if embedder is None:
+            embedder = HashingEmbedder(dim=int(os.getenv("SEMANTIC_CACHE_DIM", 256)))
+        threshold = os.getenv("SEMANTIC_CACHE_THRESHOLD")
+        cache = cls(
+            embedder=embedder,
+            threshold=float(threshold) if threshold else None,
+            max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 10000)),
+            snapshot_path=os.getenv("SEMANTIC_CACHE_SNAPSHOT"),
+        )
+        if cache.snapshot_path:
+            loaded = cache.load()
+            log.info("Semantic cache warm start: %d entries from %s", loaded, cache.snapshot_path)
+            atexit.register(cache.save_on_exit)
+        return cache
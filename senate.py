@@ -0,0 +1,187 @@
+"""Senate council mode: fan a question out to several mentors, then synthesize.
+
+When the router picks the Senate, the most relevant mentors (by keyword
+hits, topped up from a default council) are asked concurrently for a
+short perspective each. Calls run on a shared, bounded thread pool (or as
+asyncio tasks under a semaphore on the ASGI path) against a deadline
+counted from the fan-out, so the wall-clock cost is close to the slowest
+mentor rather than the sum. Mentors that miss the deadline are cancelled
+and left out. The Senate then streams one synthesis over the perspectives
+that did arrive.
+
+Configured from the environment (see Council.from_env):
+    SENATE_COUNCIL        "false" to fall back to the single Senate prompt (default on)
+    SENATE_MEMBERS        most mentors consulted per question (default 4)
+    SENATE_WORKERS        mentor calls in flight per worker process (default 8)
+    SENATE_DEADLINE       seconds allowed for the perspectives (default 20)
+    SENATE_MENTOR_TOKENS  max_tokens for each perspective (default 350)
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+log = logging.getLogger(__name__)
+
+# The Senate's own prompt speaks for emotional intelligence, persuasion,
+# presence and virtue; these mentors make up the council when the question
+# itself does not name enough specialties.
+DEFAULT_COUNCIL = ["eidos", "ethos", "praxis", "virtus"]
+
+MENTOR_BRIEF = (
+    " You are one voice on a council of mentors. Give your perspective on the latest question "
+    "from your specialty only, in at most 150 words, as a few concrete points."
+)
+
+
+class Council:
+    """Concurrent mentor consultation with a deadline (thread-safe)."""
+
+    def __init__(self, max_members=4, workers=8, deadline=20.0, mentor_tokens=350):
+        self.max_members = max_members
+        self.workers = workers
+        self.deadline = deadline
+        self.mentor_tokens = mentor_tokens
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="senate")
+        self._semaphore = None  # asyncio twin of the executor's bound, made on first use
+        self._lock = threading.Lock()
+        self.sessions = 0
+        self.perspectives = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.seconds = 0.0
+
+    def members(self, hits, order):
+        """Mentor keys for a question: those its keywords hit (in routing
+        order), topped up from DEFAULT_COUNCIL, at most max_members."""
+        chosen = [key for key in order if key in hits]
+        for key in DEFAULT_COUNCIL:
+            if len(chosen) >= self.max_members:
+                break
+            if key not in chosen:
+                chosen.append(key)
+        return chosen[:self.max_members]
+
+    def _record(self, status, count=1):
+        with self._lock:
+            if status == "done":
+                self.perspectives += count
+            elif status == "timeout":
+                self.timeouts += count
+            else:
+                self.failures += count
+
+    def _finish(self, start):
+        with self._lock:
+            self.sessions += 1
+            self.seconds += time.monotonic() - start
+
+    def consult(self, members, ask):
+        """Runs ask(key, cancel) for every member concurrently.
+
+        Yields (key, status, answer) as mentors finish, status being "done",
+        "failed" or "timeout"; answer is None unless done. `cancel` is a
+        threading.Event set once the deadline passes or the caller stops.
+        """
+        start = time.monotonic()
+        cancel = threading.Event()
+        futures = {self._executor.submit(ask, key, cancel): key for key in members}
+        try:
+            try:
+                for future in as_completed(futures, timeout=self.deadline):
+                    key = futures[future]
+                    try:
+                        answer = future.result()
+                    except Exception as e:
+                        log.warning("Senate: %s failed (%s)", key, e)
+                        self._record("failed")
+                        yield key, "failed", None
+                        continue
+                    status = "done" if answer else "failed"
+                    self._record(status)
+                    yield key, status, answer or None
+            except FuturesTimeout:
+                late = [key for future, key in futures.items() if not future.done()]
+                self._record("timeout", len(late))
+                for key in late:
+                    yield key, "timeout", None
+        finally:
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            self._finish(start)
+
+    async def aconsult(self, members, ask):
+        """Async twin of consult(); ask(key) is a coroutine function."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        start = time.monotonic()
+
+        async def bounded(key):
+            async with self._semaphore:
+                try:
+                    return key, await ask(key), None
+                except Exception as e:
+                    return key, None, e
+
+        tasks = [asyncio.create_task(bounded(key)) for key in members]
+        remaining = list(members)
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=self.deadline):
+                key, answer, error = await next_done
+                remaining.remove(key)
+                if error is not None:
+                    log.warning("Senate: %s failed (%s)", key, error)
+                status = "done" if answer else "failed"
+                self._record(status)
+                yield key, status, answer or None
+        except asyncio.TimeoutError:
+            self._record("timeout", len(remaining))
+            for key in remaining:
+                yield key, "timeout", None
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._finish(start)
+
+    @staticmethod
+    def synthesis_note(perspectives, names):
+        """System message carrying the collected perspectives into the synthesis pass."""
+        sections = [f"### {names[key]}\n{answer.strip()}" for key, answer in perspectives.items()]
+        return {
+            "role": "system",
+            "content": (
+                "Your council of mentors has weighed in on the latest question:\n\n"
+                + "\n\n".join(sections)
+                + "\n\nSynthesize these perspectives into one coherent answer. Reconcile any tensions "
+                "between them, keep the strongest concrete advice, and do not attribute points to mentors "
+                "by name unless it helps the user."
+            ),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": self.sessions,
+                "perspectives": self.perspectives,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "avg_fanout_seconds": round(self.seconds / self.sessions, 3) if self.sessions else None,
+                "deadline": self.deadline,
+                "workers": self.workers,
+            }
+
+    @classmethod
+    def from_env(cls):
+        """Builds the council from SENATE_* variables, or returns None if disabled."""
+        if os.getenv("SENATE_COUNCIL", "true").lower() != "true":
+            return None
+        return cls(
+            max_members=int(os.getenv("SENATE_MEMBERS", 4)),
+            workers=int(os.getenv("SENATE_WORKERS", 8)),
+            deadline=float(os.getenv("SENATE_DEADLINE", 20)),
+            mentor_tokens=int(os.getenv("SENATE_MENTOR_TOKENS", 350)),
+        )
@@ -0,0 +1,535 @@
+"""Single-flight chat streams: identical in-flight requests share one upstream stream.
+
+During a workshop many people send the same prompt to the same agent
+within seconds. When a request's key (agent system prompt, model,
+temperature and trimmed messages, as for the response cache) matches a
+stream that is already in flight, the request attaches to that stream
+instead of opening its own: it first gets every chunk produced so far,
+then follows the live ones. A Senate flight includes the council step
+(app.answer_chunks), so joiners share the mentor calls and their progress
+events as well as the synthesis.
+
+A flight is produced by its own thread (a task under ASGI), so it does not
+depend on the request that started it: it keeps streaming while anyone is
+reading and closes the upstream response once the last subscriber has
+gone. A flight takes joiners until its answer passes
+SINGLE_FLIGHT_MAX_BYTES; after that a joiner could not be given the start
+of the answer, so the flight drops the chunks every subscriber has read
+and an identical request starts a flight of its own. A subscriber more
+than twice that far behind the live end is cut off with an error instead
+of holding the memory.
+
+With SINGLE_FLIGHT_DB the workers of a host also share flights through a
+SQLite file: the worker that starts a flight publishes its chunks there
+every SINGLE_FLIGHT_POLL seconds, and another worker follows it with one
+poller per flight, however many of its own requests are attached.
+
+Configured from the environment (see SingleFlight.from_env):
+    SINGLE_FLIGHT            "true" to enable (default off)
+    SINGLE_FLIGHT_MAX_BYTES  answer bytes a flight keeps in memory (default 256 KiB)
+    SINGLE_FLIGHT_DB         path of the SQLite broker shared by the workers (default none)
+    SINGLE_FLIGHT_POLL       seconds between broker publishes and polls (default 0.02)
+"""
+import asyncio
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from metrics import registry
+
+FLIGHT_REQUESTS = registry.counter(
+    "gravitas_single_flight_requests_total",
+    "Chat streams by single-flight role: leader (opened the upstream stream), joined (attached to one "
+    "in this worker) or remote (followed another worker's).", ["role"])
+
+
+class Lagging(Exception):
+    """A subscriber fell further behind a flight's live end than the flight keeps."""
+
+    def __init__(self):
+        super().__init__("This connection fell too far behind the shared answer. Please try again.")
+
+
+class FlightError(Exception):
+    """A flight followed through the broker failed or was abandoned in its worker."""
+
+
+class Flight:
+    """One upstream answer being produced, readable by any number of subscribers."""
+
+    WAIT = 0.25  # seconds between cancel checks of a subscriber waiting for a chunk
+
+    def __init__(self, key, max_bytes):
+        self.key = key
+        self.max_bytes = max_bytes
+        self.served = {}
+        self.chunks = deque()
+        self.base = 0  # answer index of chunks[0]
+        self.total = 0
+        self.bytes = 0
+        self.done = False
+        self.error = None
+        self.joinable = True
+        self.abandoned = False
+        self.subscribers = 0
+        self.lagging = 0
+        self.remote_followers = None  # callable: followers of this flight in other workers
+        self.task = None  # the async producer, cancelled when abandoned
+        self._positions = {}  # subscriber -> next answer index
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        self._wakeups = set()  # (loop, asyncio.Event) of async subscribers
+
+    def is_set(self) -> bool:
+        """The producer's cancel flag (see ProviderPool.stream): set once nobody reads."""
+        return self.abandoned
+
+    def subscribe(self):
+        """A subscriber id positioned at the start of the answer, or None if too late."""
+        with self._cond:
+            if not self.joinable or self.done or self.abandoned:
+                return None
+            sid = next(self._ids)
+            self._positions[sid] = 0
+            self.subscribers += 1
+            return sid
+
+    def leave(self, sid):
+        with self._cond:
+            self._positions.pop(sid, None)
+            self.subscribers -= 1
+            if self.subscribers or self.done:
+                return
+        if self.remote_followers is None or not self.remote_followers():
+            self.abandon()
+
+    def abandon(self):
+        self.abandoned = True
+        if self.task is not None:
+            self.task.cancel()
+
+    def append(self, content):
+        with self._cond:
+            self.chunks.append(content)
+            self.total += 1
+            self.bytes += len(content.encode("utf-8"))
+            if self.bytes > self.max_bytes:
+                self.joinable = False
+                self._trim()
+                while self.bytes > 2 * self.max_bytes and self._positions:
+                    # The slowest subscriber holds the memory: cut it off.
+                    del self._positions[min(self._positions, key=self._positions.get)]
+                    self.lagging += 1
+                    self._trim()
+            self._notify()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, wake in list(self._wakeups):
+            loop.call_soon_threadsafe(wake.set)
+
+    def _trim(self):
+        """Drops chunks every subscriber has read, once no joiner can need them."""
+        if self.joinable:
+            return
+        low = min(self._positions.values(), default=self.total)
+        while self.base < low:
+            self.bytes -= len(self.chunks.popleft().encode("utf-8"))
+            self.base += 1
+
+    def _take(self, sid):
+        """(new chunks, finished, error) for a subscriber; call with the lock held."""
+        position = self._positions.get(sid)
+        if position is None:
+            raise Lagging()
+        batch = list(itertools.islice(self.chunks, position - self.base, None))
+        self._positions[sid] = self.total
+        self._trim()
+        return batch, self.done and not batch, self.error
+
+    def follow(self, sid, cancel=None):
+        """Yields the answer for one subscriber: the backlog first, then live chunks."""
+        while True:
+            if cancel is not None and cancel.is_set():
+                return
+            with self._cond:
+                while self._positions.get(sid, -1) == self.total and not self.done:
+                    self._cond.wait(self.WAIT)
+                    if cancel is not None and cancel.is_set():
+                        return
+                batch, finished, error = self._take(sid)
+            if finished:
+                if error is not None:
+                    raise error
+                return
+            yield from batch
+
+    async def afollow(self, sid):
+        """Async twin of follow(); cancellation is the consuming task's."""
+        wake = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            self._wakeups.add(wake)
+        try:
+            while True:
+                with self._cond:
+                    batch, finished, error = self._take(sid)
+                    if not batch:
+                        wake[1].clear()
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+                if not batch:
+                    await wake[1].wait()
+                for content in batch:
+                    yield content
+        finally:
+            with self._cond:
+                self._wakeups.discard(wake)
+
+
+class SQLiteBroker:
+    """Flights shared by the workers of a host through a SQLite file (one connection per thread)."""
+
+    STALE = 30.0  # an unfinished flight not updated for this long is taken to be dead
+    KEEP = 60.0  # finished flights are purged after this long
+    PURGE_EVERY = 64
+
+    def __init__(self, path: str, poll=0.02):
+        self.path = path
+        self.poll = poll
+        self._local = threading.local()
+        self._claims = 0
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flights ("
+                "id TEXT PRIMARY KEY, key TEXT NOT NULL, done INTEGER NOT NULL DEFAULT 0, error TEXT, "
+                "provider TEXT, model TEXT, bytes INTEGER NOT NULL DEFAULT 0, followers INTEGER NOT NULL DEFAULT 0, "
+                "updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS flights_key ON flights (key, done, updated)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flight_chunks ("
+                "id TEXT NOT NULL, seq INTEGER NOT NULL, content TEXT NOT NULL, PRIMARY KEY (id, seq))"
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")  # a transient broker: no fsync per publish
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key, max_bytes):
+        """(flight id, True) if this worker should produce the flight for `key`,
+        or (id of a live flight elsewhere still under max_bytes, False)."""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM flights WHERE key = ? AND done = 0 AND updated > ? AND bytes <= ? "
+                "ORDER BY updated DESC LIMIT 1",
+                (key, now - self.STALE, max_bytes),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE flights SET followers = followers + 1 WHERE id = ?", (row[0],))
+                conn.execute("COMMIT")
+                return row[0], False
+            flight_id = uuid.uuid4().hex
+            conn.execute("INSERT INTO flights (id, key, updated) VALUES (?, ?, ?)", (flight_id, key, now))
+            self._claims += 1
+            if self._claims % self.PURGE_EVERY == 0:
+                cutoff = now - self.KEEP
+                conn.execute("DELETE FROM flight_chunks WHERE id IN "
+                             "(SELECT id FROM flights WHERE updated < ? AND (done = 1 OR updated < ?))",
+                             (cutoff, now - self.STALE))
+                conn.execute("DELETE FROM flights WHERE updated < ? AND (done = 1 OR updated < ?)",
+                             (cutoff, now - self.STALE))
+            conn.execute("COMMIT")
+            return flight_id, True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def publish(self, flight_id, seq, contents, served, done=False, error=None):
+        """Appends chunks after `seq` and refreshes the flight; returns the new seq."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO flight_chunks (id, seq, content) VALUES (?, ?, ?)",
+                             [(flight_id, seq + i, c) for i, c in enumerate(contents, 1)])
+            conn.execute("UPDATE flights SET updated = ?, provider = ?, model = ?, done = ?, error = ?, "
+                         "bytes = bytes + ? WHERE id = ?",
+                         (time.time(), served.get("provider"), served.get("model"), int(done), error,
+                          sum(len(c.encode("utf-8")) for c in contents), flight_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return seq + len(contents)
+
+    def read(self, flight_id, seq):
+        """(chunks after seq as (seq, content), flight row) read consistently."""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            rows = conn.execute("SELECT seq, content FROM flight_chunks WHERE id = ? AND seq > ? ORDER BY seq",
+                                (flight_id, seq)).fetchall()
+            state = conn.execute("SELECT done, error, provider, model, updated FROM flights WHERE id = ?",
+                                 (flight_id,)).fetchone()
+        finally:
+            conn.execute("COMMIT")
+        return rows, state
+
+    def followers(self, flight_id) -> int:
+        row = self._connect().execute("SELECT followers FROM flights WHERE id = ?", (flight_id,)).fetchone()
+        return row[0] if row else 0
+
+    def leave(self, flight_id):
+        self._connect().execute("UPDATE flights SET followers = followers - 1 WHERE id = ?", (flight_id,))
+
+
+class SingleFlight:
+    """The flights of this worker by key (see module docstring)."""
+
+    def __init__(self, max_bytes=256 * 1024, broker=None):
+        self.max_bytes = max_bytes
+        self.broker = broker
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.counts = {"leader": 0, "joined": 0, "remote": 0}
+        self.lagging = 0
+
+    def _attach(self, key):
+        """(flight, subscriber id, True if the caller must start the flight)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            sid = flight.subscribe() if flight is not None else None
+            if sid is not None:
+                self._count("joined")
+                return flight, sid, False
+            flight = Flight(key, self.max_bytes)
+            self._flights[key] = flight  # replaces a flight too far along to join
+            return flight, flight.subscribe(), True
+
+    def _forget(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def _count(self, role):
+        self.counts[role] += 1
+        FLIGHT_REQUESTS.labels(role).inc()
+
+    def _claim(self, flight):
+        """Whether this worker produces the flight (always, without a broker)."""
+        if self.broker is None:
+            with self._lock:
+                self._count("leader")
+            return None, True
+        flight_id, leader = self.broker.claim(flight.key, self.max_bytes)
+        with self._lock:
+            self._count("leader" if leader else "remote")
+        if leader:
+            flight.remote_followers = lambda: self.broker.followers(flight_id)
+        return flight_id, leader
+
+    # ----- Sync (Flask) -----
+    def stream(self, key, produce, served=None, cancel=None):
+        """Yields the answer of the flight for `key`, starting one if none can be joined.
+
+        produce(served, cancel) opens the upstream stream of a new flight
+        (e.g. ProviderPool.stream); `served` receives its provider and model.
+        """
+        flight, sid, leader = self._attach(key)
+        if leader:
+            threading.Thread(target=self._produce, args=(flight, produce), name="single-flight",
+                             daemon=True).start()
+        try:
+            for content in flight.follow(sid, cancel):
+                if served is not None and not served:
+                    served.update(flight.served)
+                yield content
+            if served is not None:
+                served.update(flight.served)
+        except Lagging:
+            with self._lock:
+                self.lagging += 1
+            raise
+        finally:
+            flight.leave(sid)
+
+    def _produce(self, flight, produce):
+        try:
+            flight_id, leader = self._claim(flight)
+            if leader:
+                chunks = produce(flight.served, flight)
+                if flight_id is not None:
+                    chunks = self._publish(flight_id, flight, chunks)
+            else:
+                chunks = self._follow(flight_id, flight)
+            for content in chunks:
+                flight.append(content)
+            flight.finish(FlightError("abandoned") if flight.abandoned else None)
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            self._forget(flight)
+
+    def _publish(self, flight_id, flight, chunks):
+        """Passes the producer's chunks through, publishing them to the broker in batches."""
+        broker = self.broker
+        pending, seq, last = [], 0, time.monotonic()
+        try:
+            for content in chunks:
+                pending.append(content)
+                now = time.monotonic()
+                if now - last >= broker.poll:
+                    seq, pending, last = broker.publish(flight_id, seq, pending, flight.served), [], now
+                    if not flight.subscribers and not broker.followers(flight_id):
+                        flight.abandon()
+                yield content
+        except Exception as e:
+            broker.publish(flight_id, seq, pending, flight.served, done=True, error=f"{type(e).__name__}: {e}")
+            raise
+        broker.publish(flight_id, seq, pending, flight.served, done=True,
+                       error="abandoned" if flight.abandoned else None)
+
+    def _follow(self, flight_id, flight):
+        """Yields the chunks another worker publishes for a flight."""
+        broker = self.broker
+        seq = 0
+        try:
+            while not flight.abandoned:
+                rows, state = broker.read(flight_id, seq)
+                for seq, content in rows:
+                    yield content
+                if not self._followed(flight, state):
+                    return
+                time.sleep(broker.poll)
+        finally:
+            broker.leave(flight_id)
+
+    def _followed(self, flight, state):
+        """Applies a broker flight row; False once the flight has finished."""
+        if state is None:
+            raise FlightError("the shared answer disappeared from the broker")
+        done, error, provider, model, updated = state
+        if provider:
+            flight.served.update(provider=provider, model=model)
+        if done:
+            if error:
+                raise FlightError(error)
+            return False
+        if time.time() - updated > self.broker.STALE:
+            raise FlightError("the worker streaming this answer stopped responding")
+        return True
+
+    # ----- Async (ASGI) -----
+    async def astream(self, key, produce, served=None):
+        """Async twin of stream(); produce(served) returns an async iterator."""
+        flight, sid, leader = self._attach(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self._aproduce(flight, produce))
+        try:
+            async for content in flight.afollow(sid):
+                if served is not None and not served:
+                    served.update(flight.served)
+                yield content
+            if served is not None:
+                served.update(flight.served)
+        except Lagging:
+            with self._lock:
+                self.lagging += 1
+            raise
+        finally:
+            flight.leave(sid)
+
+    async def _aproduce(self, flight, produce):
+        try:
+            flight_id, leader = self._claim(flight) if self.broker is None else \
+                await asyncio.to_thread(self._claim, flight)
+            if leader:
+                chunks = produce(flight.served)
+                if flight_id is not None:
+                    chunks = self._apublish(flight_id, flight, chunks)
+            else:
+                chunks = self._afollow(flight_id, flight)
+            async for content in chunks:
+                flight.append(content)
+            flight.finish()
+        except asyncio.CancelledError:
+            flight.finish(FlightError("abandoned"))
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            self._forget(flight)
+
+    async def _apublish(self, flight_id, flight, chunks):
+        broker = self.broker
+        pending, seq, last = [], 0, time.monotonic()
+        try:
+            async for content in chunks:
+                pending.append(content)
+                now = time.monotonic()
+                if now - last >= broker.poll:
+                    seq = await asyncio.to_thread(broker.publish, flight_id, seq, pending, dict(flight.served))
+                    pending, last = [], now
+                yield content
+        except BaseException as e:
+            error = "abandoned" if isinstance(e, asyncio.CancelledError) else f"{type(e).__name__}: {e}"
+            await asyncio.shield(asyncio.to_thread(broker.publish, flight_id, seq, pending, dict(flight.served),
+                                                   True, error))
+            raise
+        await asyncio.to_thread(broker.publish, flight_id, seq, pending, dict(flight.served), True)
+
+    async def _afollow(self, flight_id, flight):
+        broker = self.broker
+        seq = 0
+        try:
+            while True:
+                rows, state = await asyncio.to_thread(broker.read, flight_id, seq)
+                for seq, content in rows:
+                    yield content
+                if not self._followed(flight, state):
+                    return
+                await asyncio.sleep(broker.poll)
+        finally:
+            await asyncio.shield(asyncio.to_thread(broker.leave, flight_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "flights": len(self._flights),
+                "requests": dict(self.counts),
+                "lagging": self.lagging,
+                "max_bytes": self.max_bytes,
+                "shared_broker": self.broker.path if self.broker is not None else None,
+            }
+
+    @classmethod
+    def from_env(cls):
+        """Builds the registry from SINGLE_FLIGHT_* variables, or returns None if disabled."""
+        if os.getenv("SINGLE_FLIGHT", "false").lower() != "true":
+            return None
+        db_path = os.getenv("SINGLE_FLIGHT_DB")
+        return cls(
+            max_bytes=int(os.getenv("SINGLE_FLIGHT_MAX_BYTES", 256 * 1024)),
+            broker=SQLiteBroker(db_path, poll=float(os.getenv("SINGLE_FLIGHT_POLL", 0.02))) if db_path else None,
+        )
@@ -11,6 +11,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- State ---
     let messageHistory = [];
+    // Server-side conversation id: once known, only the new message is sent each turn.
+    let conversationId = null;
+    // The answer being streamed, if any: { id, controller } (see stopStream).
+    let activeStream = null;
 
     // --- Web Speech API Setup (Speech Recognition - Input) ---
     const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
@@ -161,6 +165,147 @@ document.addEventListener('DOMContentLoaded', () => {
         return messageDiv; // Return the created message div
     }
 
+    // --- POST one chat turn (conversation-id mode, with full-history fallback) ---
+    async function postChat(history, stream) {
+        const post = (payload) => fetch('/api/chat', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ...payload, stream_id: stream.id }),
+            signal: stream.controller.signal
+        });
+        let response;
+        if (conversationId) {
+            response = await post({ conversation_id: conversationId, message: history[history.length - 1] });
+            if (response.status !== 404) return response;
+            // Server forgot the conversation (expired or restarted): resend the full history.
+            conversationId = null;
+        }
+        response = await post({ messages: history, conversation: true });
+        conversationId = response.headers.get('X-Conversation-Id') || null;
+        return response;
+    }
+
+    // Reconnects to a dropped stream: the server replays what came after lastEventId (see resume.py).
+    function resumeChat(stream, lastEventId) {
+        return fetch('/api/chat', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Last-Event-ID': lastEventId },
+            body: '{}',
+            signal: stream.controller.signal
+        });
+    }
+
+    // --- Progress (event: progress frames: admission queue, Senate mentors) ---
+    function showCouncilProgress(messageDiv, progress) {
+        let progressEl = messageDiv.querySelector('.council-progress');
+        if (!progressEl) {
+            progressEl = document.createElement('div');
+            progressEl.classList.add('council-progress');
+            progressEl.dataset.agents = '';
+            messageDiv.prepend(progressEl);
+        }
+        if (progress.stage === 'council') {
+            progressEl.textContent = `Consulting the council: ${progress.members.join(', ')}…`;
+        } else if (progress.stage === 'perspective') {
+            const mark = progress.status === 'done' ? '✓' : '✗';
+            progressEl.dataset.agents += `${progressEl.dataset.agents ? ', ' : ''}${progress.agent} ${mark}`;
+            progressEl.textContent = `Perspectives ${progress.done}/${progress.total}: ${progressEl.dataset.agents}`;
+        } else if (progress.stage === 'synthesis') {
+            progressEl.textContent = `Synthesizing ${progress.perspectives} perspectives…`;
+        } else if (progress.stage === 'queue' && progress.position) {
+            // Admission queue: the server is busy and this request is waiting for a slot.
+            progressEl.textContent = `Gravitas is busy. You are #${progress.position} in line…`;
+        }
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+
+    // --- Stop button: the send button turns into it while an answer streams ---
+    function setStreaming(stream) {
+        activeStream = stream;
+        sendButton.disabled = false;
+        sendButton.classList.toggle('btn-stop', !!stream);
+        sendButton.title = stream ? 'Stop generating' : 'Send message';
+        sendButton.innerHTML = `<i class="fa-solid fa-${stream ? 'stop' : 'arrow-up'}"></i>`;
+    }
+
+    // How long a stopped stream may take to end before the connection is dropped.
+    const STOP_GRACE_MS = 3000;
+
+    // Stops the answer being streamed. The server ends the stream after the frame
+    // in flight and keeps what it sent as the answer (in conversation mode); reading
+    // the stream to its end keeps the answer here the same. abandon drops it at once.
+    function stopStream(abandon = false) {
+        if (!activeStream) return;
+        const { id, controller } = activeStream;
+        fetch(`/api/chat/${id}/stop`, { method: 'POST', keepalive: true }).catch(() => {});
+        if (abandon) {
+            controller.abort();
+            return;
+        }
+        sendButton.disabled = true;
+        setTimeout(() => controller.abort(), STOP_GRACE_MS);
+    }
+
+    // --- Event-stream parsing: returns feed(bytes), which calls onEvent(event, data, lastEventId) per event ---
+    // Per the SSE spec, data spanning several lines arrives as several data: lines (see sse.py).
+    function createEventParser(onEvent) {
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let event = null;
+        let data = [];
+        let lastEventId = null;
+        return function feed(chunk) {
+            buffer += decoder.decode(chunk, { stream: true });
+            let hold = '';
+            if (buffer.endsWith('\r')) { // may be the first half of a \r\n
+                buffer = buffer.slice(0, -1);
+                hold = '\r';
+            }
+            const lines = buffer.split(/\r\n|\r|\n/);
+            buffer = lines.pop() + hold; // only the unterminated line is kept
+            for (const line of lines) {
+                if (line === '') {
+                    if (data.length) onEvent(event || 'message', data.join('\n'), lastEventId);
+                    event = null;
+                    data = [];
+                } else if (!line.startsWith(':')) {
+                    const colon = line.indexOf(':');
+                    const field = colon < 0 ? line : line.slice(0, colon);
+                    let value = colon < 0 ? '' : line.slice(colon + 1);
+                    if (value.startsWith(' ')) value = value.slice(1);
+                    if (field === 'data') data.push(value);
+                    else if (field === 'event') event = value;
+                    else if (field === 'id' && !value.includes('\0')) lastEventId = value;
+                }
+            }
+        };
+    }
+
+    // --- Incremental rendering: new text is appended to one text node, at most once per frame ---
+    function createStreamRenderer(span) {
+        const text = document.createTextNode('');
+        span.replaceChildren(text);
+        let pending = '';
+        let scheduled = false;
+        function flush() {
+            scheduled = false;
+            if (!pending) return;
+            text.appendData(pending);
+            pending = '';
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        }
+        return {
+            append(chunk) {
+                pending += chunk;
+                if (!scheduled) {
+                    scheduled = true;
+                    requestAnimationFrame(flush);
+                }
+            },
+            flush
+        };
+    }
+
     // --- Function using Fetch for POST and Stream Processing ---
     async function handleChatStreamWithFetch(history) { 
         let lastBotMessageDiv = addMessageToUI('bot', '');
@@ -169,22 +314,17 @@ document.addEventListener('DOMContentLoaded', () => {
         let contentSpan = lastBotMessageDiv.querySelector('span');
         if(!contentSpan) return; // Should exist, but safety check
 
-        let currentContent = '';
+        const parts = []; // answer text as received; joined once at the end
+        const renderer = createStreamRenderer(contentSpan);
+        const stream = {
+            id: window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`,
+            controller: new AbortController()
+        };
+        setStreaming(stream);
 
         try {
-            // =============================================================
-            // === FIX FOR 405 METHOD NOT ALLOWED ===
-            // === Explicitly set method to POST, content type, and body. ===
-            // =============================================================
-            const response = await fetch('/api/chat', { 
-                method: 'POST', // <-- FIX: Specify POST method
-                headers: {
-                    'Content-Type': 'application/json', // <-- FIX: Specify content type
-                },
-                // Use the entire message history as the body payload
-                body: JSON.stringify({ messages: history }) // <-- FIX: Pass messages array in JSON body
-            });
-            // =============================================================
+            // POST (not GET) with a JSON body; see postChat for the payload modes.
+            const response = await postChat(history, stream);
 
             if (!response.ok) { 
                 // Handle non-stream HTTP errors (400, 500) that might occur before the stream starts
@@ -195,49 +335,69 @@ document.addEventListener('DOMContentLoaded', () => {
                 } catch(e) { /* ignore if no JSON body */ }
                 throw new Error(errorDetails); 
             }
+            // The server picks another id if this one was taken; stop and resume use its choice.
+            stream.id = response.headers.get('X-Stream-Id') || stream.id;
             
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-            let buffer = '';
-
-            while (true) { /* ... stream reading loop ... */
-                const { done, value } = await reader.read();
-                if (done) break;
-                buffer += decoder.decode(value, { stream: true });
-                let lines = buffer.split('\n\n');
-                buffer = lines.pop() || '';
-
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        const data = line.substring(6); // Keep raw data including \n
-                        // console.log("Raw Chunk:", JSON.stringify(data));
-
-                         if (data.startsWith("[Error]")) {
-                             currentContent += data.trim();
-                             // Update the span within the div for error
-                             contentSpan.innerHTML = `<span style="color: #ff5555;">${currentContent.replace(/\\n/g, '<br>')}</span>`;
-                             lastBotMessageDiv.querySelector('.btn-tts')?.remove(); // Remove TTS button on error
-                             throw new Error("Backend Error Received");
-                         }
-
-                        // Minimal space workaround
-                        if (currentContent.length > 0 && !/\s$/.test(currentContent) && !/^\s/.test(data)) {
-                             currentContent += ' ';
-                        }
-                        currentContent += data;
-                        // Update textContent of the span
-                        contentSpan.textContent = currentContent.replace(/\\n/g, '\n');
-                        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+            let reader = response.body.getReader();
+            let streamError = null;
+            let lastEventId = null;
+            const onEvent = (event, data, id) => {
+                if (id) lastEventId = id;
+                if (event === 'progress') {
+                    showCouncilProgress(lastBotMessageDiv, JSON.parse(data));
+                    return;
+                }
+                if (event !== 'message') return;
+                lastBotMessageDiv.querySelector('.council-progress')?.remove();
+                if (data.startsWith("[Error]")) {
+                    streamError = data;
+                    return;
+                }
+                parts.push(data);
+                renderer.append(data);
+            };
+            let feed = createEventParser(onEvent);
+
+            let retries = 0;
+            while (!streamError) {
+                let chunk;
+                try {
+                    chunk = await reader.read();
+                } catch (error) {
+                    // Connection dropped mid-answer: resume after the last event received,
+                    // if the server keeps resumable streams (otherwise it answers 404).
+                    if (error.name === 'AbortError' || !lastEventId || retries >= 3) throw error;
+                    retries += 1;
+                    await new Promise(resolve => setTimeout(resolve, 500 * retries));
+                    const resumed = await resumeChat(stream, lastEventId).catch(e => {
+                        if (e.name === 'AbortError') throw e;
+                        return null; // still offline: try again
+                    });
+                    if (resumed && !resumed.ok) throw error;
+                    if (resumed) {
+                        reader = resumed.body.getReader();
+                        feed = createEventParser(onEvent);
                     }
+                    continue;
                 }
+                if (chunk.done) break;
+                retries = 0;
+                feed(chunk.value);
             }
+            renderer.flush();
+            if (streamError) {
+                const shown = (parts.join('') + streamError).trim();
+                contentSpan.innerHTML = `<span style="color: #ff5555;">${shown.replace(/\n/g, '<br>')}</span>`;
+                lastBotMessageDiv.querySelector('.btn-tts')?.remove(); // Remove TTS button on error
+                throw new Error("Backend Error Received");
+            }
+
             // AFTER STREAM: Trim, Apply Markdown, Update History
-            currentContent = currentContent.trim();
-            if (currentContent.length > 0 && !currentContent.startsWith("[Error]")) {
+            const answer = parts.join('').trim();
+            if (answer.length > 0) {
                 // Apply Markdown to the final content IN THE SPAN
-                let formattedHTML = currentContent.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>');
+                let formattedHTML = answer.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>');
                 formattedHTML = formattedHTML.replace(/\*(.*?)\*/g, '<em>$1</em>');
-                formattedHTML = formattedHTML.replace(/\\n/g, '\n'); // Ensure newlines render correctly with pre-wrap
                 contentSpan.innerHTML = formattedHTML;
 
                  // Update the TTS button's click handler with final text if needed (or rely on span's textContent)
@@ -246,18 +406,26 @@ document.addEventListener('DOMContentLoaded', () => {
                      ttsButton.onclick = (e) => speakText(contentSpan.textContent, e.currentTarget);
                  }
 
-                messageHistory.push({ role: 'assistant', content: currentContent.replace(/\\n/g, '\n') });
-            } else if (currentContent.startsWith("[Error]")) {
-                 // Ensure error is fully displayed if stream loop missed it
-                 if (!contentSpan.innerHTML.includes('color: #ff5555;')) {
-                         contentSpan.innerHTML = `<span style="color: #ff5555;">${currentContent.replace(/\\n/g, '<br>')}</span>`;
-                  }
-                  lastBotMessageDiv.querySelector('.btn-tts')?.remove(); // Remove TTS on error
+                messageHistory.push({ role: 'assistant', content: answer });
             } else {
                  lastBotMessageDiv.remove(); // Remove placeholder if no content
             }
 
         } catch (error) { 
+             if (error.name === 'AbortError') {
+                 // Dropped before the server ended the stream: keep what arrived so far
+                 // as the answer, and resend the full history next turn, as the server's
+                 // copy of the conversation may hold more or less of it.
+                 const answer = parts.join('').trim();
+                 if (answer) {
+                     contentSpan.textContent = answer;
+                     messageHistory.push({ role: 'assistant', content: answer });
+                 } else {
+                     lastBotMessageDiv.remove();
+                 }
+                 conversationId = null;
+                 return;
+             }
              console.error("Fetch stream failed:", error);
              // Ensure error is shown in the placeholder or a new div
              const errorMsg = `[Stream Connection Error: ${error.message}]`;
@@ -274,6 +442,7 @@ document.addEventListener('DOMContentLoaded', () => {
                   addMessageToUI('bot', `<span style="color: #ff5555;">${errorMsg}</span>`);
               }
         } finally { 
+            setStreaming(null);
             messageInput.disabled = false;
             sendButton.disabled = false;
             messageInput.focus();
@@ -283,13 +452,13 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Event Listener & Keypress for Sending Message ---
     async function sendMessage(event) { /* ... same as before ... */
          event.preventDefault();
+        if (activeStream) { stopStream(); return; }
         const userText = messageInput.value.trim();
         if (!userText) return;
         addMessageToUI('user', userText);
         messageHistory.push({ role: 'user', content: userText });
         messageInput.value = '';
         messageInput.disabled = true;
-        sendButton.disabled = true;
         await handleChatStreamWithFetch([...messageHistory]);
     }
     if (chatForm) { chatForm.addEventListener('submit', sendMessage); }
@@ -312,9 +481,11 @@ document.addEventListener('DOMContentLoaded', () => {
             synth.cancel();
         }
         currentUtterance = null; // Clear tracking
+        stopStream(true); // Abandon an answer still streaming
 
-        // Clear message history array
+        // Clear message history array and forget the server-side conversation
         messageHistory = [];
+        conversationId = null;
 
         // Clear messages from the UI
         messagesContainer.innerHTML = '';
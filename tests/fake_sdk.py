@@ -0,0 +1,92 @@
+"""In-process stand-ins for the OpenAI/Groq SDK clients the provider pool calls.
+
+Only the surface providers.py uses: client.chat.completions.create(stream=True,
+...) returning an iterable (or async iterable) of chunks with close(), and
+client.with_options(). Timings are real sleeps, kept short.
+"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+
+def chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+
+
+class FakeError(Exception):
+    status_code = 500
+
+
+class FakeStream:
+    def __init__(self, client):
+        self.client = client
+        self.closed = False
+        self.response = SimpleNamespace(headers={})
+
+    def __iter__(self):
+        client = self.client
+        time.sleep(client.ttft)
+        for i in range(client.tokens):
+            if self.closed:
+                return
+            if i:
+                time.sleep(client.gap)
+            client.sent += 1
+            yield chunk(f"{client.name[0].upper()}{i} ")
+
+    def close(self):
+        self.closed = True
+        self.client.closed.set()
+
+
+class AsyncFakeStream(FakeStream):
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        client = self.client
+        await asyncio.sleep(client.ttft)
+        for i in range(client.tokens):
+            if i:
+                await asyncio.sleep(client.gap)
+            client.sent += 1
+            yield chunk(f"{client.name[0].upper()}{i} ")
+
+    async def close(self):
+        super().close()
+
+
+class FakeClient:
+    """A provider that streams `tokens` chunks after `ttft` seconds, or fails with a 500."""
+
+    def __init__(self, name, tokens=10, ttft=0.01, gap=0.01, fail=False, asynchronous=False):
+        self.name = name
+        self.tokens = tokens
+        self.ttft = ttft
+        self.gap = gap
+        self.fail = fail
+        self.asynchronous = asynchronous
+        self.calls = 0
+        self.sent = 0
+        self.closed = threading.Event()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def with_options(self, **options):
+        return self
+
+    def _open(self, request):
+        self.calls += 1
+        if self.fail:
+            raise FakeError(f"{self.name} is down")
+        return (AsyncFakeStream if self.asynchronous else FakeStream)(self)
+
+    def _create(self, stream=True, **request):
+        if self.asynchronous:
+            async def create():
+                return self._open(request)
+            return create()
+        return self._open(request)
+
+    async def close(self):
+        pass
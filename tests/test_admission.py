@@ -0,0 +1,30 @@
+import pytest
+
+from admission import AdmissionControl, Rejected
+
+
+def test_unknown_api_keys_do_not_make_new_clients():
+    control = AdmissionControl(max_in_flight=10, per_client=2, api_keys=["team-a"])
+    keys = {control.client_key("10.0.0.1", {"X-API-Key": f"random-{n}"}) for n in range(50)}
+    assert keys == {"ip:10.0.0.1"}
+    assert control.client_key("10.0.0.1", {"X-API-Key": "team-a"}) == "key:team-a"
+
+    tickets = [control.enter(control.client_key("10.0.0.1", {"X-API-Key": f"random-{n}"})) for n in range(2)]
+    with pytest.raises(Rejected) as rejected:
+        control.enter(control.client_key("10.0.0.1", {"X-API-Key": "random-2"}))
+    assert rejected.value.status == 429
+    for ticket in tickets:
+        ticket.release()
+
+
+def test_forwarded_address_only_behind_a_trusted_proxy():
+    headers = {"X-Forwarded-For": "203.0.113.7, 10.0.0.2", "X-API-Key": "made-up"}
+    assert AdmissionControl().client_key("10.0.0.2", headers) == "ip:10.0.0.2"
+    assert AdmissionControl(trust_proxy=True).client_key("10.0.0.2", headers) == "ip:203.0.113.7"
+
+
+def test_api_keys_from_env(monkeypatch):
+    monkeypatch.setenv("ADMISSION_API_KEYS", " team-a, team-b ,")
+    assert AdmissionControl.from_env().api_keys == {"team-a", "team-b"}
+    monkeypatch.delenv("ADMISSION_API_KEYS")
+    assert AdmissionControl.from_env().api_keys == frozenset()
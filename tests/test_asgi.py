@@ -0,0 +1,80 @@
+"""Smoke test of asgi.py under uvicorn, with the Flask fallback routes in particular.
+
+The routes asgi.py does not serve itself go through the WSGI adapter; the
+failures it can have (asgiref's "CurrentThreadExecutor already quit")
+only show under a real server over keep-alive connections, so this runs
+uvicorn against the fake provider rather than an in-process transport.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+import pytest
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fake_provider  # noqa: E402
+from bench_ttft import start_server  # noqa: E402
+
+PORT, PROVIDER_PORT = 8941, 8940
+BASE = f"http://127.0.0.1:{PORT}"
+CHAT = {"messages": [{"role": "user", "content": "How do I lead my team through a reorganisation?"}]}
+
+
+@pytest.fixture(scope="module")
+def server():
+    provider = fake_provider.spawn(PROVIDER_PORT, ttft=0.05, tps=40, tokens=200)
+    with tempfile.TemporaryDirectory(prefix="gravitas-test-") as tmp:
+        env = {"ASSETS": "false", "BATCH": "true", "BATCH_DIR": tmp, "HTTP_WARMUP": "0",
+               "RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "SINGLE_FLIGHT": "false"}
+        proc, _ = start_server("asgi", PORT, PROVIDER_PORT, env)
+        try:
+            yield
+        finally:
+            proc.terminate()
+            proc.wait()
+            provider.terminate()
+            provider.wait()
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/", 200),
+    ("/static/app.js", 200),
+    ("/static/style.css", 200),
+    ("/metrics", 200),
+    ("/api/batch/no-such-batch", 404),
+])
+def test_fallback_routes_over_keep_alive(server, path, expected):
+    with httpx.Client(base_url=BASE, timeout=10) as client:
+        statuses = [client.get(path).status_code for _ in range(60)]
+    assert statuses == [expected] * 60
+
+
+def test_stop_unknown_stream(server):
+    with httpx.Client(base_url=BASE, timeout=10) as client:
+        statuses = [client.post(f"/api/chat/unknown-stream-{n:04d}/stop").status_code for n in range(60)]
+    assert statuses == [404] * 60
+
+
+def test_stop_ends_a_running_stream(server):
+    stream_id = "test-stop-0001"
+    with httpx.Client(base_url=BASE, timeout=10) as client:
+        with client.stream("POST", "/api/chat", json=dict(CHAT, stream_id=stream_id)) as resp:
+            assert resp.status_code == 200
+            assert resp.headers["x-stream-id"] == stream_id
+            lines = resp.iter_lines()
+            assert any(line.startswith("data:") for line in lines)  # the answer has started
+            stop = client.post(f"/api/chat/{stream_id}/stop")
+            assert stop.status_code == 200
+            assert stop.json() == {"stream_id": stream_id, "status": "stopped"}
+            start = time.monotonic()
+            rest = list(lines)
+        # 200 tokens at 40/s would take 5s; a stopped stream ends within a chunk or two.
+        assert time.monotonic() - start < 2
+        assert len(rest) < 100
+        assert json.loads(httpx.get(f"http://127.0.0.1:{PROVIDER_PORT}/control").text)["cancelled"] >= 1
@@ -0,0 +1,21 @@
+import os
+
+from cache import ResponseCache, SQLiteBackend
+
+
+def test_shared_hit_keeps_the_shared_expiry(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("cache.time.time", lambda: clock[0])
+    backend = SQLiteBackend(os.path.join(tmp_path, "cache.db"))
+    writer = ResponseCache(ttl=60, backend=backend)
+    reader = ResponseCache(ttl=60, backend=backend)
+    writer.put("k", "answer")
+
+    clock[0] += 50  # the shared row has 10s left
+    assert reader.get("k") == "answer"
+    assert reader.stats()["shared_hits"] == 1
+
+    clock[0] += 20  # past the writer's expiry: no copy may outlive it
+    assert reader.get("k") is None
+    assert writer.get("k") is None
+    assert reader.stats()["expirations"] == 1
@@ -0,0 +1,177 @@
+"""ProviderPool failover and hedging against in-process fake SDK clients (see fake_sdk.py)."""
+import asyncio
+import threading
+
+import pytest
+from fake_sdk import FakeClient, FakeError
+
+from providers import Provider, ProviderPool
+
+OPENAI = [f"O{i} " for i in range(10)]
+GROQ = [f"G{i} " for i in range(10)]
+
+
+def pool(*clients, hedge=False, hedge_delay=0.05):
+    providers = [
+        Provider(c.name, None if c.asynchronous else c, f"{c.name}-model",
+                 make_async=(lambda c=c: c) if c.asynchronous else None, primary=i == 0)
+        for i, c in enumerate(clients)
+    ]
+    return ProviderPool(providers, hedge=hedge, hedge_delay=hedge_delay)
+
+
+def request_for(provider):
+    return {"model": provider.model, "messages": [{"role": "user", "content": "hi"}]}
+
+
+async def collect(stream, count=None):
+    """The first `count` (default: all) deltas of an async stream, which is then closed."""
+    tokens = []
+    try:
+        async for content in stream:
+            tokens.append(content)
+            if len(tokens) == count:
+                break
+    finally:
+        await stream.aclose()
+    return tokens
+
+
+# ----- Failover -----
+@pytest.mark.parametrize("hedge", [False, True])
+def test_failover_before_the_first_token(hedge):
+    primary, backup = FakeClient("openai", fail=True), FakeClient("groq")
+    providers = pool(primary, backup, hedge=hedge, hedge_delay=1.0)
+    served = {}
+    assert list(providers.stream(request_for, served)) == GROQ
+    assert served == {"provider": "groq", "model": "groq-model"}
+    assert (primary.calls, backup.calls) == (1, 1)
+    assert providers.stats()["failovers"] == 1
+    assert providers.stats()["providers"]["openai"]["failures"] == 1
+
+
+@pytest.mark.parametrize("hedge", [False, True])
+def test_last_provider_failure_is_raised(hedge):
+    providers = pool(FakeClient("openai", fail=True), FakeClient("groq", fail=True), hedge=hedge)
+    with pytest.raises(FakeError, match="groq is down"):
+        list(providers.stream(request_for))
+
+
+def test_async_failover_before_the_first_token():
+    primary, backup = FakeClient("openai", fail=True, asynchronous=True), FakeClient("groq", asynchronous=True)
+    providers = pool(primary, backup)
+    served = {}
+    assert asyncio.run(collect(providers.astream(request_for, served))) == GROQ
+    assert served["provider"] == "groq"
+    assert providers.stats()["failovers"] == 1
+
+
+# ----- Hedging -----
+def test_hedge_wins_over_a_slow_primary():
+    primary, backup = FakeClient("openai", ttft=1.0), FakeClient("groq")
+    providers = pool(primary, backup, hedge=True)
+    served = {}
+    assert list(providers.stream(request_for, served)) == GROQ
+    assert served == {"provider": "groq", "model": "groq-model"}
+    assert primary.closed.wait(2)
+    assert primary.sent <= 1  # cancelled at its first chunk
+    assert (providers.stats()["hedges"], providers.stats()["hedge_wins"]) == (1, 1)
+
+
+def test_hedged_primary_wins_after_hedge_fires():
+    primary, backup = FakeClient("openai", ttft=0.2), FakeClient("groq", ttft=1.0)
+    served = {}
+    providers = pool(primary, backup, hedge=True)
+    assert list(providers.stream(request_for, served)) == OPENAI
+    assert served == {"provider": "openai", "model": "openai-model"}
+    assert backup.calls == 1
+    assert backup.closed.wait(2)
+    assert (providers.stats()["hedges"], providers.stats()["hedge_wins"]) == (1, 0)
+
+
+def test_no_hedge_when_the_primary_answers_in_time():
+    primary, backup = FakeClient("openai"), FakeClient("groq")
+    assert list(pool(primary, backup, hedge=True, hedge_delay=1.0).stream(request_for)) == OPENAI
+    assert backup.calls == 0
+
+
+@pytest.mark.parametrize("hedge", [False, True])
+def test_caller_cancel_ends_the_stream_and_closes_upstreams(hedge):
+    primary, backup = FakeClient("openai", tokens=100, ttft=0.1), FakeClient("groq", ttft=0.5)
+    cancel = threading.Event()
+    stream = pool(primary, backup, hedge=hedge).stream(request_for, cancel=cancel)
+    tokens = [next(stream) for _ in range(3)]
+    cancel.set()
+    tokens += list(stream)
+    assert tokens == OPENAI[:3]
+    assert primary.closed.wait(2)
+    assert primary.sent < 20
+    if hedge:
+        assert backup.calls == 1 and backup.closed.wait(2)
+
+
+def test_async_hedge_wins_over_a_slow_primary():
+    primary = FakeClient("openai", ttft=1.0, asynchronous=True)
+    backup = FakeClient("groq", asynchronous=True)
+    providers = pool(primary, backup, hedge=True)
+    served = {}
+    assert asyncio.run(collect(providers.astream(request_for, served))) == GROQ
+    assert served["provider"] == "groq"
+    assert primary.closed.is_set()  # the losing task is cancelled
+    assert providers.stats()["hedge_wins"] == 1
+
+
+def test_async_hedged_primary_wins_after_hedge_fires():
+    primary = FakeClient("openai", ttft=0.2, asynchronous=True)
+    backup = FakeClient("groq", ttft=1.0, asynchronous=True)
+    providers = pool(primary, backup, hedge=True)
+    assert asyncio.run(collect(providers.astream(request_for))) == OPENAI
+    assert backup.calls == 1 and backup.closed.is_set()
+    assert providers.stats()["hedge_wins"] == 0
+
+
+def test_async_caller_close_cancels_both_upstreams():
+    primary = FakeClient("openai", tokens=100, ttft=0.1, asynchronous=True)
+    backup = FakeClient("groq", ttft=0.5, asynchronous=True)
+
+    async def main():
+        tokens = await collect(pool(primary, backup, hedge=True).astream(request_for), count=3)
+        await asyncio.sleep(0.05)
+        return tokens
+
+    assert asyncio.run(main()) == OPENAI[:3]
+    assert primary.closed.is_set() and backup.closed.is_set()
+    assert primary.sent < 20
+
+
+def test_client_named_models_share_one_metric_label():
+    providers = pool(FakeClient("openai"), FakeClient("groq"))
+    providers.metric_models.add("gpt-4o-mini")  # a cascade tier
+    assert [providers.model_label(m) for m in ("openai-model", "groq-model", "gpt-4o-mini")] == \
+        ["openai-model", "groq-model", "gpt-4o-mini"]
+    assert {providers.model_label(f"made-up-{n}") for n in range(100)} == {"other"}
+
+
+# ----- Ranking -----
+def test_failing_provider_out_of_cooldown_is_probed_not_preferred():
+    primary, backup = FakeClient("openai"), FakeClient("groq", fail=True)
+    providers = pool(primary, backup)
+    for _ in range(5):
+        providers.providers[0].stats.record_ttft(0.3)
+    for _ in range(3):
+        providers.providers[1].stats.record_failure()  # trips the breaker
+    providers.providers[1].stats.cooldown_until = 0.0  # ... which has just expired
+
+    assert [p.name for p in providers.ranked()] == ["openai", "groq"]
+    for _ in range(5):
+        assert list(providers.stream(request_for)) == OPENAI
+    assert backup.calls == 1  # one probe per interval, failing over to the primary
+    assert providers.stats()["probes"] == 1
+    assert providers.stats()["failovers"] == 1
+
+
+def test_unsampled_providers_rank_by_error_rate():
+    providers = pool(FakeClient("openai"), FakeClient("groq"))
+    providers.providers[0].stats.record_failure()
+    assert [p.name for p in providers.ranked(probe=True)] == ["groq", "openai"]
+    assert providers.stats()["probes"] == 0  # nothing sampled to probe ahead of
@@ -0,0 +1,116 @@
+"""Resumable streams across a dropped connection, with two workers sharing a SQLite store."""
+import time
+
+import pytest
+
+from cancellation import StreamRegistry
+from resume import ResumableStreams, SQLiteRecordings
+from sse import frame
+
+TOKENS = 30
+
+
+class Worker:
+    """One server process: its own stream registry and recordings, the host's store file."""
+
+    def __init__(self, path, ttl=60.0):
+        self.streams = StreamRegistry()
+        self.resumable = ResumableStreams(ttl=ttl, grace=5.0, store=SQLiteRecordings(path, ttl, poll=0.01))
+
+    def start(self, stream_id, gap=0.01):
+        stop = self.streams.open(stream_id)
+        assert self.resumable.claim(stop.id)
+        return self.resumable.start(stop, answer(gap), on_done=stop.close)
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "recordings.db")
+
+
+def answer(gap):
+    for i in range(TOKENS):
+        time.sleep(gap)
+        yield frame(f"t{i} ")
+
+
+def event_id(data: bytes) -> str:
+    return data.decode().rpartition("id: ")[2].split("\n")[0]
+
+
+def text(frames):
+    return "".join(data.decode().split("data: ")[1].split("\n")[0] for data in frames)
+
+
+def drop_after(reader, count):
+    """Reads `count` frames and drops the connection; returns them."""
+    received = [next(reader) for _ in range(count)]
+    reader.close()
+    return received
+
+
+def published(worker, stream_id, count=None):
+    """Waits for the producing worker to publish `count` frames, or all of them (it
+    publishes every poll seconds; a real reconnect takes far longer than that)."""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        state = worker.resumable.store.state(stream_id)
+        if state is not None and (state[0] or count is not None and state[2] >= count):
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"{stream_id}: frames not published")
+
+
+FULL = "".join(f"t{i} " for i in range(TOKENS))
+
+
+def test_mid_stream_drop_resumes_on_the_same_worker(store_path):
+    worker = Worker(store_path)
+    before = drop_after(worker.start("drop-same-0001"), 5)
+    after = list(worker.resumable.resume(event_id(before[-1])))
+    assert text(before + after) == FULL
+    assert worker.resumable.counts["local"] == 1
+
+
+def test_reconnect_on_another_worker_follows_the_shared_store(store_path):
+    a, b = Worker(store_path), Worker(store_path)
+    before = drop_after(a.start("drop-other-0001"), 5)
+    published(b, "drop-other-0001", 5)
+    resumed = b.resumable.resume(event_id(before[-1]))
+    assert resumed is not None
+    after = list(resumed)
+    assert text(before + after) == FULL
+    assert event_id(after[-1]) == f"drop-other-0001:{TOKENS}"
+    assert b.resumable.counts["shared"] == 1
+
+
+def test_reconnect_on_another_worker_after_the_answer_finished(store_path):
+    a, b = Worker(store_path), Worker(store_path)
+    before = drop_after(a.start("drop-done-0001", gap=0), 3)
+    published(b, "drop-done-0001")
+    assert text(before + list(b.resumable.resume(event_id(before[-1])))) == FULL
+
+
+def test_unknown_stream_is_not_resumable(store_path):
+    worker = Worker(store_path)
+    assert worker.resumable.resume("never-started-0001:3") is None
+    assert worker.resumable.counts["missing"] == 1
+
+
+def test_id_of_a_kept_recording_cannot_be_reused(store_path):
+    a, b = Worker(store_path), Worker(store_path)
+    stream_id = "taken-0001"
+    list(a.start(stream_id, gap=0))
+    published(b, stream_id)
+    assert not a.resumable.claim(stream_id)  # kept in this worker
+    assert not b.resumable.claim(stream_id)  # kept in the store
+    # The original recording is untouched and still resumable from either worker.
+    assert text(b.resumable.resume(f"{stream_id}:10")) == FULL[FULL.index("t10 "):]
+
+
+def test_id_is_free_again_once_the_recording_expired(store_path):
+    a, b = Worker(store_path, ttl=0.05), Worker(store_path, ttl=0.05)
+    list(a.start("expired-0001", gap=0))
+    time.sleep(0.1)
+    assert a.resumable.claim("expired-0001")
+    assert not b.resumable.claim("expired-0001")  # claimed again, by a
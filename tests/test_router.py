@@ -0,0 +1,109 @@
+"""app.route_agent against the substring scan it replaced, and the router's matching rules."""
+import os
+import random
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import app  # noqa: E402
+from bench_router import legacy_detect_agent  # noqa: E402
+from router import KeywordRouter  # noqa: E402
+
+CURATED = [
+    "How do I improve my executive presence?",
+    "I get anxiety before board meetings as a CEO",
+    "How should I handle conflict on my team?",
+    "What posture should I use on stage?",
+    "Help me write a persuasive pitch for the board",
+    "How do I stay calm and project gravitas?",
+    "Which Roman virtues matter for modern leaders?",
+    "How can I dress to build my personal brand?",
+    "What should my greeting and style be for a first impression?",
+    "How do I become a more compassionate listener?",
+    "Consult all mentors on my leadership transition",
+    "Can you write some Python code for me?",
+    "hello",
+    "ok",
+    "What is the weather today?",
+]
+
+# Substring false positives under the legacy scan, routed on whole words now.
+INTENDED_CHANGES = {
+    "Please review my request for feedback on the team offsite": "praxis",   # "eq" in "request"
+    "Somebody on my team keeps interrupting me": "praxis",                  # "body" in "somebody"
+    "I am hosting a dinner for my leadership team": "praxis",                # "inner" in "dinner"
+    "How do I decode what my manager means?": "praxis",                     # "code" in "decode"
+    # "moral" in "morale", "math" in "aftermath"; "manager" is what is left
+    "How do I keep morale up in the aftermath of layoffs as a manager?": "praxis",
+    "I want to develop my career as a leader": "praxis",                    # "care" in "career"
+}
+
+FILLER = ("how", "do", "i", "my", "the", "a", "with", "for", "board", "today", "help", "please",
+          "quarter", "plan", "we", "should", "when", "about", "next", "week", "really")
+
+
+def random_messages(count, seed=7):
+    keywords = sorted({w for words in app.ROUTER.groups.values() for w in words})
+    # Keywords that contain another keyword ("career" holds "care") may route
+    # differently by design; INTENDED_CHANGES covers them.
+    keywords = [k for k in keywords if not any(o != k and o in k for o in keywords)]
+    rng = random.Random(seed)
+    for _ in range(count):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(0, 8))]
+        words += [rng.choice(keywords) for _ in range(rng.randint(0, 3))]
+        rng.shuffle(words)
+        yield " ".join(words)
+
+
+@pytest.mark.parametrize("text", CURATED)
+def test_curated_messages_route_as_before(text):
+    assert app.route_agent(text) == legacy_detect_agent(text)
+
+
+@pytest.mark.parametrize("text, expected", INTENDED_CHANGES.items())
+def test_substring_false_positives_are_fixed(text, expected):
+    assert legacy_detect_agent(text) != expected
+    assert app.route_agent(text) == expected
+
+
+def test_random_keyword_messages_route_as_before():
+    mismatches = [text for text in random_messages(5000) if app.route_agent(text) != legacy_detect_agent(text)]
+    assert mismatches == []
+
+
+ROUTER = KeywordRouter({
+    "virtus": ["moral", "virtue", "care", "compassion", "emotion"],
+    "praxis": ["eq", "inner", "leader", "manage", "strategy", "body language", "executive presence"],
+})
+
+
+@pytest.mark.parametrize("text", [
+    "team morale is low",
+    "a virtual offsite",
+    "my career plan",
+    "a request for time off",
+    "a dinner with the board",
+    "emotionless",
+])
+def test_keywords_do_not_match_inside_other_words(text):
+    assert ROUTER.scan(text) == {}
+
+
+@pytest.mark.parametrize("text, group, keyword", [
+    ("our leaders met", "praxis", "leader"),
+    ("new to leadership", "praxis", "leader"),
+    ("managing upward", "praxis", "manage"),
+    ("my manager said", "praxis", "manage"),
+    ("two strategies", "praxis", "strategy"),
+    ("a compassionate boss", "virtus", "compassion"),
+    ("emotional, again", "virtus", "emotion"),
+    ("my eq is low", "praxis", "eq"),
+    ("reading body language", "praxis", "body language"),
+    ("“executive presence”", "praxis", "executive presence"),
+])
+def test_keywords_match_whole_words_and_inflections(text, group, keyword):
+    assert ROUTER.scan(text) == {group: [keyword]}
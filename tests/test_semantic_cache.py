@@ -0,0 +1,71 @@
+import pytest
+
+from semantic_cache import HASHING_THRESHOLD, HashingEmbedder, SemanticCache, compatible
+
+
+def cache(**kwargs):
+    return SemanticCache(HashingEmbedder(), **kwargs)
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Should I fire my cofounder?", "Should I not fire my cofounder?"),
+    ("Should I fire my cofounder?", "Shouldn't I fire my cofounder?"),
+    ("How do I manage a team of 10 people?", "How do I manage a team of 1000 people?"),
+    ("How do I manage a team of 1,000 people?", "How do I manage a team of 100 people?"),
+])
+def test_negation_and_number_mismatches_are_not_served(stored, asked):
+    assert not compatible(asked, stored)
+    loose = cache(threshold=0.5)  # well below what these pairs score
+    loose.store("eidos", "gpt-4o", stored, "the stored answer")
+    assert loose.lookup("eidos", "gpt-4o", asked) is None
+    assert loose.stats()["guarded"] == 1
+
+
+def test_guard_falls_through_to_the_next_nearest_question():
+    loose = cache(threshold=0.5)
+    loose.store("eidos", "gpt-4o", "Should I fire my cofounder?", "fire")
+    loose.store("eidos", "gpt-4o", "Should I never fire my cofounder?", "keep")
+    assert loose.lookup("eidos", "gpt-4o", "Should I not fire my cofounder?") == "keep"
+    assert loose.lookup("eidos", "gpt-4o", "should i fire my cofounder") == "fire"
+
+
+@pytest.mark.parametrize("asked", [
+    "how do i project authority in meetings",
+    "In meetings, how can I project authority?",
+])
+def test_rewordings_hit_at_the_hashing_default(asked):
+    strict = cache()
+    assert strict.threshold == HASHING_THRESHOLD
+    strict.store("gravis", "gpt-4o", "How do I project authority in meetings?", "answer")
+    assert strict.lookup("gravis", "gpt-4o", asked) == "answer"
+
+
+@pytest.mark.parametrize("asked", [
+    "How can I appear more authoritative",
+    "ways to convey authority",
+])
+def test_paraphrases_within_the_lexicon_hit_at_the_hashing_default(asked):
+    strict = cache()
+    strict.store("gravis", "gpt-4o", "How to project authority", "answer")
+    assert strict.lookup("gravis", "gpt-4o", asked) == "answer"
+    assert strict.lookup("gravis", "gpt-4o", "How can I not appear more authoritative") is None
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("How do I improve my executive presence?", "How do I improve my public speaking?"),
+    ("How do I give feedback to my boss?", "How do I give feedback to my team?"),
+    ("How do I negotiate my salary?", "How do I negotiate a raise?"),
+])
+def test_different_questions_miss_at_the_hashing_default(stored, asked):
+    strict = cache()
+    strict.store("gravis", "gpt-4o", stored, "answer")
+    assert strict.lookup("gravis", "gpt-4o", asked) is None
+
+
+def test_threshold_defaults_by_embedder(monkeypatch):
+    monkeypatch.setenv("SEMANTIC_CACHE", "true")
+    monkeypatch.delenv("SEMANTIC_CACHE_MODEL", raising=False)
+    monkeypatch.delenv("SEMANTIC_CACHE_THRESHOLD", raising=False)
+    assert SemanticCache.from_env().threshold == HASHING_THRESHOLD
+    monkeypatch.setenv("SEMANTIC_CACHE_THRESHOLD", "0.9")
+    assert SemanticCache.from_env().threshold == 0.9
@@ -0,0 +1,73 @@
+"""Identical Senate prompts share one flight: the council's mentor calls as well as the synthesis."""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+from conftest import ROOT
+from sse import EventParser
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fake_provider  # noqa: E402
+from bench_ttft import start_server  # noqa: E402
+
+PROVIDER_PORT = 8950
+PORTS = {"wsgi": 8951, "asgi": 8952}
+QUESTION = "Consult all mentors: how do I lead my team through a painful restructuring?"
+CLIENTS = 6
+MEMBERS = 4
+
+
+@pytest.fixture(scope="module")
+def provider():
+    proc = fake_provider.spawn(PROVIDER_PORT, ttft=0.3, tps=40, tokens=40)
+    yield httpx.Client(base_url=f"http://127.0.0.1:{PROVIDER_PORT}", timeout=10)
+    proc.terminate()
+    proc.wait()
+
+
+@pytest.fixture(params=["wsgi", "asgi"])
+def server(request, provider):
+    env = {"ASSETS": "false", "HTTP_WARMUP": "0", "SINGLE_FLIGHT": "true", "SENATE_MEMBERS": str(MEMBERS),
+           "RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false"}
+    proc, _ = start_server(request.param, PORTS[request.param], PROVIDER_PORT, env)
+    try:
+        yield f"http://127.0.0.1:{PORTS[request.param]}/api/chat"
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+async def ask(client, url, delay):
+    """(progress stages, answer) of one Senate request sent after `delay` seconds."""
+    await asyncio.sleep(delay)
+    parser, stages, parts = EventParser(), [], []
+    body = {"messages": [{"role": "user", "content": QUESTION}]}
+    async with client.stream("POST", url, json=body, timeout=30) as resp:
+        assert resp.status_code == 200
+        async for chunk in resp.aiter_bytes():
+            for event in parser.feed(chunk):
+                if event.event == "progress":
+                    stages.append(event.data)
+                else:
+                    parts.append(event.data)
+    return stages, "".join(parts)
+
+
+async def burst(url):
+    async with httpx.AsyncClient() as client:
+        return await asyncio.gather(*(ask(client, url, 0.05 * i) for i in range(CLIENTS)))
+
+
+def test_identical_senate_prompts_share_the_council(server, provider):
+    before = provider.get("/control").json()["requests"]
+    results = asyncio.run(burst(server))
+    # One call per mentor and one synthesis, however many clients asked.
+    assert provider.get("/control").json()["requests"] - before == MEMBERS + 1
+    stages, answer = results[0]
+    assert answer and not answer.startswith("[Error]")
+    assert len(stages) == MEMBERS + 2  # council, a perspective per mentor, synthesis
+    assert all(result == (stages, answer) for result in results)
@@ -0,0 +1,78 @@
+"""Stopping an answer in conversation mode, under gunicorn (Flask) and uvicorn (asgi.py).
+
+The client keeps the part of a stopped answer it was shown, reading the
+stream to its end (static/app.js); the server-side conversation must end
+with that same answer, or the next turn sent by id would not include it.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+import httpx
+import pytest
+
+from conftest import ROOT
+from sse import EventParser
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fake_provider  # noqa: E402
+from bench_ttft import start_server  # noqa: E402
+
+PROVIDER_PORT = 8945
+PORTS = {"wsgi": 8946, "asgi": 8947}
+QUESTION = "How do I lead my team through a reorganisation?"
+
+
+@pytest.fixture(scope="module")
+def provider():
+    proc = fake_provider.spawn(PROVIDER_PORT, ttft=0.05, tps=40, tokens=200)
+    yield
+    proc.terminate()
+    proc.wait()
+
+
+@pytest.fixture(params=[("wsgi", False), ("asgi", False), ("wsgi", True), ("asgi", True)],
+                ids=["wsgi", "asgi", "wsgi-resumable", "asgi-resumable"])
+def server(request, provider):
+    mode, resumable = request.param
+    with tempfile.TemporaryDirectory(prefix="gravitas-test-") as tmp:
+        db = os.path.join(tmp, "conversations.db")
+        env = {"ASSETS": "false", "HTTP_WARMUP": "0", "CONVERSATION_DB": db, "RESUMABLE_STREAMS": str(resumable).lower(),
+               "RESPONSE_CACHE": "false", "SEMANTIC_CACHE": "false", "SINGLE_FLIGHT": "false"}
+        proc, _ = start_server(mode, PORTS[mode], PROVIDER_PORT, env)
+        try:
+            yield f"http://127.0.0.1:{PORTS[mode]}", db
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def stored(db, conversation_id):
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq",
+                            (conversation_id,)).fetchall()
+
+
+def test_stopped_answer_is_kept_in_the_conversation(server):
+    base, db = server
+    parser, shown = EventParser(), []
+    with httpx.Client(base_url=base, timeout=10) as client:
+        body = {"conversation": True, "messages": [{"role": "user", "content": QUESTION}],
+                "stream_id": "test-stop-history-0001"}
+        with client.stream("POST", "/api/chat", json=body) as resp:
+            assert resp.status_code == 200
+            conversation_id = resp.headers["x-conversation-id"]
+            stream_id = resp.headers["x-stream-id"]
+            chunks = resp.iter_bytes()
+            while len(shown) < 5:
+                shown += [e.data for e in parser.feed(next(chunks)) if e.event == "message"]
+            assert client.post(f"/api/chat/{stream_id}/stop").status_code == 200
+            for chunk in chunks:  # read to the end, as the browser does
+                shown += [e.data for e in parser.feed(chunk) if e.event == "message"]
+
+    answer = "".join(shown)
+    assert not answer.startswith("[Error]")
+    assert len(shown) < 150  # stopped, not completed
+    assert stored(db, conversation_id) == [("user", QUESTION), ("assistant", answer)]